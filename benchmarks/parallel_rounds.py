@@ -0,0 +1,86 @@
+"""
+Time per synchronous round of a gradient + collection program on a mobile deformed lattice, run sequentially and
+with `ParallelRounds` on a growing number of worker processes (every node moves a little before each round, so the
+partitions are updated every round).
+Usage: python benchmarks/parallel_rounds.py [side] [rounds]
+"""
+import os
+import random
+import sys
+import time
+
+from fieldpy.calculus import aggregate, neighbors_distances
+from fieldpy.libraries.collect import count_nodes
+from fieldpy.libraries.diffusion import distance_to
+from fieldpy.simulator import Simulator
+from fieldpy.simulator.deployments import deformed_lattice
+from fieldpy.simulator.neighborhood import radius_neighborhood
+from fieldpy.simulator.parallel import ParallelRounds
+from fieldpy.simulator.runner import run_round
+
+
+@aggregate
+def gradient_count(context):
+    distances = neighbors_distances(context.position)
+    distance = distance_to(context.data["source"], distances)
+    return distance, count_nodes(context, distance)
+
+
+def build(side: int) -> Simulator:
+    random.seed(1)
+    simulator = Simulator()
+    simulator.environment.set_neighborhood_function(radius_neighborhood(0.15))
+    deformed_lattice(simulator, side, side, 0.1, 0.01)
+    for node in simulator.environment.nodes.values():
+        node.data = {"source": node.id == 0}
+    return simulator
+
+
+def move(simulator: Simulator, rng: random.Random):
+    environment = simulator.environment
+    for node in environment.nodes.values():
+        x, y = node.position
+        node.position = (x + rng.uniform(-0.01, 0.01), y + rng.uniform(-0.01, 0.01))
+    environment.nodes_updated(environment.nodes.values())
+
+
+def sequential_round(environment):
+    previous = {id: node.data.get("messages", {}) for id, node in environment.nodes.items()}
+    for node in environment.node_list():
+        run_round(node, {n.id: previous[n.id] for n in environment.get_neighbors(node)}, gradient_count)
+
+
+def sequential(side: int, rounds: int) -> float:
+    simulator = build(side)
+    rng = random.Random(2)
+    # the same warm-up round as the parallel runs (state created, neighbor lists cached)
+    sequential_round(simulator.environment)
+    start = time.perf_counter()
+    for _ in range(rounds):
+        sequential_round(simulator.environment)
+        move(simulator, rng)
+    return (time.perf_counter() - start) / rounds
+
+
+def parallel(side: int, rounds: int, workers: int) -> float:
+    simulator = build(side)
+    rng = random.Random(2)
+    with ParallelRounds(gradient_count, workers=workers) as parallel_rounds:
+        # the first round starts the workers (a warm-up round, as for the sequential runs)
+        parallel_rounds.round(simulator.environment)
+        start = time.perf_counter()
+        for _ in range(rounds):
+            parallel_rounds.round(simulator.environment)
+            move(simulator, rng)
+        return (time.perf_counter() - start) / rounds
+
+
+if __name__ == "__main__":
+    side = int(sys.argv[1]) if len(sys.argv) > 1 else 40
+    rounds = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    print(f"{side * side} nodes, {os.cpu_count()} CPUs")
+    reference = sequential(side, rounds) * 1e3
+    print(f"{'sequential':>12} {reference:>9.1f} ms/round")
+    for workers in (1, 2, 4, 8):
+        elapsed = parallel(side, rounds, workers) * 1e3
+        print(f"{workers:>4} workers {elapsed:>9.1f} ms/round {reference / elapsed:>6.2f}x")
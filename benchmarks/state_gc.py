@@ -0,0 +1,40 @@
+"""
+Per-round cost of the state kept by `MutableEngine` for programs with many `remember` slots.
+Each round runs `setup` (with the state of the previous round), the program and `cooldown`, like
+`fieldpy.simulator.runner.aggregate_program_runner` does for a single device.
+Usage: python benchmarks/state_gc.py [rounds]
+"""
+import sys
+import time
+
+from fieldpy import engine
+from fieldpy.calculus import aggregate, remember
+
+
+@aggregate
+def slots(count: int, changing: bool, round: int):
+    for _ in range(count):
+        remember(0).update_fn(lambda x: x + 1)
+    if changing and round % 2 == 0:
+        # a branch taken every other round: its slot is dropped by the rounds that skip it
+        remember(0).update_fn(lambda x: x + 1)
+
+
+def per_round(count: int, rounds: int, changing: bool) -> float:
+    state = {}
+    start = time.perf_counter()
+    for round in range(rounds):
+        engine.setup({}, 0, state)
+        slots(count, changing, round)
+        engine.cooldown()
+        state = engine.state
+    return (time.perf_counter() - start) / rounds
+
+
+if __name__ == "__main__":
+    rounds = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    print(f"{'slots':>6} {'steady (us/round)':>18} {'changing (us/round)':>20}")
+    for count in (100, 300, 1000):
+        steady = per_round(count, rounds, False) * 1e6
+        changing = per_round(count, rounds, True) * 1e6
+        print(f"{count:>6} {steady:>18.1f} {changing:>20.1f}")
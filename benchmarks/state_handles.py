@@ -0,0 +1,44 @@
+"""
+Per-round cost of `remember` slots kept as `State` proxies or as `StateHandle`s (`remember(init, handle=True)`):
+each slot is created, read by an operation and updated every round, like `distance_to` and `counter` do.
+Usage: python benchmarks/state_handles.py [rounds]
+"""
+import sys
+import time
+
+from fieldpy import engine
+from fieldpy.calculus import aggregate, remember
+
+
+@aggregate
+def proxies(count: int):
+    for _ in range(count):
+        state = remember(0.0)
+        state.update(min(state + 1.0, 1e9))
+
+
+@aggregate
+def handles(count: int):
+    for _ in range(count):
+        state = remember(0.0, handle=True)
+        state.update(min(state.value + 1.0, 1e9))
+
+
+def per_round(program, count: int, rounds: int) -> float:
+    state = {}
+    start = time.perf_counter()
+    for _ in range(rounds):
+        engine.setup({}, 0, state)
+        program(count)
+        engine.cooldown()
+        state = engine.state
+    return (time.perf_counter() - start) / rounds
+
+
+if __name__ == "__main__":
+    rounds = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    print(f"{'slots':>6} {'State (us/round)':>17} {'StateHandle (us/round)':>23} {'speedup':>8}")
+    for count in (10, 100, 1000):
+        proxy = per_round(proxies, count, rounds) * 1e6
+        handle = per_round(handles, count, rounds) * 1e6
+        print(f"{count:>6} {proxy:>17.1f} {handle:>23.1f} {proxy / handle:>8.2f}")
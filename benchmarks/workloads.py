@@ -0,0 +1,188 @@
+"""
+Canonical aggregate workloads at scale: gradient (`distance_to`), broadcast (`cast_from`), collection
+(`count_nodes`) and leader election (`elect_leader`), on `grid_generation`, `deformed_lattice` or
+`random_in_circle` deployments with a `radius_neighborhood` or `k_nearest_neighbors`, swept over the node count,
+the density (mean neighbors per node) and the number of rounds.
+Every case runs in a fresh process (so that its peak memory is its own) with `Simulator.schedule_rounds`, and
+reports rounds/sec, the latency per node-round, the peak resident memory and the rounds to convergence (the first
+round after which no result changes anymore, null if the results still change in the last round).
+The results are printed (or written with --output) as JSON; --compare prints the speedup against a previous file.
+Usage: python benchmarks/workloads.py --nodes 100 400 1600 --density 8 --rounds 50 --output results.json
+"""
+import argparse
+import itertools
+import json
+import math
+import multiprocessing
+import platform
+import random
+import resource
+import subprocess
+import sys
+import time
+from typing import Any, Dict, List
+
+from fieldpy.calculus import aggregate, neighbors_distances
+from fieldpy.libraries.collect import count_nodes
+from fieldpy.libraries.diffusion import distance_to, cast_from
+from fieldpy.libraries.leader_election import elect_leader
+from fieldpy.simulator import Simulator
+from fieldpy.simulator.deployments import grid_generation, deformed_lattice, random_in_circle
+from fieldpy.simulator.neighborhood import radius_neighborhood, k_nearest_neighbors
+
+# the range of the leader election, in communication radii
+LEADER_AREA = 4.0
+
+
+@aggregate
+def gradient(context):
+    return distance_to(context.data["source"], neighbors_distances(context.position))
+
+
+@aggregate
+def broadcast(context):
+    return cast_from(context.data["source"], context.id, neighbors_distances(context.position))
+
+
+@aggregate
+def count(context):
+    return count_nodes(context, distance_to(context.data["source"], neighbors_distances(context.position)))
+
+
+@aggregate
+def leader(context):
+    return elect_leader(context, context.data["area"], neighbors_distances(context.position))
+
+
+WORKLOADS = {"gradient": gradient, "broadcast": broadcast, "count": count, "leader": leader}
+DEPLOYMENTS = ("grid", "lattice", "circle")
+NEIGHBORHOODS = ("radius", "knn")
+
+
+def deploy(simulator: Simulator, deployment: str, nodes: int) -> float:
+    """Deploy the nodes, returning the area they cover"""
+    side = math.ceil(math.sqrt(nodes))
+    if deployment == "grid":
+        grid_generation(simulator, side, math.ceil(nodes / side), 1.0)
+        return float(side * math.ceil(nodes / side))
+    if deployment == "lattice":
+        deformed_lattice(simulator, side, math.ceil(nodes / side), 1.0, 0.2)
+        return float(side * math.ceil(nodes / side))
+    random_in_circle(simulator, nodes, 1.0)
+    return math.pi
+
+
+def run_case(case: Dict[str, Any]) -> Dict[str, Any]:
+    """Run a case (in the current process) and return its measures"""
+    random.seed(case["seed"])
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    simulator = Simulator()
+    area = deploy(simulator, case["deployment"], case["nodes"])
+    nodes = simulator.environment.node_list()
+    # the radius that gives `density` neighbors per node on average (the mean k-th neighbor distance for knn)
+    radius = math.sqrt(case["density"] * area / (math.pi * len(nodes)))
+    if case["neighborhood"] == "radius":
+        simulator.environment.set_neighborhood_function(radius_neighborhood(radius))
+    else:
+        simulator.environment.set_neighborhood_function(k_nearest_neighbors(int(case["density"])))
+    for node in nodes:
+        node.data = {"source": node.id == 0, "area": LEADER_AREA * radius}
+    neighbors = sum(len(simulator.environment.get_neighbors(node)) for node in nodes) / len(nodes)
+
+    changed: List[int] = []
+    previous: Dict[Any, Any] = {}
+    observing = [0.0]
+
+    def observe(round: int):
+        start = time.perf_counter()
+        current = {node.id: node.data.get("result") for node in nodes}
+        if current != previous:
+            changed.append(round)
+            previous.clear()
+            previous.update(current)
+        observing[0] += time.perf_counter() - start
+
+    rounds = case["rounds"]
+    # synchronous rounds: the convergence does not depend on the order of the nodes in a round
+    simulator.schedule_rounds(WORKLOADS[case["workload"]], 1.0, synchronous=True)
+    for round in range(1, rounds + 1):
+        simulator.schedule_event(round - 0.5, observe, round)
+    start = time.perf_counter()
+    simulator.run(rounds - 0.5)
+    seconds = time.perf_counter() - start - observing[0]
+    last_change = changed[-1] if changed else 0
+    return dict(case,
+                deployed_nodes=len(nodes),
+                mean_neighbors=neighbors,
+                seconds=seconds,
+                rounds_per_second=rounds / seconds,
+                node_round_us=seconds / (rounds * len(nodes)) * 1e6,
+                peak_rss_mb=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+                baseline_rss_mb=baseline / 1024,
+                rounds_to_convergence=last_change if last_change < rounds else None)
+
+
+def _run_isolated(case: Dict[str, Any]) -> Dict[str, Any]:
+    with multiprocessing.get_context("spawn").Pool(1) as pool:
+        return pool.apply(run_case, (case,))
+
+
+def key(result: Dict[str, Any]) -> str:
+    return "/".join(str(result[name]) for name in ("workload", "deployment", "neighborhood", "nodes", "density",
+                                                   "rounds"))
+
+
+def metadata() -> Dict[str, Any]:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {"commit": commit, "python": platform.python_version(), "platform": platform.platform(),
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S")}
+
+
+def compare(baseline: Dict[str, Any], current: Dict[str, Any]):
+    previous = {key(result): result for result in baseline["results"]}
+    print(f"{'case':<50}{'before r/s':>12}{'after r/s':>12}{'speedup':>9}")
+    for result in current["results"]:
+        before = previous.get(key(result))
+        if before is not None:
+            print(f"{key(result):<50}{before['rounds_per_second']:>12.2f}{result['rounds_per_second']:>12.2f}"
+                  f"{result['rounds_per_second'] / before['rounds_per_second']:>9.2f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workloads", nargs="+", choices=list(WORKLOADS), default=list(WORKLOADS))
+    parser.add_argument("--deployments", nargs="+", choices=DEPLOYMENTS, default=["lattice"])
+    parser.add_argument("--neighborhoods", nargs="+", choices=NEIGHBORHOODS, default=["radius"])
+    parser.add_argument("--nodes", nargs="+", type=int, default=[100, 400, 1600])
+    parser.add_argument("--density", nargs="+", type=float, default=[8.0])
+    parser.add_argument("--rounds", nargs="+", type=int, default=[50])
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="write the JSON results to this file instead of printing them")
+    parser.add_argument("--compare", help="a previous JSON result file to compare against")
+    parser.add_argument("--in-process", action="store_true", help="run the cases in this process (faster, but the "
+                                                                   "peak memory is the one of the whole sweep)")
+    arguments = parser.parse_args()
+    cases = [dict(workload=workload, deployment=deployment, neighborhood=neighborhood, nodes=nodes, density=density,
+                  rounds=rounds, seed=arguments.seed)
+             for workload, deployment, neighborhood, nodes, density, rounds in itertools.product(
+                 arguments.workloads, arguments.deployments, arguments.neighborhoods, arguments.nodes,
+                 arguments.density, arguments.rounds)]
+    results = []
+    for case in cases:
+        result = run_case(case) if arguments.in_process else _run_isolated(case)
+        print(f"{key(result)}: {result['rounds_per_second']:.2f} rounds/s, {result['node_round_us']:.1f} us/node-round,"
+              f" converged after {result['rounds_to_convergence']}", file=sys.stderr)
+        results.append(result)
+    report = {"meta": metadata(), "results": results}
+    if arguments.output:
+        with open(arguments.output, "w") as output:
+            json.dump(report, output, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    if arguments.compare:
+        with open(arguments.compare) as baseline:
+            compare(json.load(baseline), report)
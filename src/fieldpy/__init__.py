@@ -13,6 +13,16 @@ In order to use it, you should:
 1. Call `engine.setup(messages, id, state)` to initialize the engine with the current context.
 2. Call an aggregate script 
 3. Call `engine.cooldown()` to reset the engine state and get the messages to send.
-4. Store the state for the next iteration.
+4. Store the state (`engine.state`) for the next iteration: passing it back to `setup` reuses it without copies.
+A synchronous round of every device at once can instead run on a `fieldpy.internal.batch.BatchEngine`
+(see `fieldpy.simulator.runner.batch_program_runner`), or be split across worker processes
+(see `fieldpy.simulator.parallel.parallel_program_runner`).
+Setting `engine.codec` to a `fieldpy.internal.codec.MessageCodec` makes `cooldown` return the messages as compact
+(optionally delta-encoded) bytes, which `setup` decodes.
+On real devices, `fieldpy.device.DeviceRuntime` runs the rounds on its own engine and exchanges them over UDP.
+Programs decorated with `fieldpy.calculus.compiled` replay the alignment of their previous round (see `engine.trace`).
+The aggregate functions run on the engine of the current thread or asyncio task: `fieldpy.calculus.use_engine`
+sets another one for a block, so threads can run programs at once, each on its own engine (see
+`fieldpy.simulator.runner.threaded_program_runner`).
 """
 engine = MutableEngine()
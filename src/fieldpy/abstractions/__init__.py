@@ -1,3 +1,4 @@
+import random
 from abc import ABC
 
 
@@ -21,6 +22,7 @@ class Engine(ABC):
     def enter(self, name: str) -> None:
         """
         Enter a new context.
+        Engines may expose the key of the current path as `path`: it can be passed wherever a stack is expected.
         :param name: The name of the context.
         """
         pass
@@ -41,6 +43,19 @@ class Engine(ABC):
         """
         pass
 
+    def init_state(self, default: any, stack: list[str]) -> any:
+        """
+        Read the state of the engine, initializing it with `default` when there is none.
+        :param default: The value to write when the state is missing.
+        :param stack: The stack of the engine.
+        :return: The value of the state.
+        """
+        value = self.read_state(stack)
+        if value is None:
+            self.write_state(default, stack)
+            return default
+        return value
+
     def exit(self) -> None:
         """
         Exit the current context.
@@ -68,6 +83,32 @@ class Engine(ABC):
         :return: The aligned values.
         """
         pass
+
+    def field(self, value: any) -> any:
+        """
+        Build the field of the values aligned with the current path, including the local `value`.
+        :param value: The local value.
+        :return: The field of the aligned values.
+        """
+        pass
+
+    def mux(self, condition: any, then: any, otherwise: any) -> any:
+        """
+        Choose between two already computed values.
+        :param condition: The condition.
+        :param then: The value returned when the condition holds.
+        :param otherwise: The value returned when the condition does not hold.
+        :return: The chosen value.
+        """
+        return then if condition else otherwise
+
+    def random_uniform(self) -> any:
+        """
+        Draw a uniform random number in [0, 1) for the current device.
+        :return: The random number.
+        """
+        return random.random()
+
     def cooldown(self) -> None:
         """
         Cooldown the engine.
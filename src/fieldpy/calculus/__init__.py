@@ -7,8 +7,95 @@ with align("name"):
     # do something
 ```
 """
+import functools
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+import numpy as np
+
 from fieldpy import engine
-from fieldpy.data import State, Field
+from fieldpy.abstractions import Engine
+from fieldpy.data import State, StateHandle, Field, COMPACT_MIN_SIZE
+
+
+# the engine of the current thread or asyncio task: the one set with `use_engine`, `fieldpy.engine` elsewhere
+current_engine: ContextVar = ContextVar("engine", default=engine)
+_current = current_engine.get
+
+
+class ContextEngine(object):
+    """
+    The engine of the current context: every attribute is the one of the engine set with `use_engine` in the
+    current thread or asyncio task (or of `fieldpy.engine`, where none is set).
+    """
+    __slots__ = ()
+
+    def __getattr__(self, name: str):
+        return getattr(_current(), name)
+
+    # the operations of every aggregate call, without the failed lookup that precedes `__getattr__`
+    @property
+    def path(self):
+        return _current().path
+
+    def enter(self, name: str) -> None:
+        _current().enter(name)
+
+    def exit(self) -> None:
+        _current().exit()
+
+    def send(self, data) -> None:
+        _current().send(data)
+
+    def field(self, value):
+        return _current().field(value)
+
+    def __setattr__(self, name: str, value):
+        setattr(_current(), name, value)
+
+
+# the engine of the aggregate functions (threads and asyncio tasks run programs concurrently, each on its own)
+engine = ContextEngine()
+
+
+@contextmanager
+def use_engine(current: Engine):
+    """
+    Run the aggregate functions called in the block on another engine (e.g. a `BatchEngine`):
+    ```python
+    with use_engine(batch_engine):
+        program(context)
+    ```
+    Only the current thread or asyncio task uses it: the other ones keep their own engine.
+    """
+    token = current_engine.set(current)
+    try:
+        yield current
+    finally:
+        current_engine.reset(token)
+
+
+# the profiler of the aggregate functions (a `fieldpy.profiling.Profiler`), None when profiling is disabled
+profiler = None
+
+
+@contextmanager
+def profiling(current):
+    """
+    Profile the aggregate functions called (and the rounds run by the simulator runners) in the block:
+    ```python
+    with profiling(Profiler()) as profiler:
+        simulator.run(100)
+    print(profiler.report())
+    ```
+    """
+    global profiler
+    previous = profiler
+    profiler = current
+    try:
+        yield current
+    finally:
+        profiler = previous
 
 
 class AlignContext:
@@ -17,11 +104,11 @@ class AlignContext:
         pass
 
     def __enter__(self):
-        engine.enter(self.name)
+        _current().enter(self.name)
         return self
 
     def __exit__(self, exception_type, exception_value, traceback):
-        engine.exit()
+        _current().exit()
 
 def align(name: str):
     return AlignContext(name)
@@ -38,10 +125,59 @@ def my_function():
     return result
 """
 def aggregate(func):
+    name = func.__name__
+
+    @functools.wraps(func)
     def wrapper(*args, **kwargs):
-        engine.enter(func.__name__)
+        current = _current()
+        if profiler is not None:
+            return profiler.call(current, name, func, args, kwargs)
+        current.enter(name)
         result = func(*args, **kwargs)
-        engine.exit()
+        current.exit()
+        return result
+    return wrapper
+
+# the distinct tapes a compiled program keeps (it forgets them all when it has more, e.g. with data-dependent loops)
+MAX_TAPES = 64
+
+def compiled(program):
+    """
+    Opt-in tracing of a program whose alignment rarely changes from round to round:
+    ```python
+    @compiled
+    @aggregate
+    def main(context):
+        ...
+    ```
+    The first round of a device records the aggregate functions it enters (a `fieldpy.internal.Tape`, with the
+    key of every path), and the next ones replay it: entering a function only checks its name against the tape and
+    moves the engine to the precomputed path, without building the path. When a device takes another branch, the
+    engine rebuilds the path where it left the tape and records the rest of the round, which becomes the tape of
+    its next round. Devices without a tape start from the last one recorded (usually the one of every device).
+    On engines that cannot trace (or when called inside another program), the program runs as it is.
+    """
+    # device id -> tape of its last round; names -> tape, to share the tapes of the devices
+    tapes = {}
+    known = {}
+    last = [None]
+
+    @functools.wraps(program)
+    def wrapper(context, *args, **kwargs):
+        current = _current()
+        trace = getattr(current, "trace", None)
+        id = current.id
+        if trace is None or not trace(tapes.get(id, last[0])):
+            return program(context, *args, **kwargs)
+        try:
+            result = program(context, *args, **kwargs)
+        finally:
+            tape = current.untrace()
+        if tape is not tapes.get(id):
+            if len(known) >= MAX_TAPES:
+                known.clear()
+            tape = known.setdefault(tape.names, tape)
+        tapes[id] = last[0] = tape
         return result
     return wrapper
 
@@ -50,23 +186,50 @@ Core syntax
 """
 
 @aggregate
-def remember(init):
-    return State(init, engine.stack, engine)
+def remember(init, handle=False):
+    """
+    The state of the device at this point of the program, `init` in its first round.
+    :param handle: Return a `StateHandle` (read with `.value`, updates return the new value) instead of a `State`
+    proxy, which is slower to create and to operate on. The bundled libraries (`distance_to`, `collect_with`,
+    `elect_leader`, ...) take a `handle` flag too, and then return plain values instead of `State`s.
+    """
+    current = _current()
+    if handle:
+        return StateHandle(init, current.path, current)
+    return State(init, current.path, current)
 
 @aggregate
 def neighbors(value):
-    engine.send(value)
-    values = engine.aligned_values(engine.stack)
-    values[engine.id] = value
-    return Field(values, engine)
+    current = _current()
+    current.send(value)
+    return current.field(value)
+
+def mux(condition, then, otherwise):
+    """
+    Choose between two already computed values: `then` where the condition holds, `otherwise` elsewhere.
+    Unlike an `if` statement, it also works pointwise on the columns of a batched round.
+    """
+    return _current().mux(condition, then, otherwise)
+
+def random_uniform():
+    """
+    A uniform random number in [0, 1) for each device.
+    """
+    return _current().random_uniform()
 
 @aggregate
 def neighbors_distances(position):
     positions = neighbors(position)
+    if not isinstance(positions, Field):
+        # batched round: the position is a column per coordinate, the distances are computed for all the devices
+        x, y = position
+        return ((positions[0] - x) ** 2 + (positions[1] - y) ** 2) ** 0.5
     x, y = position
     distances = {}
     for id, pos in positions.data.items():
         # pos are x, y tuples
         n_x, n_y = pos
         distances[id] = ((x - n_x) ** 2 + (y - n_y) ** 2) ** 0.5
-    return Field(distances, engine)
\ No newline at end of file
+    if len(distances) >= COMPACT_MIN_SIZE:
+        return Field.from_arrays(list(distances), np.fromiter(distances.values(), dtype=float), _current())
+    return Field(distances, _current())
@@ -2,53 +2,337 @@
 """
 Internal state class used to manage the state of the system (namely `rep` of field calculus).
 """
-from typing import Any, Dict, Optional, List
+from functools import reduce
+from operator import itemgetter
+from typing import Any, Dict, Optional, List, Union
 from fieldpy.abstractions import Engine
+import numpy as np
 import wrapt
 
+# Python types stored in compact fields, with the kind of the NumPy buffer holding them.
+# Integers stay in dictionaries: Python integers never overflow, int64 buffers would.
+_NUMERIC_KINDS = {float: "f", bool: "b"}
+# smallest field stored in compact form: below it NumPy call overhead outweighs the vectorized operations
+COMPACT_MIN_SIZE = 16
+# scalar operands accepted by the vectorized operators, by buffer kind
+_SCALARS = {"f": (float, int), "b": (bool,)}
+
 """
 Field class used to manage the interactions of between nodes (namely `nbr` of field calculus).
 """
 class Field(object):
+    """
+    A field is stored either as a dictionary (id -> value, sorted by id), or, for numeric values, in a compact
+    form: a sorted list of ids, a NumPy buffer of values and an optional mask of the entries that belong to
+    the field. Operations between compact fields over the same ids are vectorized; any other case goes through
+    the dictionary form.
+    Fields built by the engine start as lazy views over the received messages: operators applied to a view are
+    recorded and fused, and the field is materialized (sorted, and compact when possible) in a single pass the
+    first time its entries are needed.
+    """
     def __init__(self, data: Dict[int, Any], engine: Engine) -> None:
-        self.data = dict(sorted(data.items()))
+        self._data: Optional[Dict[int, Any]] = dict(sorted(data.items()))
+        self._ids: Optional[List[int]] = None
+        self._values: Optional[np.ndarray] = None
+        self._mask: Optional[np.ndarray] = None
+        self._view: Optional[tuple] = None
         self._iter_index: Optional[int] = None
-        self._iter_keys: Optional[List[int]] = None
+        self._iter_values: Optional[List[Any]] = None
         self.engine = engine
 
-    def __iter__(self) -> 'Field':
-        self._iter_index = -1  # -1 represents the local value
-        self._iter_keys = sorted(self.data.keys())
-        return self
+    @classmethod
+    def from_arrays(cls, ids: List[int], values: np.ndarray, engine: Engine,
+                    mask: Optional[np.ndarray] = None) -> 'Field':
+        """
+        Build a compact field.
+        :param ids: The sorted ids of the entries.
+        :param values: The numeric values, aligned with the ids (`data` gives them back as Python values of the type
+        of the buffer, so they must all have that type).
+        :param engine: The engine of the field.
+        :param mask: The entries that belong to the field (None meaning all of them).
+        """
+        field = cls.__new__(cls)
+        field._data = None
+        field._ids = ids
+        field._values = values
+        field._mask = mask
+        field._view = None
+        field._iter_index = None
+        field._iter_values = None
+        field.engine = engine
+        return field
+
+    @classmethod
+    def view(cls, aligned: Dict[int, Any], id: int, value: Any, engine: Engine) -> 'Field':
+        """
+        Build a lazy field over the values received from the neighbors.
+        :param aligned: The aligned values of the neighbors (id -> value), read but never modified.
+        :param id: The id of the local device.
+        :param value: The local value (a state is read now, later updates do not change the field).
+        :param engine: The engine of the field.
+        """
+        field = cls.from_arrays(None, None, engine)
+        if isinstance(value, STATES):
+            value = value.value
+        # received values, local id, local value, pending operations (op, operand, kinds), self excluded
+        field._view = (aligned, id, value, (), False)
+        return field
+
+    def _derive(self, operation: Optional[tuple] = None, exclude_self: bool = False) -> 'Field':
+        aligned, id, value, operations, excluded = self._view
+        field = Field.from_arrays(None, None, self.engine)
+        field._view = (aligned, id, value, operations + (operation,) if operation else operations,
+                       excluded or exclude_self)
+        return field
+
+    def _materialize(self) -> None:
+        aligned, own, value, operations, excluded = self._view
+        self._view = None
+        ids = sorted({*aligned, own})
+        kind = _NUMERIC_KINDS.get(value.__class__)
+        if kind is not None and len(ids) >= COMPACT_MIN_SIZE:
+            entries = [value if k == own else aligned[k] for k in ids]
+            # only when every value has the type of the local one: a buffer would convert the others (e.g. the
+            # integers among floats), and `data` would not give them back as they were received
+            cls = value.__class__
+            if all(entry.__class__ is cls for entry in entries):
+                values = np.array(entries)
+                mask = None
+                if excluded:
+                    mask = np.ones(len(ids), dtype=bool)
+                    mask[ids.index(own)] = False
+                result = Field.from_arrays(ids, values, self.engine, mask)
+                for op, operand, kinds in operations:
+                    result = result._apply_binary_op(operand, op, kinds)
+                self._data, self._ids, self._values, self._mask = \
+                    result._data, result._ids, result._values, result._mask
+                return
+        data = {k: value if k == own else aligned[k] for k in ids}
+        if excluded:
+            del data[own]
+        if operations:
+            # fused pass: every operation is applied to an entry before moving to the next one
+            steps = [(op, operand.data if isinstance(operand, Field) else None, operand)
+                     for op, operand, _ in operations]
+            fields = [values for _, values, _ in steps if values is not None]
+            if fields:
+                data = {k: v for k, v in data.items() if all(k in values for values in fields)}
+            for k, v in data.items():
+                for op, values, operand in steps:
+                    v = op(v, operand if values is None else values[k])
+                data[k] = v
+        self._data = data
+
+    @property
+    def data(self) -> Dict[int, Any]:
+        """The field as a dictionary from ids to values (sorted by id)"""
+        if self._view is not None:
+            self._materialize()
+        if self._data is None:
+            if self._mask is None:
+                self._data = dict(zip(self._ids, self._values.tolist()))
+            else:
+                self._data = {k: v for k, v, keep in zip(self._ids, self._values.tolist(), self._mask.tolist()) if keep}
+        return self._data
+
+    def _value_list(self) -> List[Any]:
+        """The values of the field, in id order"""
+        if self._view is not None:
+            self._materialize()
+        if self._values is None:
+            return list(self._data.values())
+        if self._mask is None:
+            return self._values.tolist()
+        return self._values[self._mask].tolist()
 
     def exclude_self(self):
+        if self._view is not None:
+            return self._derive(exclude_self=True)
+        if self._values is not None:
+            try:
+                index = self._ids.index(self.engine.id)
+            except ValueError:
+                return self
+            mask = np.ones(len(self._ids), dtype=bool) if self._mask is None else self._mask.copy()
+            mask[index] = False
+            return Field.from_arrays(self._ids, self._values, self.engine, mask)
         to_return = self.data.copy()
         to_return.pop(self.engine.id, None)
         return Field(to_return, self.engine)
 
     def local(self):
+        if self._view is not None:
+            aligned, own, value, operations, excluded = self._view
+            if not excluded and not any(isinstance(operand, Field) for _, operand, _ in operations):
+                # only scalar operands: no need to look at the neighbors
+                for op, operand, _ in operations:
+                    value = op(value, operand)
+                return value
         return self.data.get(self.engine.id, None)
 
     def select(self, field) -> List:
-        # take the element which are true from the field passed
-        return [self.data[k] for k in self.data.keys() & field.data.keys() if field.data[k]]
-    # Helper method to apply binary operations
-    def _apply_binary_op(self, other, op):
+        # take the element which are true from the field passed (in id order)
+        return self.filter(field)._value_list()
+
+    def filter(self, condition: 'Field') -> 'Field':
+        """The field restricted to the entries for which `condition` is true"""
+        if self._view is not None:
+            self._materialize()
+        if condition._view is not None:
+            condition._materialize()
+        if self._values is not None and condition._values is not None and condition._ids == self._ids:
+            keep = condition._values.astype(bool)
+            if self._mask is not None:
+                keep &= self._mask
+            if condition._mask is not None:
+                keep &= condition._mask
+            return Field.from_arrays(self._ids, self._values, self.engine, keep)
+        other = condition.data
+        return Field({k: v for k, v in self.data.items() if k in other and other[k]}, self.engine)
+
+    # Reductions (the `*hood` operators of field calculus). Each of them takes an `include_self` switch: when False,
+    # the local entry is left out of the reduction. They are vectorized on compact fields (only where NumPy gives
+    # the same results as Python).
+    def _reduced(self, include_self: bool) -> 'Field':
+        field = self if include_self else self.exclude_self()
+        if field._view is not None:
+            field._materialize()
+        return field
+
+    def _buffer(self) -> Optional[np.ndarray]:
+        """The values of a compact field that belong to it (None for dictionary fields)"""
+        if self._values is None or self._mask is None:
+            return self._values
+        return self._values[self._mask]
+
+    def _entry(self, index: int) -> int:
+        """The position in the ids of the `index`-th entry of a compact field"""
+        return index if self._mask is None else int(np.flatnonzero(self._mask)[index])
+
+    def _extreme(self, default: Any, include_self: bool, largest: bool) -> Any:
+        field = self._reduced(include_self)
+        if isinstance(default, STATES):
+            default = default.value
+        values = field._buffer()
+        if values is not None:
+            result = (values.max() if largest else values.min()).item() if len(values) else None
+        else:
+            values = field._value_list()
+            result = (max(values) if largest else min(values)) if values else None
+        if result is None or (default is not None and (result < default if largest else default < result)):
+            return default
+        return result
+
+    def min(self, default: Any = None, include_self: bool = True) -> Any:
+        """
+        The minimum of the field.
+        :param default: A value that takes part in the reduction, returned when the field is empty.
+        :param include_self: Whether the local entry takes part in the reduction.
+        """
+        return self._extreme(default, include_self, False)
+
+    def max(self, default: Any = None, include_self: bool = True) -> Any:
+        """
+        The maximum of the field.
+        :param default: A value that takes part in the reduction, returned when the field is empty.
+        :param include_self: Whether the local entry takes part in the reduction.
+        """
+        return self._extreme(default, include_self, True)
+
+    def _arg_extreme(self, include_self: bool, largest: bool) -> tuple:
+        field = self._reduced(include_self)
+        values = field._buffer()
+        if values is not None:
+            entry = field._entry(int(values.argmax() if largest else values.argmin()))
+            return field._ids[entry], field._values[entry].item()
+        return (max if largest else min)(field.data.items(), key=itemgetter(1))
+
+    def argmin(self, include_self: bool = True) -> tuple:
+        """The id and the value of the first (in id order) minimum of the field"""
+        return self._arg_extreme(include_self, False)
+
+    def argmax(self, include_self: bool = True) -> tuple:
+        """The id and the value of the first (in id order) maximum of the field"""
+        return self._arg_extreme(include_self, True)
+
+    def min_by(self, keys: 'Field', include_self: bool = True) -> Any:
+        """The value of the first (in id order) entry with the minimum key, among the ids of both fields"""
+        field = self._reduced(include_self)
+        if keys._view is not None:
+            keys._materialize()
+        if field._values is not None and keys._values is not None and keys._ids == field._ids:
+            valid = field._mask if keys._mask is None else (
+                keys._mask if field._mask is None else field._mask & keys._mask)
+            candidates = np.arange(len(keys._ids)) if valid is None else np.flatnonzero(valid)
+            if not len(candidates):
+                raise ValueError("min_by of an empty field")
+            return field._values[candidates[keys._values[candidates].argmin()]].item()
+        other = keys.data
+        _, result = min(((other[k], v) for k, v in field.data.items() if k in other), key=itemgetter(0))
+        return result
+
+    def sum(self, start: Any = 0, include_self: bool = True) -> Any:
+        """The sum of the values of the field, plus `start`"""
+        field = self._reduced(include_self)
+        values = field._buffer()
+        if values is not None and values.dtype.kind == "b":
+            return int(np.count_nonzero(values)) + start
+        # float buffers are summed by Python (NumPy pairwise summation rounds differently)
+        return sum(field._value_list(), start)
+
+    def any(self, include_self: bool = True) -> bool:
+        """Whether any value of the field is true"""
+        field = self._reduced(include_self)
+        values = field._buffer()
+        if values is not None:
+            return bool(values.any())
+        return any(field._value_list())
+
+    def all(self, include_self: bool = True) -> bool:
+        """Whether all the values of the field are true"""
+        field = self._reduced(include_self)
+        values = field._buffer()
+        if values is not None:
+            return bool(values.all())
+        return all(field._value_list())
+
+    def fold(self, accumulation: callable, init: Any, include_self: bool = True) -> Any:
+        """Fold the values of the field (in id order) with `accumulation`, starting from `init`"""
+        return reduce(accumulation, self._reduced(include_self)._value_list(), init)
+
+    # Helper method to apply binary operations, vectorized on compact fields whose buffers are of the given kinds
+    # (only where NumPy gives the same results as Python)
+    def _apply_binary_op(self, other, op, kinds: str = ""):
+        if isinstance(other, STATES):
+            other = other.value
+        if self._view is not None:
+            return self._derive((op, other, kinds))
+        if isinstance(other, Field) and other._view is not None:
+            other._materialize()
+        if self._values is not None and self._values.dtype.kind in kinds:
+            if isinstance(other, Field):
+                if other._values is not None and other._values.dtype.kind in kinds \
+                        and (other._ids is self._ids or other._ids == self._ids):
+                    mask = self._mask if other._mask is None else (
+                        other._mask if self._mask is None else self._mask & other._mask)
+                    return Field.from_arrays(self._ids, op(self._values, other._values), self.engine, mask)
+            elif other.__class__ in _SCALARS[self._values.dtype.kind]:
+                return Field.from_arrays(self._ids, op(self._values, other), self.engine, self._mask)
         if isinstance(other, Field):
             return Field({k: op(self.data[k], other.data[k]) for k in self.data.keys() & other.data.keys()}, self.engine)
         return Field({k: op(v, other) for k, v in self.data.items()}, self.engine)
 
     # Plus operator, namely it sums all the elements of the field
     def __add__(self, other):
-        return self._apply_binary_op(other, lambda a, b: a + b)
+        return self._apply_binary_op(other, lambda a, b: a + b, "f")
 
     # Minus operator, namely it subtracts all the elements of the field
     def __sub__(self, other):
-        return self._apply_binary_op(other, lambda a, b: a - b)
+        return self._apply_binary_op(other, lambda a, b: a - b, "f")
 
     # Multiplication operator, namely it multiplies all the elements of the field
     def __mul__(self, other):
-        return self._apply_binary_op(other, lambda a, b: a * b)
+        return self._apply_binary_op(other, lambda a, b: a * b, "f")
 
     # Division operator, namely it divides all the elements of the field
     def __truediv__(self, other):
@@ -68,66 +352,77 @@ class Field(object):
 
     # Bitwise and operator, namely it does a bitwise and operation on all the elements of the field
     def __and__(self, other):
-        return self._apply_binary_op(other, lambda a, b: a & b)
+        return self._apply_binary_op(other, lambda a, b: a & b, "b")
 
     # Bitwise or operator, namely it does a bitwise or operation on all the elements of the field
     def __or__(self, other):
-        return self._apply_binary_op(other, lambda a, b: a | b)
+        return self._apply_binary_op(other, lambda a, b: a | b, "b")
 
     # Bitwise xor operator, namely it does a bitwise xor operation on all the elements of the field
     def __xor__(self, other):
-        return self._apply_binary_op(other, lambda a, b: a ^ b)
+        return self._apply_binary_op(other, lambda a, b: a ^ b, "b")
 
     # Bitwise not operator, namely it does a bitwise not operation on all the elements of the field
     def __invert__(self):
+        if self._view is not None:
+            return self._derive((lambda a, _: ~a, None, ""))
         return Field({k: ~v for k, v in self.data.items()}, self.engine)
 
     # Less than operator, namely it does a less than operation on all the elements of the field
     def __lt__(self, other):
-        return self._apply_binary_op(other, lambda a, b: a < b)
+        return self._apply_binary_op(other, lambda a, b: a < b, "fb")
 
     # Less than or equal operator, namely it does a less than or equal operation on all the elements of the field
     def __le__(self, other):
-        return self._apply_binary_op(other, lambda a, b: a <= b)
+        return self._apply_binary_op(other, lambda a, b: a <= b, "fb")
 
     # Greater than operator, namely it does a greater than operation on all the elements of the field
     def __gt__(self, other):
-        return self._apply_binary_op(other, lambda a, b: a > b)
+        return self._apply_binary_op(other, lambda a, b: a > b, "fb")
+
+    # Greater than or equal operator, namely it does a greater than or equal operation on all the elements of the field
+    def __ge__(self, other):
+        return self._apply_binary_op(other, lambda a, b: a >= b, "fb")
+
+    # Equality check on all the elements of the field (`==` compares the fields themselves, by identity)
+    def eq(self, other) -> 'Field':
+        return self._apply_binary_op(other, lambda a, b: a == b, "fb")
+
+    # Inequality check on all the elements of the field
+    def ne(self, other) -> 'Field':
+        return self._apply_binary_op(other, lambda a, b: a != b, "fb")
 
     def __iter__(self) -> 'Field':
         self._iter_index = 0
-        self._iter_keys = sorted(self.data.keys())
+        self._iter_values = self._value_list()
         return self
 
     def __next__(self) -> Any:
-        if self._iter_keys is None or self._iter_index is None:
+        if self._iter_values is None or self._iter_index is None:
             raise StopIteration
 
-        if self._iter_index >= len(self._iter_keys):
+        if self._iter_index >= len(self._iter_values):
             self._iter_index = None
-            self._iter_keys = None
+            self._iter_values = None
             raise StopIteration
 
-        key = self._iter_keys[self._iter_index]
-        value = self.data[key]
+        value = self._iter_values[self._iter_index]
         self._iter_index += 1
         return value
 
+def _value(value: Any) -> Any:
+    return value
+
 class State(wrapt.ObjectProxy):
     """
     A wrapper class that delegates operations to the underlying value
     while maintaining state management functionality.
     """
 
-    def __init__(self, default: Any, path: List, engine: Engine):
-        state = engine.read_state(path)
-        if state is None:
-            value = default
-            engine.write_state(default, path)
-        else:
-            value = state
-        super().__init__(value)
-        self._self_path = list(path)
+    def __init__(self, default: Any, path: Union[str, List], engine: Engine):
+        super().__init__(engine.init_state(default, path))
+        # interned path keys are immutable and can be shared, stacks are copied
+        self._self_path = path if isinstance(path, str) else list(path)
         self._self_engine = engine
 
     @property
@@ -137,7 +432,7 @@ class State(wrapt.ObjectProxy):
 
     def update(self, new_value: Any) -> Any:
         """Update the stored value."""
-        if isinstance(new_value, State):
+        if isinstance(new_value, STATES):
             new_value = new_value.value
         self._self_engine.write_state(new_value, self._self_path)
         self.__wrapped__ = new_value
@@ -153,10 +448,61 @@ class State(wrapt.ObjectProxy):
         self._self_engine.forget(self._self_path)
         self.__wrapped__ = None
 
+    def __reduce_ex__(self, protocol):
+        """A state is meaningful only in the round of its engine: it is pickled (and copied) as its value."""
+        return _value, (self.__wrapped__,)
+
+    def __reduce__(self):
+        return self.__reduce_ex__(2)
+
     def __str__(self):
         """String representation of the state."""
         return str(self.__wrapped__)
 
     def __repr__(self):
         """String representation of the state."""
-        return f"State: {repr(self.__wrapped__)}"
\ No newline at end of file
+        return f"State: {repr(self.__wrapped__)}"
+
+
+class StateHandle(object):
+    """
+    A lightweight state: the value is not proxied but read explicitly (`handle.value`), and the updates return the
+    new value itself. Returned by `remember(init, handle=True)`, it avoids the proxy dispatch of `State` on every
+    operation (and the proxy objects stored in tuples, messages and state).
+    """
+    __slots__ = ("value", "_path", "_engine")
+
+    def __init__(self, default: Any, path: Union[str, List], engine: Engine):
+        self.value: Any = engine.init_state(default, path)
+        self._path: Union[str, List] = path if path.__class__ is str else list(path)
+        self._engine: Engine = engine
+
+    def update(self, new_value: Any) -> Any:
+        """Store a new value, returning it."""
+        if isinstance(new_value, STATES):
+            new_value = new_value.value
+        self._engine.write_state(new_value, self._path)
+        self.value = new_value
+        return new_value
+
+    def update_fn(self, fn: callable) -> Any:
+        """Store the value computed by `fn` from the current one, returning it."""
+        self.value = new_value = fn(self.value)
+        self._engine.write_state(new_value, self._path)
+        return new_value
+
+    def forget(self):
+        """Forget the stored value."""
+        self._engine.forget(self._path)
+        self.value = None
+
+    def __reduce_ex__(self, protocol):
+        """Like a `State`, a handle is pickled (and copied) as its value."""
+        return _value, (self.value,)
+
+    def __repr__(self):
+        return f"StateHandle: {repr(self.value)}"
+
+
+# the states exported, stored or returned as their value
+STATES = (State, StateHandle)
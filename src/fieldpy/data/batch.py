@@ -0,0 +1,445 @@
+
+"""
+Batched data types, used by `fieldpy.internal.batch.BatchEngine` to run a synchronous round of an aggregate
+program for every device at once.
+A value of the program becomes a *column*: a NumPy array with one entry per device, or a `TupleColumn`
+(one column per tuple component) for tuple values. Python scalars stand for the same value on every device.
+A `BatchField` holds the neighbor values of every device in a CSR layout (see `Topology`).
+"""
+from typing import Any, List, Optional, Sequence
+import numpy as np
+
+from fieldpy.abstractions import Engine
+from fieldpy.data import STATES
+
+_NUMERIC_KINDS = "biuf"
+
+
+def unwrap(value: Any) -> Any:
+    """Return the value of a `State` or `StateHandle` (or the value itself)"""
+    if isinstance(value, STATES):
+        return value.value
+    return value
+
+
+class TupleColumn(object):
+    """
+    Column of tuple values, stored as one column per component.
+    Comparisons are lexicographic, like the ones between Python tuples.
+    """
+    __slots__ = ("components",)
+
+    def __init__(self, components):
+        self.components = tuple(components)
+
+    def __len__(self) -> int:
+        return len(self.components)
+
+    def __iter__(self):
+        return iter(self.components)
+
+    def __getitem__(self, index):
+        return self.components[index]
+
+    def take(self, indices: np.ndarray) -> 'TupleColumn':
+        return TupleColumn(take(c, indices) for c in self.components)
+
+    def tolist(self) -> List[tuple]:
+        return list(zip(*(to_list(c) for c in self.components)))
+
+    def _other(self, other) -> Sequence:
+        other = unwrap(other)
+        if isinstance(other, (TupleColumn, tuple)) and len(other) == len(self.components):
+            return [unwrap(c) for c in other]
+        raise TypeError(f"cannot compare a tuple column with {type(other).__name__}")
+
+    def __eq__(self, other):
+        result = None
+        for a, b in zip(self.components, self._other(other)):
+            equal = a == b
+            result = equal if result is None else result & equal
+        return result
+
+    def __ne__(self, other):
+        return ~self.__eq__(other)
+
+    def _lexicographic(self, other, last):
+        others = self._other(other)
+        result = last(self.components[-1], others[-1])
+        for a, b in zip(reversed(self.components[:-1]), reversed(others[:-1])):
+            result = (a < b) | ((a == b) & result)
+        return result
+
+    def __lt__(self, other):
+        return self._lexicographic(other, lambda a, b: a < b)
+
+    def __le__(self, other):
+        return self._lexicographic(other, lambda a, b: a <= b)
+
+    def __gt__(self, other):
+        return ~self.__le__(other)
+
+    def __ge__(self, other):
+        return ~self.__lt__(other)
+
+    __hash__ = None
+
+    def __repr__(self):
+        return f"TupleColumn{self.components!r}"
+
+
+def is_column(value: Any) -> bool:
+    return isinstance(value, (np.ndarray, TupleColumn))
+
+
+def objects(values: List[Any]) -> np.ndarray:
+    """Build an object column holding exactly the given Python values"""
+    column = np.empty(len(values), dtype=object)
+    column[:] = values
+    return column
+
+
+def column_from_values(values: List[Any]) -> Any:
+    """Build a column from the per-device Python values"""
+    if values and all(isinstance(v, tuple) for v in values) and len({len(v) for v in values}) == 1:
+        return TupleColumn(column_from_values(list(c)) for c in zip(*values))
+    try:
+        column = np.array(values)
+    except ValueError:
+        return objects(values)
+    if column.ndim != 1 or column.dtype.kind not in _NUMERIC_KINDS:
+        return objects(values)
+    return column
+
+
+def as_column(value: Any, size: int) -> Any:
+    """Turn a value of a batched program into a column of `size` entries (broadcasting scalars)"""
+    value = unwrap(value)
+    if isinstance(value, (np.ndarray, TupleColumn)):
+        return value
+    if isinstance(value, tuple):
+        return TupleColumn(as_column(c, size) for c in value)
+    if isinstance(value, (bool, int, float, np.number, np.bool_)):
+        return np.full(size, value)
+    column = np.empty(size, dtype=object)
+    column.fill(value)
+    return column
+
+
+def as_objects(value: Any, size: int) -> np.ndarray:
+    """Turn a value into an object column (tuple columns become columns of Python tuples)"""
+    column = as_column(value, size)
+    if isinstance(column, TupleColumn):
+        return objects(column.tolist())
+    return column if column.dtype == object else objects(column.tolist())
+
+
+def to_list(column: Any) -> List[Any]:
+    """The per-device Python values of a column"""
+    if isinstance(column, TupleColumn):
+        return column.tolist()
+    return column.tolist()
+
+
+def take(value: Any, indices: np.ndarray) -> Any:
+    """Select entries of a column (scalars are left untouched)"""
+    value = unwrap(value)
+    if isinstance(value, (np.ndarray, TupleColumn)):
+        return value.take(indices)
+    if isinstance(value, tuple):
+        return tuple(take(c, indices) for c in value)
+    return value
+
+
+def where(condition: Any, then: Any, otherwise: Any, size: int) -> Any:
+    """Pointwise choice between two values (columns, tuples of columns or scalars)"""
+    condition = unwrap(condition)
+    then = unwrap(then)
+    otherwise = unwrap(otherwise)
+    if not isinstance(condition, np.ndarray):
+        return then if condition else otherwise
+    then_tuple = isinstance(then, (tuple, TupleColumn))
+    otherwise_tuple = isinstance(otherwise, (tuple, TupleColumn))
+    if then_tuple and otherwise_tuple and len(then) == len(otherwise):
+        return TupleColumn(where(condition, a, b, size) for a, b in zip(then, otherwise))
+    if then_tuple or otherwise_tuple:
+        return np.where(condition, as_objects(then, size), as_objects(otherwise, size))
+    if then is None or otherwise is None:
+        return np.where(condition, as_objects(then, size), as_objects(otherwise, size))
+    return np.where(condition, then, otherwise)
+
+
+def sort_keys(values: Any) -> List[np.ndarray]:
+    """Numeric keys ordering a column like Python orders its values (most significant first)"""
+    if isinstance(values, TupleColumn):
+        return [key for c in values.components for key in sort_keys(c)]
+    if values.dtype.kind in _NUMERIC_KINDS:
+        return [values]
+    order = sorted(range(len(values)), key=values.__getitem__)
+    ranks = np.empty(len(values), dtype=np.int64)
+    ranks[order] = np.arange(len(values))
+    return [ranks]
+
+
+class Topology(object):
+    """
+    The neighborhood of every device of a round in CSR layout.
+    Row `i` holds the entries of device `i`: itself and its neighbors, sorted by id (the order of a `Field`).
+    """
+
+    def __init__(self, ids: List[Any], neighbors: List[List[Any]]):
+        self.size = len(ids)
+        self.id_list = list(ids)
+        self.ids = column_from_values(self.id_list)
+        self.index_of = {id: index for index, id in enumerate(self.id_list)}
+        ranks = np.empty(self.size, dtype=np.int64)
+        ranks[sorted(range(self.size), key=self.id_list.__getitem__)] = np.arange(self.size)
+        index_of = self.index_of
+        counts = np.fromiter((len(n) + 1 for n in neighbors), dtype=np.int64, count=self.size)
+        rows = np.repeat(np.arange(self.size), counts)
+        cols = np.fromiter((index for row, row_neighbors in enumerate(neighbors)
+                            for index in (row, *(index_of[n] for n in row_neighbors))),
+                           dtype=np.int64, count=int(counts.sum()))
+        order = np.lexsort((ranks[cols], rows))
+        self.rows = rows
+        self.cols = cols[order]
+        self.indptr = np.zeros(self.size + 1, dtype=np.int64)
+        np.cumsum(counts, out=self.indptr[1:])
+        self.self_mask = self.cols == self.rows
+        self.self_entries = np.flatnonzero(self.self_mask)
+        self._slots = None
+
+    @property
+    def edges(self) -> int:
+        return len(self.cols)
+
+    def slots(self) -> List[np.ndarray]:
+        """Entries grouped by position in their row: `slots()[j]` holds the j-th entry of every row long enough"""
+        if self._slots is None:
+            position = np.arange(self.edges) - self.indptr[self.rows]
+            order = np.argsort(position, kind="stable")
+            bounds = np.searchsorted(position[order], np.arange(int(position.max(initial=-1)) + 2))
+            self._slots = [order[bounds[j]:bounds[j + 1]] for j in range(len(bounds) - 1)]
+        return self._slots
+
+    def row_argmin(self, keys: Any, valid: Optional[np.ndarray], largest: bool = False) -> np.ndarray:
+        """For every row, the first entry (in id order) with the minimum (or maximum) key among the valid ones"""
+        keys = sort_keys(keys)
+        if largest:
+            keys = [-(key.astype(np.int64) if key.dtype.kind == "b" else key) for key in keys]
+        sort = [np.arange(self.edges)] + list(reversed(keys))
+        if valid is not None:
+            sort.append(~valid)
+        sort.append(self.rows)
+        return np.lexsort(tuple(sort))[self.indptr[:-1]]
+
+    def row_any(self, valid: Optional[np.ndarray]) -> np.ndarray:
+        if valid is None:
+            return np.ones(self.size, dtype=bool)
+        return np.logical_or.reduceat(valid, self.indptr[:-1])
+
+
+def _combine(first: Optional[np.ndarray], second: Optional[np.ndarray]) -> Optional[np.ndarray]:
+    if first is None:
+        return second
+    if second is None:
+        return first
+    return first & second
+
+
+class BatchField(object):
+    """
+    Batched counterpart of `Field`: the neighbor values of every device of a round.
+    `values` is an edge column aligned with `topology`, `mask` marks the entries that are actually aligned
+    (None meaning all of them). Binary operators combine aligned entries, broadcasting scalars and
+    per-device columns; reductions produce per-device columns.
+    """
+    __slots__ = ("topology", "values", "mask", "engine")
+
+    def __init__(self, topology: Topology, values: Any, mask: Optional[np.ndarray], engine: Engine) -> None:
+        self.topology = topology
+        self.values = values
+        self.mask = mask
+        self.engine = engine
+
+    def _with(self, values: Any, mask: Optional[np.ndarray]) -> 'BatchField':
+        return BatchField(self.topology, values, mask, self.engine)
+
+    def _operand(self, other):
+        if isinstance(other, BatchField):
+            return other.values, other.mask
+        return take(other, self.topology.rows), None
+
+    def _apply_binary_op(self, other, op):
+        values, mask = self._operand(other)
+        with np.errstate(all="ignore"):
+            return self._with(op(self.values, values), _combine(self.mask, mask))
+
+    def __add__(self, other):
+        return self._apply_binary_op(other, lambda a, b: a + b)
+
+    def __sub__(self, other):
+        return self._apply_binary_op(other, lambda a, b: a - b)
+
+    def __mul__(self, other):
+        return self._apply_binary_op(other, lambda a, b: a * b)
+
+    def __truediv__(self, other):
+        return self._apply_binary_op(other, lambda a, b: a / b)
+
+    def __mod__(self, other):
+        return self._apply_binary_op(other, lambda a, b: a % b)
+
+    def __pow__(self, other):
+        return self._apply_binary_op(other, lambda a, b: a ** b)
+
+    def __floordiv__(self, other):
+        return self._apply_binary_op(other, lambda a, b: a // b)
+
+    def __and__(self, other):
+        return self._apply_binary_op(other, lambda a, b: a & b)
+
+    def __or__(self, other):
+        return self._apply_binary_op(other, lambda a, b: a | b)
+
+    def __xor__(self, other):
+        return self._apply_binary_op(other, lambda a, b: a ^ b)
+
+    def __invert__(self):
+        return self._with(~self.values, self.mask)
+
+    def __lt__(self, other):
+        return self._apply_binary_op(other, lambda a, b: a < b)
+
+    def __le__(self, other):
+        return self._apply_binary_op(other, lambda a, b: a <= b)
+
+    def __gt__(self, other):
+        return self._apply_binary_op(other, lambda a, b: a > b)
+
+    def __ge__(self, other):
+        return self._apply_binary_op(other, lambda a, b: a >= b)
+
+    # elementwise equality, as `Field.eq` (`==` compares the fields themselves, by identity)
+    def eq(self, other) -> 'BatchField':
+        return self._apply_binary_op(other, lambda a, b: a == b)
+
+    def ne(self, other) -> 'BatchField':
+        return self._apply_binary_op(other, lambda a, b: a != b)
+
+    def __getitem__(self, index):
+        """The field of a component of tuple values"""
+        return self._with(self.values[index], self.mask)
+
+    def exclude_self(self) -> 'BatchField':
+        not_self = ~self.topology.self_mask
+        return self._with(self.values, not_self if self.mask is None else self.mask & not_self)
+
+    def local(self) -> Any:
+        return take(self.values, self.topology.self_entries)
+
+    def select(self, field: 'BatchField') -> 'BatchField':
+        """The entries for which `field` is true (the batched counterpart of `Field.select`)"""
+        selected = np.asarray(field.values, dtype=bool)
+        return self._with(self.values, _combine(_combine(self.mask, field.mask), selected))
+
+    filter = select
+
+    def _reduced(self, include_self: bool) -> 'BatchField':
+        return self if include_self else self.exclude_self()
+
+    def _truth(self) -> np.ndarray:
+        if isinstance(self.values, TupleColumn):
+            return np.ones(self.topology.edges, dtype=bool)
+        return np.asarray(self.values, dtype=bool)
+
+    def _extreme(self, default: Any, largest: bool) -> Any:
+        topology = self.topology
+        size = topology.size
+        values = self.values
+        default = unwrap(default)
+        if isinstance(values, np.ndarray) and values.dtype.kind in _NUMERIC_KINDS and default is not None \
+                and not isinstance(default, (tuple, TupleColumn)):
+            extreme = np.maximum if largest else np.minimum
+            if self.mask is not None:
+                values = np.where(self.mask, values, take(default, topology.rows))
+            return extreme(extreme.reduceat(values, topology.indptr[:-1]), default)
+        result = take(values, topology.row_argmin(values, self.mask, largest))
+        found = topology.row_any(self.mask)
+        if default is None:
+            return where(found, result, None, size)
+        default_column = as_column(default, size)
+        return where(found & ~(result < default_column if largest else default_column < result), result, default, size)
+
+    def min(self, default: Any = None, include_self: bool = True) -> Any:
+        """The minimum of every row and `default` (the batched counterpart of `Field.min`)"""
+        return self._reduced(include_self)._extreme(default, False)
+
+    def max(self, default: Any = None, include_self: bool = True) -> Any:
+        """The maximum of every row and `default` (the batched counterpart of `Field.max`)"""
+        return self._reduced(include_self)._extreme(default, True)
+
+    def _arg_extreme(self, largest: bool) -> tuple:
+        topology = self.topology
+        entries = topology.row_argmin(self.values, self.mask, largest)
+        return take(topology.ids, topology.cols[entries]), take(self.values, entries)
+
+    def argmin(self, include_self: bool = True) -> tuple:
+        """The id and the value of the first minimum of every row"""
+        return self._reduced(include_self)._arg_extreme(False)
+
+    def argmax(self, include_self: bool = True) -> tuple:
+        """The id and the value of the first maximum of every row"""
+        return self._reduced(include_self)._arg_extreme(True)
+
+    def min_by(self, keys: 'BatchField', include_self: bool = True) -> Any:
+        """The value of the first entry with the minimum key of every row"""
+        field = self._reduced(include_self)
+        entries = field.topology.row_argmin(keys.values, _combine(field.mask, keys.mask))
+        return take(field.values, entries)
+
+    def sum(self, start: Any = 0, include_self: bool = True) -> Any:
+        """The sum of every row, plus `start` (summed in id order, like `Field.sum` on Python values)"""
+        return self.fold(lambda a, b: a + b, start, include_self)
+
+    def any(self, include_self: bool = True) -> np.ndarray:
+        """Whether any value of every row is true"""
+        field = self._reduced(include_self)
+        truth = field._truth()
+        if field.mask is not None:
+            truth = truth & field.mask
+        return np.logical_or.reduceat(truth, field.topology.indptr[:-1])
+
+    def all(self, include_self: bool = True) -> np.ndarray:
+        """Whether all the values of every row are true"""
+        field = self._reduced(include_self)
+        truth = field._truth()
+        if field.mask is not None:
+            truth = truth | ~field.mask
+        return np.logical_and.reduceat(truth, field.topology.indptr[:-1])
+
+    def fold(self, accumulation: callable, init: Any, include_self: bool = True) -> Any:
+        """Fold the valid entries of every row (in id order) starting from `init`"""
+        field = self._reduced(include_self)
+        topology = field.topology
+        accumulated = as_column(init, topology.size)
+        accumulated = accumulated.copy() if isinstance(accumulated, np.ndarray) else as_objects(accumulated, topology.size)
+        values = field.values if isinstance(field.values, np.ndarray) else as_objects(field.values, topology.edges)
+        operation = accumulation
+        for entries in topology.slots():
+            if field.mask is not None:
+                entries = entries[field.mask[entries]]
+            if len(entries) == 0:
+                continue
+            rows = topology.rows[entries]
+            try:
+                result = np.asarray(operation(accumulated[rows], values[entries]))
+            except (TypeError, ValueError):
+                # not a vectorizable operation (e.g. `x or y`): apply it value by value
+                operation = np.frompyfunc(accumulation, 2, 1)
+                accumulated = accumulated.astype(object)
+                result = operation(accumulated[rows], values[entries])
+            if result.dtype != accumulated.dtype:
+                accumulated = accumulated.astype(np.result_type(accumulated, result))
+            accumulated[rows] = result
+        return accumulated
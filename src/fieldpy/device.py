@@ -0,0 +1,244 @@
+"""
+Asyncio runtime for a real device: it runs the setup -> program -> cooldown cycle every `period` seconds on its own
+`MutableEngine`, and exchanges the messages with its neighbors over UDP (unicast to known peers, or multicast).
+```python
+device = DeviceRuntime(main, id=7, position=(0.0, 1.0), peers=[("10.0.0.2", 7000)], bind=("0.0.0.0", 7000))
+await device.start()
+await device.run()  # until device.stop()
+```
+Neighbors are discovered by hearing them: a packet received from an unknown address adds it to the unicast peers,
+and a neighbor that is not heard for `expiry` seconds is dropped. Packets are decoded as they arrive and only the
+latest messages of each neighbor are kept, so a round never waits for the network (nor for slow neighbors): it
+uses whatever was received by then. Each round sends one datagram (with all the exported paths, encoded by a
+`fieldpy.internal.codec.MessageCodec`) to every peer.
+Many runtimes can share a process (e.g. on loopback, for tests): every round runs on the engine of its runtime.
+"""
+import asyncio
+import random
+import socket
+import struct
+from time import perf_counter
+from typing import Any, Callable, Dict, Iterable, Optional, Set, Tuple
+
+from fieldpy import calculus
+from fieldpy.calculus import use_engine
+from fieldpy.data import STATES
+from fieldpy.internal import MutableEngine
+from fieldpy.internal.codec import MessageCodec, _read_value, _write_value
+from fieldpy.simulator import Node
+
+# the first bytes of every datagram (followed by the sender id and the encoded messages)
+MAGIC = b"FP\x01"
+
+# the decoder of an expired neighbor is dropped after FORGET expiry times
+FORGET = 10
+
+Address = Tuple[str, int]
+
+
+class _DeviceProtocol(asyncio.DatagramProtocol):
+    def __init__(self, runtime: 'DeviceRuntime'):
+        self.runtime = runtime
+
+    def datagram_received(self, data: bytes, address: Address):
+        self.runtime._received(data, address)
+
+    def error_received(self, exception: Exception):
+        # e.g. the port of a peer that went down: the peer simply stops being heard
+        self.runtime.errors += 1
+
+
+class DeviceRuntime:
+    """A device running an aggregate program in rounds, exchanging messages over UDP"""
+
+    def __init__(self, program: Callable, id: Any, position: Tuple[float, ...] = (0.0, 0.0), data: Any = None,
+                 bind: Address = ("127.0.0.1", 0), peers: Iterable[Address] = (),
+                 multicast: Optional[Address] = None, period: float = 0.1, expiry: Optional[float] = None,
+                 jitter: float = 0.0, accept: Optional[Callable[[Any], bool]] = None, delta: bool = False,
+                 keyframe_every: Optional[int] = None):
+        """
+        :param program: The aggregate program, called with the device context (a `Node`) every round.
+        :param id: The id of the device (an int or a str), unique in the network.
+        :param bind: The local address of the socket (port 0 picks a free one).
+        :param peers: The addresses the messages are always sent to (neighbors heard from other addresses are added
+        while they are heard).
+        :param multicast: A multicast group (address, port) to send to and to receive from (on the interface of
+        `bind`), instead of unicast.
+        :param period: The time between the starts of two rounds.
+        :param expiry: The time after which a silent neighbor is dropped (3 periods by default).
+        :param jitter: Each round starts at a random offset in [0, jitter) after its slot.
+        :param accept: A filter of the neighbors, by id (e.g. to impose a topology on loopback).
+        :param delta: Send only the values that changed since the previous round (see `MessageCodec`). After a lost
+        datagram, a neighbor cannot decode the deltas until the next keyframe, so keyframes must come at least once
+        per `expiry`.
+        :param keyframe_every: The rounds between two keyframes (full messages), with `delta` (by default as many as
+        fit in `expiry`).
+        """
+        self.expiry = expiry if expiry is not None else 3 * period
+        if keyframe_every is None:
+            keyframe_every = max(1, int(self.expiry // period))
+        elif delta and keyframe_every * period > self.expiry:
+            raise ValueError(f"with delta, a keyframe every {keyframe_every} rounds of {period:g}s would let the "
+                             f"neighbors expire ({self.expiry:g}s) after a single lost datagram")
+        self.program = program
+        self.id = id
+        self.node = Node(position, {} if data is None else data, id)
+        self.bind = bind
+        self.peers: Set[Address] = set(peers)
+        self.multicast = multicast
+        self.period = period
+        self.jitter = jitter
+        self.accept = accept
+        # values that need pickling cannot be sent: unpickling what the network delivers is not safe
+        self.codec = MessageCodec(delta, keyframe_every, shared=False, pickled=False)
+        self.engine = MutableEngine(self.codec)
+        self.state = None
+        # neighbor id -> (time received, decoded messages, address)
+        self.inbox: Dict[Any, Tuple[float, Dict[str, Any], Address]] = {}
+        # the addresses of the neighbors heard, that are not among the peers
+        self.discovered: Set[Address] = set()
+        # expired neighbor id -> time it expired (its decoder is kept for a while, in case it was only late)
+        self.expired: Dict[Any, float] = {}
+        self.rounds = 0
+        self.errors = 0
+        self.dropped = 0
+        self.latency = 0.0
+        self.transport: Optional[asyncio.DatagramTransport] = None
+        self.running = False
+        self._header = bytearray(MAGIC)
+        _write_value(self._header, id, False)
+        self._header = bytes(self._header)
+
+    @property
+    def address(self) -> Address:
+        """The local address of the socket"""
+        return self.transport.get_extra_info("sockname")[:2]
+
+    @property
+    def neighbors(self):
+        """The ids of the neighbors currently heard"""
+        return list(self.inbox)
+
+    async def start(self):
+        """Open the socket (and join the multicast group)"""
+        loop = asyncio.get_running_loop()
+        if self.multicast is None:
+            self.transport, _ = await loop.create_datagram_endpoint(lambda: _DeviceProtocol(self), local_addr=self.bind)
+        else:
+            group, port = self.multicast
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            if hasattr(socket, "SO_REUSEPORT"):
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+            sock.bind(("", port))
+            # the interface of `bind` sends and receives the group datagrams
+            interface = socket.inet_aton(self.bind[0])
+            sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP,
+                            struct.pack("4s4s", socket.inet_aton(group), interface))
+            sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_IF, interface)
+            sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_LOOP, 1)
+            self.transport, _ = await loop.create_datagram_endpoint(lambda: _DeviceProtocol(self), sock=sock)
+
+    def _received(self, data: bytes, address: Address):
+        if not data.startswith(MAGIC):
+            self.dropped += 1
+            return
+        try:
+            sender, offset = _read_value(data, len(MAGIC), False)
+            if sender == self.id or (self.accept is not None and not self.accept(sender)):
+                return
+            messages = self.codec.decode(sender, data[offset:])
+        except (ValueError, IndexError, TypeError, UnicodeDecodeError, struct.error):
+            # a malformed (or foreign) datagram
+            self.dropped += 1
+            return
+        if messages is None:
+            # a delta whose previous packet was lost: the neighbor keeps its last messages until the next keyframe
+            self.dropped += 1
+            return
+        self.inbox[sender] = (asyncio.get_running_loop().time(), messages, address)
+        self.expired.pop(sender, None)
+        if self.multicast is None and address not in self.peers:
+            self.discovered.add(address)
+
+    def _expire(self, now: float):
+        for sender in [sender for sender, (received, _, _) in self.inbox.items() if now - received > self.expiry]:
+            _, _, address = self.inbox.pop(sender)
+            self.expired[sender] = now
+            if all(other != address for _, _, other in self.inbox.values()):
+                self.discovered.discard(address)
+        for sender in [sender for sender, time in self.expired.items() if now - time > FORGET * self.expiry]:
+            del self.expired[sender]
+            self.codec.decoders.pop(sender, None)
+
+    def round(self) -> Any:
+        """Run a round with the messages received so far, then send the exported messages"""
+        start = perf_counter()
+        self._expire(asyncio.get_running_loop().time())
+        messages = {sender: exported for sender, (_, exported, _) in self.inbox.items()}
+        engine = self.engine
+        with use_engine(engine):
+            engine.setup(messages, self.id, self.state)
+            try:
+                result = self.program(self.node)
+            except BaseException:
+                engine.rollback()
+                raise
+            if isinstance(result, STATES):
+                result = result.value
+            packet = engine.cooldown()
+        self.state = engine.state
+        self.node.data["result"] = result
+        self._send(self._header + packet)
+        self.rounds += 1
+        self.latency = perf_counter() - start
+        if calculus.profiler is not None:
+            calculus.profiler.round(self.id, self.latency, packet, self.state)
+        return result
+
+    def _send(self, datagram: bytes):
+        if self.multicast is not None:
+            self.transport.sendto(datagram, self.multicast)
+            return
+        for peer in self.peers:
+            self.transport.sendto(datagram, peer)
+        for peer in self.discovered:
+            self.transport.sendto(datagram, peer)
+
+    async def run(self, rounds: Optional[int] = None):
+        """Run rounds every `period` (forever, or `rounds` times), until `stop`"""
+        if self.transport is None:
+            await self.start()
+        loop = asyncio.get_running_loop()
+        self.running = True
+        next_round = loop.time()
+        count = 0
+        while self.running and (rounds is None or count < rounds):
+            delay = next_round - loop.time() + (random.uniform(0, self.jitter) if self.jitter else 0.0)
+            # always yield, so that the datagrams of the other devices are received
+            await asyncio.sleep(max(delay, 0.0))
+            if not self.running:
+                break
+            self.round()
+            count += 1
+            next_round += self.period
+            if next_round < loop.time():
+                # late (e.g. an overloaded host): skip the missed slots instead of bursting
+                next_round = loop.time()
+        self.running = False
+
+    def stop(self):
+        self.running = False
+
+    def close(self):
+        self.stop()
+        if self.transport is not None:
+            self.transport.close()
+            self.transport = None
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc):
+        self.close()
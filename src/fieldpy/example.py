@@ -7,8 +7,7 @@ from fieldpy.libraries.diffusion import distance_to
 from fieldpy.simulator import Simulator
 from fieldpy.simulator.deployments import deformed_lattice
 from fieldpy.simulator.neighborhood import radius_neighborhood
-from fieldpy.simulator.render import render_sync
-from fieldpy.simulator.runner import aggregate_program_runner
+from fieldpy.simulator.render import Renderer, render_sync
 
 random.seed(42)
 @aggregate
@@ -32,9 +31,12 @@ for node in simulator.environment.nodes.values():
 simulator.environment.node_list()[0].data["source"] = True
 target = simulator.environment.node_list()[-1]
 target.data["target"] = True
-# schedule the main function
-for node in simulator.environment.nodes.values():
-    simulator.schedule_event(0.0, aggregate_program_runner, simulator, 0.1, node, main)
-# render
-simulator.schedule_event(1.0, render_sync, simulator, "result")
-simulator.run(100)
\ No newline at end of file
+# schedule the main function (a round of every node every 0.1)
+simulator.schedule_rounds(main, 0.1)
+# render (the frames are drawn while the simulation runs)
+renderer = Renderer("result")
+simulator.schedule_event(1.0, render_sync, simulator, "result", renderer)
+simulator.run(100)
+# keep the window of the last frame open
+renderer.close()
+renderer.show()
@@ -4,89 +4,537 @@ Engine is the core of the FieldPy library. It manages the state and message pass
 between different contexts. It provides methods to enter and exit contexts, send messages,
 and manage the state of the system.
 """
-from typing import Dict, List, Any, Optional
+from collections.abc import Mapping
+from typing import Dict, Iterator, List, Any, Optional, Tuple, Union
 from copy import deepcopy
 from fieldpy.abstractions import Engine
-from fieldpy.data import State
+
+from fieldpy.data import STATES, Field
+
+# the previous value of a slot that did not exist
+_MISSING = object()
+
+
+class StateStore(dict):
+    """
+    The state of a device (key -> value), kept by the engine from one round to the next.
+    Every slot is stamped with the last round that read it, and the slots stamped in the current round are counted.
+    When all the slots carry the stamp of the current round (the steady state of a program whose shape does not
+    change) `collect` has nothing to sweep, and finds it out in constant time.
+    The value a slot had before its first write of the round is kept until `collect`, so that `rollback` undoes the
+    writes of a failed round.
+    """
+    __slots__ = ("stamps", "round", "fresh", "missed", "undo")
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.stamps: Dict[str, int] = {}
+        self.round: int = 0
+        self.fresh: int = 0  # the number of slots stamped in the current round
+        self.missed = set()  # keys read while missing in the current round: they are kept if written later
+        self.undo: Dict[str, Any] = {}  # key -> value before the first write of the round (or _MISSING)
+
+    def _stamp(self, key: str) -> None:
+        if self.stamps.get(key) != self.round:
+            self.stamps[key] = self.round
+            self.fresh += 1
+
+    def read(self, key: str) -> Optional[Any]:
+        if key in self:
+            self._stamp(key)
+            return self[key]
+        self.missed.add(key)
+        return None
+
+    def init(self, key: str, default: Any) -> Any:
+        """Read a slot, initializing it with `default` when it is missing (or None)"""
+        self._stamp(key)
+        value = self.get(key)
+        if value is None:
+            if key not in self.undo:
+                self.undo[key] = self.get(key, _MISSING)
+            self[key] = default
+            return default
+        return value
+
+    def write(self, key: str, value: Any) -> None:
+        if key not in self.undo:
+            self.undo[key] = self.get(key, _MISSING)
+        if key not in self and key in self.missed:
+            self._stamp(key)
+        self[key] = value
+
+    def forget(self, key: str) -> None:
+        if key in self and key not in self.undo:
+            self.undo[key] = self[key]
+        self.pop(key, None)
+        if self.stamps.pop(key, None) == self.round:
+            self.fresh -= 1
+
+    def collect(self) -> None:
+        """Drop the slots that were not read in the current round and start the next one"""
+        current: int = self.round
+        if self.fresh != len(self) or len(self.stamps) != len(self):
+            stamps: Dict[str, int] = self.stamps
+            for key in [key for key in self if stamps.get(key) != current]:
+                del self[key]
+            self.stamps = {key: current for key in self}
+        if self.missed:
+            self.missed = set()
+        if self.undo:
+            self.undo = {}
+        self.round = current + 1
+        self.fresh = 0
+
+    def rollback(self) -> None:
+        """Undo the writes of the current round and start the next one (the reads of the round are not counted)"""
+        for key, value in self.undo.items():
+            if value is _MISSING:
+                self.pop(key, None)
+                self.stamps.pop(key, None)
+            else:
+                self[key] = value
+        self.undo = {}
+        self.missed = set()
+        self.round += 1
+        self.fresh = 0
+
+# the mean number of slots per chunk of a `PersistentStateStore` (the chunks double when it is exceeded)
+CHUNK_SIZE = 32
+
+
+class StateSnapshot(Mapping):
+    """A read-only version of a `PersistentStateStore`, sharing its chunks with the store and the other versions"""
+    __slots__ = ("chunks", "mask", "size")
+
+    def __init__(self, chunks: Tuple[Dict[str, Any], ...], mask: int, size: int):
+        self.chunks = chunks
+        self.mask = mask
+        self.size = size
+
+    def __getitem__(self, key: str) -> Any:
+        return self.chunks[hash(key) & self.mask][key]
+
+    def __contains__(self, key: Any) -> bool:
+        return key in self.chunks[hash(key) & self.mask]
+
+    def __iter__(self) -> Iterator[str]:
+        for chunk in self.chunks:
+            yield from chunk
+
+    def __len__(self) -> int:
+        return self.size
+
+
+class PersistentStateStore(Mapping):
+    """
+    A `StateStore` (same methods, same collection of the slots not read in a round) made of chunks that are copied
+    on write: `snapshot` returns a read-only version in constant time (up to the number of chunks), and the store
+    then copies only the chunks written afterwards. Every `collect` keeps the version it ends with, so a failed round
+    is undone by `rollback`, and old versions can be kept (e.g. for tracing) sharing their unchanged chunks.
+    The slots of a key are found by its hash: the path keys of an engine are interned, so hashing them is free.
+    """
+    __slots__ = ("chunks", "owners", "mask", "size", "version", "committed", "reads", "missed")
+
+    def __init__(self, items: Any = ()):
+        self.chunks: List[Dict[str, Any]] = [{}]
+        # the version that owns each chunk (the others are shared with a snapshot, and copied before a write)
+        self.owners: List[int] = [0]
+        self.mask: int = 0
+        self.size: int = 0
+        self.version: int = 0
+        self.reads = set()  # keys read (or initialized) in the current round
+        self.missed = set()  # keys read while missing in the current round: they are kept if written later
+        for key, value in (items.items() if isinstance(items, Mapping) else items):
+            self[key] = value
+        self.committed: StateSnapshot = self.snapshot()
+
+    def __getitem__(self, key: str) -> Any:
+        return self.chunks[hash(key) & self.mask][key]
+
+    def __contains__(self, key: Any) -> bool:
+        return key in self.chunks[hash(key) & self.mask]
+
+    def __iter__(self) -> Iterator[str]:
+        for chunk in self.chunks:
+            yield from chunk
+
+    def __len__(self) -> int:
+        return self.size
+
+    def _owned(self, key: str) -> Dict[str, Any]:
+        """The chunk of a key, copied first if it is shared"""
+        index = hash(key) & self.mask
+        if self.owners[index] == self.version:
+            return self.chunks[index]
+        chunk = self.chunks[index] = dict(self.chunks[index])
+        self.owners[index] = self.version
+        return chunk
+
+    def __setitem__(self, key: str, value: Any) -> None:
+        index = hash(key) & self.mask
+        chunk = self.chunks[index]
+        if self.owners[index] != self.version:
+            chunk = self.chunks[index] = dict(chunk)
+            self.owners[index] = self.version
+        if key not in chunk:
+            self.size += 1
+            if self.size > len(self.chunks) * CHUNK_SIZE:
+                chunk[key] = value
+                self._grow()
+                return
+        chunk[key] = value
+
+    def __delitem__(self, key: str) -> None:
+        del self._owned(key)[key]
+        self.size -= 1
+
+    def _grow(self) -> None:
+        """Split the slots in twice as many chunks (new chunks, so the snapshots are not affected)"""
+        mask = self.mask * 2 + 1
+        chunks: List[Dict[str, Any]] = [{} for _ in range(mask + 1)]
+        for chunk in self.chunks:
+            for key, value in chunk.items():
+                chunks[hash(key) & mask][key] = value
+        self.chunks = chunks
+        self.owners = [self.version] * len(chunks)
+        self.mask = mask
+
+    def read(self, key: str) -> Optional[Any]:
+        chunk = self.chunks[hash(key) & self.mask]
+        if key in chunk:
+            self.reads.add(key)
+            return chunk[key]
+        self.missed.add(key)
+        return None
+
+    def init(self, key: str, default: Any) -> Any:
+        """Read a slot, initializing it with `default` when it is missing (or None)"""
+        self.reads.add(key)
+        value = self.chunks[hash(key) & self.mask].get(key)
+        if value is None:
+            self[key] = default
+            return default
+        return value
+
+    def write(self, key: str, value: Any) -> None:
+        if key in self.missed and key not in self:
+            self.reads.add(key)
+        self[key] = value
+
+    def forget(self, key: str) -> None:
+        if key in self:
+            del self[key]
+            self.reads.discard(key)
+
+    def collect(self) -> None:
+        """Drop the slots that were not read in the current round, and keep the resulting version"""
+        reads = self.reads
+        # only keys of the store are read (`forget` discards them), so all of them were read when the sizes match
+        if len(reads) != self.size:
+            for key in [key for key in self if key not in reads]:
+                del self[key]
+        self.reads = set()
+        if self.missed:
+            self.missed = set()
+        self.committed = self.snapshot()
+
+    def snapshot(self) -> StateSnapshot:
+        """The current version (read-only); the chunks written from now on are copied"""
+        self.version += 1
+        return StateSnapshot(tuple(self.chunks), self.mask, self.size)
+
+    def restore(self, snapshot: StateSnapshot) -> None:
+        """Go back to a version"""
+        self.chunks = list(snapshot.chunks)
+        self.mask = snapshot.mask
+        self.size = snapshot.size
+        self.version += 1
+        self.owners = [0] * len(self.chunks)
+        self.reads = set()
+        self.missed = set()
+
+    def rollback(self) -> None:
+        """Undo the writes of the current round (go back to the version kept by the last `collect`)"""
+        self.restore(self.committed)
+
+    def __reduce__(self):
+        return PersistentStateStore, (dict(self.items()),)
+
+
+# the stores used in place by `MutableEngine.setup`
+STORES = (StateStore, PersistentStateStore)
+
+# the end of a tape: no name matches it
+_END = object()
+
+
+class Tape:
+    """
+    The alignment of a round, as traced by a `MutableEngine`: the name of every `enter` (None for an `exit`) and the
+    key of the path it leads to. The keys only depend on the names, so a tape can be replayed on any engine.
+    """
+    __slots__ = ("names", "keys")
+
+    def __init__(self, names: List[Optional[str]], keys: List[str]):
+        self.names: Tuple[Any, ...] = (*names, _END)
+        self.keys: Tuple[str, ...] = tuple(keys)
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
 
 class MutableEngine(Engine):
-    def __init__(self):
+    """
+    Engine that mutates its own context while a program runs.
+    Alignment paths are interned in a trie shared by every round (and every device) run on this engine:
+    each path gets an integer id and its message key (`str(stack)`, the format found in `node.data["messages"]`)
+    is computed once, the first time the path is reached. `self.path` always holds the key of the current path.
+    The state is a `StateStore`: a store passed back to `setup` (e.g. `engine.state` after `cooldown`) is used
+    in place, without copying it. With `persistent`, new states are `PersistentStateStore`s instead, whose versions
+    share their unchanged chunks (e.g. to keep the states of past rounds). Both undo the writes of a failed round
+    on `rollback`.
+    With a `fieldpy.internal.codec.MessageCodec`, `cooldown` returns the messages encoded as bytes and `setup`
+    decodes the encoded messages it receives.
+    A round can be traced (see `trace`): the enters and exits of the previous round are replayed from a `Tape`,
+    only moving `self.path` to the precomputed key of each path, as long as the program follows it.
+    """
+    def __init__(self, codec=None, persistent: bool = False):
+        self.codec = codec
+        self.persistent = persistent
+        # path trie: (parent path id, name, counter) -> path id
+        self._children: Dict[Tuple[int, str, int], int] = {}
+        self._segments: List[str] = [""]
+        self._keys: List[str] = [str([])]
+        self.path_ids: List[int] = [0]
+        self.path: str = self._keys[0]
         self.stack: List[str] = []
-        self.state: Dict[str, Any] = {}
+        self.state: StateStore = StateStore()
         self.count_stack: List[int] = [0]
         self.to_send: Dict[str, Any] = {}
         self.messages: Dict[int, Dict[str, Any]] = {}
+        self.aligned_index: Dict[str, Dict[int, Any]] = {}
         self.count: int = 0
         self.id: int = 0
-        self.reads = set()
+        # the tape replayed (None while recording) and the position in it, the names and keys recorded
+        self.tracing: bool = False
+        self._tape: Optional[Tape] = None
+        self._tape_names: Tuple[Any, ...] = ()
+        self._tape_keys: Tuple[str, ...] = ()
+        self._cursor: int = 0
+        self._names: List[Optional[str]] = []
+        self._recorded: List[str] = []
 
     def setup(self, messages: Dict[int, Dict[str, Any]], id: int, state=None) -> None:
-        if state is None:
-            state = {}
         self.stack: List[str] = []
-        self.state: Dict[str, Any] = state.copy()  # Copy the state to avoid modifying the original
+        self.path_ids: List[int] = [0]
+        self.path: str = self._keys[0]
+        # stores are owned by the engine and updated in place, other mappings are copied to avoid modifying them
+        if not isinstance(state, STORES):
+            state = (PersistentStateStore if self.persistent else StateStore)(state or {})
+        self.state: Union[StateStore, PersistentStateStore] = state
         self.count_stack: List[int] = [0]  # Reset counter stack
         self.to_send: Dict[str, Any] = {}
+        if self.codec is not None:
+            messages = self.codec.decode_all(messages)
         self.messages: Dict[int, Dict[str, Any]] = messages
+        self.aligned_index: Dict[str, Dict[int, Any]] = self._index_messages(messages)
         self.count: int = 0  # Reset global counter
         self.id: int = id
-        self.reads = set()
+
+    @staticmethod
+    def _index_messages(messages: Dict[int, Dict[str, Any]]) -> Dict[str, Dict[int, Any]]:
+        """Invert the messages (id -> path -> value) into path -> id -> value"""
+        index: Dict[str, Dict[int, Any]] = {}
+        for id, exported in messages.items():
+            for path, value in exported.items():
+                values = index.get(path)
+                if values is None:
+                    index[path] = {id: value}
+                else:
+                    values[id] = value
+        return index
 
     def enter(self, name: str) -> None:
         counter: int = self.count_stack[-1]
-        self.count_stack[-1] += 1
-        self.stack.append(f"{name}@{counter}")
+        self.count_stack[-1] = counter + 1
+        parent: int = self.path_ids[-1]
+        path_id: Optional[int] = self._children.get((parent, name, counter))
+        if path_id is None:
+            path_id = self._intern(parent, name, counter)
+        self.path_ids.append(path_id)
+        self.stack.append(self._segments[path_id])
+        self.path = self._keys[path_id]
         self.count_stack.append(0)
 
-    def forget(self, stack: List[str]) -> None:
-        if str(stack) in self.state:
-            del self.state[str(stack)]
+    def _intern(self, parent: int, name: str, counter: int) -> int:
+        path_id: int = len(self._keys)
+        segment: str = f"{name}@{counter}"
+        self._segments.append(segment)
+        self._keys.append(str(self.stack + [segment]))
+        self._children[(parent, name, counter)] = path_id
+        return path_id
+
+    def key(self, path: Union[str, List[str]]) -> str:
+        """
+        The message/state key of a path, given either as an interned key (see `self.path`) or as a stack.
+        """
+        if path.__class__ is str:
+            return path
+        if path is self.stack:
+            return self.path
+        return str(path)
 
-    def write_state(self, value: Any, stack: List[str]) -> None:
-        self.state[str(stack)] = value
+    def forget(self, stack: Union[str, List[str]]) -> None:
+        self.state.forget(self.key(stack))
 
-    def read_state(self, stack: List[str]) -> Optional[Any]:
-        self.reads.add(str(stack))
-        return self.state.get(str(stack))
+    def write_state(self, value: Any, stack: Union[str, List[str]]) -> None:
+        self.state.write(self.key(stack), value)
+
+    def read_state(self, stack: Union[str, List[str]]) -> Optional[Any]:
+        return self.state.read(self.key(stack))
+
+    def init_state(self, default: Any, stack: Union[str, List[str]]) -> Any:
+        return self.state.init(self.key(stack), default)
 
     def exit(self) -> None:
         if self.stack:
             self.stack.pop()
             self.count_stack.pop()
+            self.path_ids.pop()
+            self.path = self._keys[self.path_ids[-1]]
+
+    def rollback(self) -> None:
+        """
+        Abandon the current round (e.g. when the program raised): nothing is exported, and the state goes back to
+        its values before the round (values mutated in place are not restored).
+        """
+        rollback = getattr(self.state, "rollback", None)
+        if rollback is not None:
+            rollback()
+        self.to_send = {}
+        self.stack = []
+        self.path_ids = [0]
+        self.path = self._keys[0]
+        self.count_stack = []
+        self.count = 0
+        self.messages = []
+        self.aligned_index = {}
+
+    def trace(self, tape: Optional[Tape] = None) -> bool:
+        """
+        Trace the program run until `untrace`: replay `tape` while the program enters the same functions in the same
+        order, recording the enters and exits from where it does not (or from the start, without a tape).
+        While replaying, `stack`, `path_ids` and `count_stack` are not maintained: they are rebuilt if the program
+        leaves the tape. Only the start of a round (after `setup`) can be traced.
+        :return: Whether the tracing started (False when already tracing or not at the start of a round).
+        """
+        if self.tracing or self.stack or self.count_stack != [0]:
+            return False
+        self.tracing = True
+        if tape is None:
+            self._record([], [])
+        else:
+            self._tape = tape
+            self._tape_names = tape.names
+            self._tape_keys = tape.keys
+            self._cursor = 0
+            # instance attributes: the untraced enter and exit pay nothing for tracing
+            self.enter = self._replay_enter
+            self.exit = self._replay_exit
+        return True
+
+    def untrace(self) -> Tape:
+        """Stop tracing, returning the tape of the round (the replayed tape itself if the round followed all of it)"""
+        del self.enter, self.exit
+        self.tracing = False
+        tape, self._tape = self._tape, None
+        if tape is not None:
+            if self._cursor == len(tape):
+                return tape
+            # the program stopped before the end of the tape
+            return Tape(tape.names[:self._cursor], tape.keys[:self._cursor])
+        names, keys = self._names, self._recorded
+        self._names, self._recorded = [], []
+        return Tape(names, keys)
+
+    def _replay_enter(self, name: str) -> None:
+        cursor = self._cursor
+        if self._tape_names[cursor] == name:
+            self.path = self._tape_keys[cursor]
+            self._cursor = cursor + 1
+        else:
+            self._leave_tape()
+            self.enter(name)
+
+    def _replay_exit(self) -> None:
+        cursor = self._cursor
+        if self._tape_names[cursor] is None:
+            self.path = self._tape_keys[cursor]
+            self._cursor = cursor + 1
+        else:
+            self._leave_tape()
+            self.exit()
+
+    def _leave_tape(self) -> None:
+        """Rebuild the stacks of the part of the tape replayed so far, and record from there"""
+        cursor = self._cursor
+        names = list(self._tape_names[:cursor])
+        self._tape = None
+        for name in names:
+            if name is None:
+                MutableEngine.exit(self)
+            else:
+                MutableEngine.enter(self, name)
+        self._record(names, list(self._tape_keys[:cursor]))
+
+    def _record(self, names: List[Optional[str]], keys: List[str]) -> None:
+        self._names = names
+        self._recorded = keys
+        self.enter = self._record_enter
+        self.exit = self._record_exit
+
+    def _record_enter(self, name: str) -> None:
+        MutableEngine.enter(self, name)
+        self._names.append(name)
+        self._recorded.append(self.path)
+
+    def _record_exit(self) -> None:
+        MutableEngine.exit(self)
+        self._names.append(None)
+        self._recorded.append(self.path)
 
     def send(self, data: Any) -> None:
-        self.to_send[str(self.stack)] = data
+        self.to_send[self.path] = data
 
     def aligned(self) -> List[int]:
-        aligned: List[int] = []
-        for id in self.messages:
-            if str(self.stack) in self.messages[id]:
-                aligned.append(id)
-
-        return aligned
-
-    def aligned_values(self, path: List[str]) -> Dict[int, Any]:
-        aligned: List[int] = self.aligned()
-        path_str: str = str(path)
-        aligned_values: Dict[int, Any] = {}
-        # take the values of the given path
-        for id in aligned:
-            if path_str in self.messages[id]:
-                aligned_values[id] = self.messages[id][path_str]
-        return aligned_values
-
-    def cooldown(self) -> Dict[str, Any]:
+        return list(self.aligned_index.get(self.path, ()))
+
+    def aligned_values(self, path: Union[str, List[str]]) -> Dict[int, Any]:
+        values: Optional[Dict[int, Any]] = self.aligned_index.get(self.key(path))
+        # callers own the returned dict (e.g. `neighbors` adds the local value)
+        return values.copy() if values is not None else {}
+
+    def field(self, value: Any) -> Field:
+        # a lazy view: the received values are sorted (and compacted) only if the field is actually read
+        return Field.view(self.aligned_index.get(self.path) or {}, self.id, value, self)
+
+    def cooldown(self) -> Union[Dict[str, Any], bytes]:
         flatten_messages: Dict[str, Any] = {}
         for key in self.to_send:
             value = self.to_send[key]
-            flatten_messages[key] = value
-        # get state that were not read
-        for key in self.state.copy():
-            if key not in self.reads:
-                del self.state[key]
+            # states are exported with their final value
+            flatten_messages[key] = value.value if isinstance(value, STATES) else value
+        # drop the state that was not read
+        self.state.collect()
         self.to_send = {}
         self.stack = []
+        self.path_ids = [0]
+        self.path = self._keys[0]
         self.count_stack = []  # Reset counter stack
         self.count = 0  # Reset global counter
         self.messages = []
+        self.aligned_index = {}
+        if self.codec is not None:
+            return self.codec.encode(self.id, flatten_messages)
         return flatten_messages
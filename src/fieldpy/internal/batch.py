@@ -0,0 +1,176 @@
+
+"""
+Lockstep engine: it runs one synchronous round of an aggregate program for every device at once.
+Every device executes the same alignment paths, so the engine walks the program a single time and keeps,
+for each path, one column of values (one entry per device) instead of one dictionary per device.
+`neighbors` returns a `BatchField` over the whole network and the operators work on whole columns.
+
+The semantics is the one of synchronous rounds: every device reads the values its neighbors exported in the
+previous round. Programs should choose between values with `mux` (from `fieldpy.calculus`) rather than with
+Python `if` statements on values, which are per device.
+"""
+import random
+from typing import Dict, List, Any, Optional, Union
+
+import numpy as np
+
+from fieldpy.internal import MutableEngine
+from fieldpy.data.batch import BatchField, Topology, as_column, take, to_list, where
+
+
+def _merge(known: np.ndarray, column: Any, default: Any, size: int) -> Any:
+    """The column where `known`, the default elsewhere"""
+    return where(known, column, as_column(default, size), size)
+
+
+class BatchEngine(MutableEngine):
+    """
+    Engine running a round for all the devices of a `Topology` at once.
+    State and exported values are kept by the engine between rounds (not in the nodes data): when the devices
+    change between two rounds, the columns are remapped by id and new devices start without state or messages.
+    """
+    def __init__(self):
+        super().__init__()
+        self.topology: Optional[Topology] = None
+        # what the topology was built from (e.g. an environment version), for runners that reuse it
+        self.topology_version: Any = None
+        self.size: int = 0
+        self.id = None
+        self.state: Dict[str, Any] = {}
+        # slots/exports that only some devices have (devices added since they were written), by path key
+        self.state_known: Dict[str, np.ndarray] = {}
+        self.exports: Dict[str, Any] = {}
+        self.exported: Dict[str, np.ndarray] = {}
+
+    def setup(self, topology: Topology, id: Any = None, state=None) -> None:
+        """
+        Setup the engine for a round over the devices of `topology`.
+        :param topology: The devices of the round and their neighbors.
+        """
+        if self.topology is not None and topology is not self.topology and topology.id_list != self.topology.id_list:
+            self._remap(topology)
+        self.topology = topology
+        self.size = topology.size
+        self.stack = []
+        self.path_ids = [0]
+        self.path = self._keys[0]
+        self.count_stack = [0]
+        self.to_send = {}
+        self.count = 0
+        self.reads = set()
+
+    def _remap(self, topology: Topology) -> None:
+        """Move the columns of the previous devices to the rows of the new ones"""
+        previous = self.topology.index_of
+        rows = np.fromiter((previous.get(id, -1) for id in topology.id_list), dtype=np.int64, count=topology.size)
+        present = rows >= 0
+        rows = np.where(present, rows, 0)
+
+        def remap(columns: Dict[str, Any], known: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+            remapped_known = {}
+            for key, column in columns.items():
+                columns[key] = take(column, rows)
+                mask = present & known[key][rows] if key in known else present
+                if not mask.all():
+                    remapped_known[key] = mask
+            return remapped_known
+
+        if self.topology.size == 0:
+            self.state = {}
+            self.exports = {}
+        self.state_known = remap(self.state, self.state_known)
+        self.exported = remap(self.exports, self.exported)
+
+    def init_state(self, default: Any, stack: Union[str, List[str]]) -> Any:
+        key: str = self.key(stack)
+        self.reads.add(key)
+        column = self.state.get(key)
+        if column is None:
+            column = as_column(default, self.size)
+        elif key in self.state_known:
+            column = _merge(self.state_known.pop(key), column, default, self.size)
+        else:
+            return column
+        self.state[key] = column
+        return column
+
+    def read_state(self, stack: Union[str, List[str]]) -> Optional[Any]:
+        key: str = self.key(stack)
+        self.reads.add(key)
+        return self.state.get(key)
+
+    def write_state(self, value: Any, stack: Union[str, List[str]]) -> None:
+        key: str = self.key(stack)
+        self.state[key] = as_column(value, self.size)
+        self.state_known.pop(key, None)
+
+    def forget(self, stack: Union[str, List[str]]) -> None:
+        key: str = self.key(stack)
+        self.state.pop(key, None)
+        self.state_known.pop(key, None)
+
+    def _aligned_entries(self, key: str) -> np.ndarray:
+        """The CSR entries of the neighbors that exported a value at `key` in the previous round"""
+        topology = self.topology
+        if key not in self.exports:
+            return np.zeros(0, dtype=np.int64)
+        valid = ~topology.self_mask
+        known = self.exported.get(key)
+        if known is not None:
+            valid &= known[topology.cols]
+        return np.flatnonzero(valid)
+
+    def aligned(self) -> List[List[Any]]:
+        """The ids of the neighbors aligned with the current path, one list per device (row of the topology)"""
+        topology = self.topology
+        entries = self._aligned_entries(self.path)
+        bounds = np.searchsorted(entries, topology.indptr).tolist()
+        ids = take(topology.ids, topology.cols[entries]).tolist()
+        return [ids[bounds[row]:bounds[row + 1]] for row in range(self.size)]
+
+    def aligned_values(self, path: Union[str, List[str]]) -> List[Dict[Any, Any]]:
+        """The values of the neighbors aligned with `path` (id -> value), one dict per device (row of the topology)"""
+        topology = self.topology
+        key: str = self.key(path)
+        entries = self._aligned_entries(key)
+        bounds = np.searchsorted(entries, topology.indptr).tolist()
+        cols = topology.cols[entries]
+        ids = take(topology.ids, cols).tolist()
+        values = to_list(take(self.exports[key], cols)) if len(entries) else []
+        return [dict(zip(ids[bounds[row]:bounds[row + 1]], values[bounds[row]:bounds[row + 1]]))
+                for row in range(self.size)]
+
+    def field(self, value: Any) -> BatchField:
+        topology = self.topology
+        local = as_column(take(value, topology.rows), topology.edges)
+        exported = self.exports.get(self.path)
+        if exported is None:
+            return BatchField(topology, local, topology.self_mask, self)
+        values = where(topology.self_mask, local, take(exported, topology.cols), topology.edges)
+        known = self.exported.get(self.path)
+        mask = None if known is None else known[topology.cols] | topology.self_mask
+        return BatchField(topology, values, mask, self)
+
+    def mux(self, condition: Any, then: Any, otherwise: Any) -> Any:
+        return where(condition, then, otherwise, self.size)
+
+    def random_uniform(self) -> np.ndarray:
+        # drawn device by device, so that seeded runs match the ones of `MutableEngine`
+        return np.array([random.random() for _ in range(self.size)])
+
+    def cooldown(self) -> Dict[str, Any]:
+        size = self.size
+        exports = {key: as_column(value, size) for key, value in self.to_send.items()}
+        for key in list(self.state):
+            if key not in self.reads:
+                del self.state[key]
+                self.state_known.pop(key, None)
+        self.exports = exports
+        self.exported = {}
+        self.to_send = {}
+        self.stack = []
+        self.path_ids = [0]
+        self.path = self._keys[0]
+        self.count_stack = []
+        self.count = 0
+        return exports
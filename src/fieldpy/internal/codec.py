@@ -0,0 +1,272 @@
+"""
+Compact binary encoding of the messages exported by a device (path -> value).
+Paths are sent as small integers: each sender numbers its paths and sends the table of the new ones in the packet
+that first uses them (and the whole table in every keyframe). Scalars, strings and tuples of them are packed in
+binary, other values are pickled. In delta mode a packet only holds the values that changed since the previous one
+(and the paths that are no longer exported); every `keyframe_every` packets, a keyframe holds the whole table and
+all the values, so a receiver that missed a packet (or joined later) decodes again from the next keyframe.
+```python
+engine.codec = MessageCodec(delta=True)  # cooldown returns bytes, setup decodes them
+```
+Packet: flags (byte), sequence number, definitions [(id, path)], values [(id, value)], removed ids; numbers are
+unsigned LEB128 varints. Packets from untrusted sources must be decoded with `pickled=False`, which rejects pickled
+values (unpickling can run arbitrary code).
+"""
+import pickle
+import struct
+from typing import Any, Dict, List, Optional, Tuple
+
+# flags of a packet: it holds all the values / all the path definitions of the sender
+FULL = 1
+TABLE = 2
+
+# value tags
+NONE, FALSE, TRUE, INT, FLOAT, STR, TUPLE, PICKLED = range(8)
+
+_double = struct.Struct("<d")
+
+
+def _write_varint(buffer: bytearray, number: int):
+    while number > 0x7F:
+        buffer.append((number & 0x7F) | 0x80)
+        number >>= 7
+    buffer.append(number)
+
+
+def _read_varint(data: bytes, offset: int) -> Tuple[int, int]:
+    number = 0
+    shift = 0
+    while True:
+        byte = data[offset]
+        offset += 1
+        number |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return number, offset
+        shift += 7
+
+
+def _write_value(buffer: bytearray, value: Any, pickled: bool = True):
+    kind = type(value)
+    if value is None:
+        buffer.append(NONE)
+    elif kind is bool:
+        buffer.append(TRUE if value else FALSE)
+    elif kind is int:
+        buffer.append(INT)
+        # zigzag: small negative numbers stay short
+        _write_varint(buffer, value << 1 if value >= 0 else ((-value) << 1) - 1)
+    elif kind is float:
+        buffer.append(FLOAT)
+        buffer += _double.pack(value)
+    elif kind is str:
+        encoded = value.encode()
+        buffer.append(STR)
+        _write_varint(buffer, len(encoded))
+        buffer += encoded
+    elif kind is tuple:
+        buffer.append(TUPLE)
+        _write_varint(buffer, len(value))
+        for item in value:
+            _write_value(buffer, item, pickled)
+    elif not pickled:
+        raise TypeError(f"{type(value).__name__} values cannot be encoded without pickling them")
+    else:
+        pickled = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        buffer.append(PICKLED)
+        _write_varint(buffer, len(pickled))
+        buffer += pickled
+
+
+def _read_value(data: bytes, offset: int, pickled: bool = True) -> Tuple[Any, int]:
+    tag = data[offset]
+    offset += 1
+    if tag == NONE:
+        return None, offset
+    if tag == FALSE:
+        return False, offset
+    if tag == TRUE:
+        return True, offset
+    if tag == INT:
+        number, offset = _read_varint(data, offset)
+        return (number >> 1) if not number & 1 else -((number + 1) >> 1), offset
+    if tag == FLOAT:
+        return _double.unpack_from(data, offset)[0], offset + 8
+    if tag == STR:
+        size, offset = _read_varint(data, offset)
+        return data[offset:offset + size].decode(), offset + size
+    if tag == TUPLE:
+        size, offset = _read_varint(data, offset)
+        items = []
+        for _ in range(size):
+            item, offset = _read_value(data, offset, pickled)
+            items.append(item)
+        return tuple(items), offset
+    if tag == PICKLED and pickled:
+        size, offset = _read_varint(data, offset)
+        return pickle.loads(data[offset:offset + size]), offset + size
+    raise ValueError(f"unknown value tag {tag}")
+
+
+def _same(old: Any, new: Any) -> bool:
+    if old is new:
+        return True
+    if type(old) is not type(new):
+        return False
+    try:
+        return bool(old == new)
+    except (TypeError, ValueError):  # e.g. arrays, whose comparison is not a bool
+        return False
+
+
+class MessageEncoder:
+    """Encodes the successive messages of a device"""
+
+    def __init__(self, delta: bool = True, keyframe_every: int = 16, pickled: bool = True):
+        """
+        :param delta: Send only the values that changed since the previous packet.
+        :param keyframe_every: Send all the definitions (and all the values) every `keyframe_every` packets.
+        :param pickled: Pickle the values that have no binary encoding (otherwise they raise a TypeError).
+        """
+        self.delta = delta
+        self.keyframe_every = keyframe_every
+        self.pickled = pickled
+        self.ids: Dict[str, int] = {}
+        self.sequence = -1
+        self.last: Dict[str, Any] = {}
+
+    def encode(self, messages: Dict[str, Any]) -> bytes:
+        self.sequence += 1
+        keyframe = self.sequence % self.keyframe_every == 0
+        full = keyframe or not self.delta
+        ids = self.ids
+        definitions: List[Tuple[int, str]] = []
+        for path in messages:
+            if path not in ids:
+                ids[path] = len(ids)
+                definitions.append((ids[path], path))
+        if keyframe:
+            definitions = [(path_id, path) for path, path_id in ids.items()]
+        last = self.last
+        if full:
+            values = list(messages.items())
+        else:
+            values = [(path, value) for path, value in messages.items()
+                      if path not in last or not _same(last[path], value)]
+        removed = [ids[path] for path in last if path not in messages] if not full else []
+        self.last = messages
+        buffer = bytearray()
+        buffer.append((FULL if full else 0) | (TABLE if keyframe else 0))
+        _write_varint(buffer, self.sequence)
+        _write_varint(buffer, len(definitions))
+        for path_id, path in definitions:
+            encoded = path.encode()
+            _write_varint(buffer, path_id)
+            _write_varint(buffer, len(encoded))
+            buffer += encoded
+        _write_varint(buffer, len(values))
+        for path, value in values:
+            _write_varint(buffer, ids[path])
+            _write_value(buffer, value, self.pickled)
+        _write_varint(buffer, len(removed))
+        for path_id in removed:
+            _write_varint(buffer, path_id)
+        return bytes(buffer)
+
+
+class MessageDecoder:
+    """
+    Rebuilds the messages of a device from its packets. A packet that cannot be decoded (a delta whose previous
+    packet was missed, or a path whose definition was missed) gives None, until the next keyframe.
+    """
+
+    def __init__(self, pickled: bool = True):
+        """
+        :param pickled: Accept pickled values (otherwise their packets raise a ValueError).
+        """
+        self.pickled = pickled
+        self.paths: Dict[int, str] = {}
+        self.sequence: Optional[int] = None
+        self.view: Dict[str, Any] = {}
+        # the previous packet and its view, for receivers still reading it
+        self.previous: Tuple[Optional[int], Dict[str, Any]] = (None, {})
+
+    def decode(self, packet: bytes) -> Optional[Dict[str, Any]]:
+        flags = packet[0]
+        sequence, offset = _read_varint(packet, 1)
+        if sequence == self.sequence:
+            return self.view
+        if sequence == self.previous[0]:
+            return self.previous[1]
+        if not flags & FULL and (self.sequence is None or sequence != self.sequence + 1):
+            return None
+        paths = {} if flags & TABLE else self.paths
+        count, offset = _read_varint(packet, offset)
+        for _ in range(count):
+            path_id, offset = _read_varint(packet, offset)
+            size, offset = _read_varint(packet, offset)
+            paths[path_id] = packet[offset:offset + size].decode()
+            offset += size
+        self.paths = paths
+        view = {} if flags & FULL else dict(self.view)
+        count, offset = _read_varint(packet, offset)
+        for _ in range(count):
+            path_id, offset = _read_varint(packet, offset)
+            value, offset = _read_value(packet, offset, self.pickled)
+            path = paths.get(path_id)
+            if path is None:
+                return None
+            view[path] = value
+        count, offset = _read_varint(packet, offset)
+        for _ in range(count):
+            path_id, offset = _read_varint(packet, offset)
+            view.pop(paths.get(path_id), None)
+        self.previous = (self.sequence, self.view)
+        self.sequence = sequence
+        self.view = view
+        return view
+
+
+class MessageCodec:
+    """
+    The encoders and decoders of an engine, by device id: a single device only uses its own encoder, an engine
+    shared by the devices of a simulation has one encoder per device and one decoder per sender.
+    """
+
+    def __init__(self, delta: bool = True, keyframe_every: int = 16, shared: bool = True, pickled: bool = True):
+        """
+        :param shared: The engine runs every device (a simulation): the packets are decoded as soon as they are
+        encoded, so a delta is never lost because no neighbor read the previous packet in time.
+        :param pickled: Pickle the values that have no binary encoding, and accept them (see `MessageDecoder`).
+        """
+        self.delta = delta
+        self.keyframe_every = keyframe_every
+        self.shared = shared
+        self.pickled = pickled
+        self.encoders: Dict[Any, MessageEncoder] = {}
+        self.decoders: Dict[Any, MessageDecoder] = {}
+
+    def encode(self, id: Any, messages: Dict[str, Any]) -> bytes:
+        encoder = self.encoders.get(id)
+        if encoder is None:
+            encoder = self.encoders[id] = MessageEncoder(self.delta, self.keyframe_every, self.pickled)
+        packet = encoder.encode(messages)
+        if self.shared:
+            self.decode(id, packet)
+        return packet
+
+    def decode(self, id: Any, packet: bytes) -> Optional[Dict[str, Any]]:
+        decoder = self.decoders.get(id)
+        if decoder is None:
+            decoder = self.decoders[id] = MessageDecoder(self.pickled)
+        return decoder.decode(packet)
+
+    def decode_all(self, messages: Dict[Any, Any]) -> Dict[Any, Dict[str, Any]]:
+        """Decode the packets of the neighbors (id -> packet), leaving out the ones that cannot be decoded yet"""
+        decoded = {}
+        for id, exported in messages.items():
+            if exported.__class__ is bytes:
+                exported = self.decode(id, exported)
+                if exported is None:
+                    continue
+            decoded[id] = exported
+        return decoded
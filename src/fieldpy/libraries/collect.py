@@ -1,35 +1,34 @@
-from fieldpy.calculus import neighbors, aggregate, remember
+from fieldpy.calculus import neighbors, aggregate, remember, mux
 
 
 @aggregate
 def find_parent(potential: float) -> any:
     neighbors_potential = neighbors(potential)
-    min_value = min(neighbors_potential.data.items(), key=lambda x: x[1])
-    if min_value[1] >= potential:
-        return None
-    else:
-        return min_value[0]
+    parent, min_value = neighbors_potential.argmin()
+    return mux(min_value >= potential, None, parent)
 
 @aggregate
-def collect_with(context, potential, local, accumulation):
-    collections = remember(local)
+def collect_with(context, potential, local, accumulation, handle=False):
+    """
+    The accumulation of the local values of the nodes whose potential descends to this one, as a `State`.
+    :param handle: Keep the collection in a `StateHandle`: it is returned as a plain value (faster).
+    """
+    collections = remember(local, handle=handle)
     n_collections = neighbors(collections)
     parents = neighbors(find_parent(potential))
-    zip_operation = zip(parents, n_collections)
-    operations = local
-    for parent, value in zip_operation:
-        if context.id == parent:
-            operations = accumulation(operations, value)
+    # values of the neighbors that chose this node as parent
+    children = n_collections.filter(parents.eq(context.id))
+    operations = children.fold(accumulation, local)
     return collections.update(operations)
 
 @aggregate
-def count_nodes(context, potential):
-    return collect_with(context, potential, 1, lambda x, y: x + y)
+def count_nodes(context, potential, handle=False):
+    return collect_with(context, potential, 1, lambda x, y: x + y, handle)
 
 @aggregate
-def sum_values(context, potential, local):
-    return collect_with(context, potential, local, lambda x, y: x + y)
+def sum_values(context, potential, local, handle=False):
+    return collect_with(context, potential, local, lambda x, y: x + y, handle)
 
 @aggregate
-def collect_or(context, potential, local):
-    return collect_with(context, potential, local, lambda x, y: x or y)
\ No newline at end of file
+def collect_or(context, potential, local, handle=False):
+    return collect_with(context, potential, local, lambda x, y: x or y, handle)
@@ -1,22 +1,27 @@
-from fieldpy.calculus import aggregate, remember, neighbors
-from fieldpy.libraries.utils import min_with_default
+from fieldpy.calculus import aggregate, remember, neighbors, mux
 
 
 @aggregate
-def distance_to(source, distances):
-    gradient = remember(float("inf"))
+def distance_to(source, distances, handle=False):
+    """
+    The distance to the nearest source, as a `State`.
+    :param handle: Keep the gradient in a `StateHandle`: the distance is returned as a plain value (faster).
+    """
+    gradient = remember(float("inf"), handle=handle)
     neighbors_gradients = neighbors(gradient) + distances
-    return gradient.update(0.0 if source else min_with_default(neighbors_gradients.exclude_self(), float("inf")))
+    return gradient.update(mux(source, 0.0, neighbors_gradients.min(float("inf"), include_self=False)))
 
 @aggregate
-def cast_from(source, data, distances):
-    cast_area = remember(data)
-    potential = distance_to(source, distances)
+def cast_from(source, data, distances, handle=False):
+    """
+    The data of the nearest source, as a `State`.
+    :param handle: Keep the states in `StateHandle`s: the data is returned as a plain value (faster).
+    """
+    cast_area = remember(data, handle=handle)
+    potential = distance_to(source, distances, handle)
     neighbors_value = neighbors(cast_area)
     # neighbors potential
     neighbors_potential = neighbors(potential)
     # take the value from the minimum potential
-    values = zip(neighbors_potential, neighbors_value)
-    # select the minimum potential
-    _, result = min(values, key=lambda x: x[0])
-    return cast_area.update(data if source else result)
\ No newline at end of file
+    result = neighbors_value.min_by(neighbors_potential)
+    return cast_area.update(mux(source, data, result))
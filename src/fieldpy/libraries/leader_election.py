@@ -1,29 +1,31 @@
-from fieldpy.calculus import aggregate, remember, neighbors
+from fieldpy.calculus import aggregate, remember, neighbors, mux, random_uniform
 from fieldpy.data import Field
-import random
 
 from fieldpy.libraries.diffusion import distance_to, cast_from
-from fieldpy.libraries.utils import min_with_default
 
 
 @aggregate
-def elect_leader(context, area: float, distances: Field) -> int:
-    result = breaking_using_uids(random_uuid(context), area, distances)
+def elect_leader(context, area: float, distances: Field, handle=False) -> int:
+    """
+    The id of the leader of the area of the device, None if no leader was elected.
+    :param handle: Keep the states in `StateHandle`s (faster): the unique ids hold plain values instead of `State`s.
+    """
+    result = breaking_using_uids(random_uuid(context, handle), area, distances, handle)
     # Return None if no leader was elected (infinite distance), otherwise return the leader ID
-    return None if result[0] == float("inf") else result[1]
+    return mux(result[0] == float("inf"), None, result[1])
 
 @aggregate
-def random_uuid(context):
-    value = remember(random.random())
-    return (value, context.id)
+def random_uuid(context, handle=False):
+    value = remember(random_uniform(), handle=handle)
+    return (value.value if handle else value, context.id)
 
 @aggregate
-def breaking_using_uids(uid, area: float, distances: Field):
+def breaking_using_uids(uid, area: float, distances: Field, handle=False):
     # get the minimum value of the neighbors
-    lead = remember(uid)
+    lead = remember(uid, handle=handle)
     # get the minimum value of the neighbors
-    potential = distance_to(lead == uid, distances)
-    leader_id = cast_from(lead == uid, uid, distances)
+    potential = distance_to(lead.value == uid, distances, handle)
+    leader_id = cast_from(lead.value == uid, uid, distances, handle)
     new_lead = distance_competition(potential, area, uid, lead, distances, leader_id)
     # if the new lead is the same, return the uid
     return lead.update(new_lead)
@@ -35,13 +37,8 @@ def distance_competition(current_distance, area: float, uid, lead, distances: Fi
     neighbors_lead = neighbors(lead)
     condition = (neighbors(current_distance) + distances) < (0.5 * area)
     # filter the one that have the condition
-    lead = neighbors_lead.select(condition)
+    lead = neighbors_lead.filter(condition)
     # take the minimum value, but the comparator just consider both values of the tuple
-    lead = min_with_default(lead, inf)
-    if current_distance > area:
-        return uid
-    elif current_distance >= (0.5 * area):
-        return inf
-    else:
-        return lead
+    lead = lead.min(inf)
+    return mux(current_distance > area, uid, mux(current_distance >= (0.5 * area), inf, lead))
 
@@ -1,10 +1,31 @@
 from functools import reduce
 
 from fieldpy.calculus import aggregate, remember
+from fieldpy.data import Field
+from fieldpy.data.batch import BatchField
 
 def min_with_default(iterable, default=None):
+    if isinstance(iterable, (Field, BatchField)):
+        return iterable.min(default)
     return reduce(lambda x, y: x if x < y else y, iterable, default) if iterable else default
 
+def fold(iterable, accumulation, init):
+    if isinstance(iterable, (Field, BatchField)):
+        return iterable.fold(accumulation, init)
+    return reduce(accumulation, iterable, init)
+
+def argmin(field):
+    """The id and the value of the (first) minimum of a field"""
+    return field.argmin()
+
+def min_by(field, keys):
+    """The value of `field` where `keys` is minimum"""
+    return field.min_by(keys)
+
 @aggregate
-def counter():
-    return remember(0).update_fn(lambda x: x + 1)
\ No newline at end of file
+def counter(handle=False):
+    """
+    The rounds run by the device, as a `State`.
+    :param handle: Count in a `StateHandle`: the count is returned as a plain value (faster).
+    """
+    return remember(0, handle=handle).update_fn(lambda x: x + 1)
@@ -0,0 +1,169 @@
+"""
+Profiling of aggregate programs. While a `Profiler` is enabled, every `@aggregate` function call is timed (per
+function, per alignment path and per call stack) and every device round run by the simulator runners is measured
+(latency, exported messages and their payload per path, state slots):
+```python
+profiler = Profiler()
+simulator.run(100, profiler=profiler)  # or: with profiling(profiler): ...
+print(profiler.report())
+profiler.write_folded("run.folded")  # flamegraph.pl / speedscope input
+```
+When no profiler is enabled, `@aggregate` functions only pay a global lookup per call.
+Rounds run on several threads at once (e.g. by `fieldpy.simulator.runner.threaded_program_runner`) are profiled
+too: every thread keeps its own call stack, and the statistics are updated under a lock. The times of a thread
+include the time it waits for the others, unless they run in parallel (on free-threaded builds of Python).
+"""
+import pickle
+import threading
+from array import array
+import statistics
+from time import perf_counter
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from fieldpy.calculus import profiling
+
+
+def payload_size(value: Any) -> int:
+    """The size in bytes of a message value, as pickled (0 if it cannot be pickled)"""
+    try:
+        return len(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL))
+    except (pickle.PicklingError, TypeError, AttributeError):
+        return 0
+
+
+def _shorten(path: str, width: int = 68) -> str:
+    return path if len(path) <= width else "..." + path[3 - width:]
+
+
+class Profiler:
+    """Statistics of the aggregate functions and of the device rounds run (by any thread) while the profiler is enabled"""
+
+    def __init__(self, payloads: bool = True):
+        """
+        :param payloads: Measure the size of the exported messages (by pickling them, which takes some time).
+        """
+        self.payloads = payloads
+        # name -> [calls, total time, self time]
+        self.functions: Dict[str, List[float]] = {}
+        # alignment path -> [calls, total time]
+        self.paths: Dict[str, List[float]] = {}
+        # call stack (names of the aggregate functions) -> self time
+        self.stacks: Dict[Tuple[str, ...], float] = {}
+        # alignment path -> [exported messages, payload bytes]
+        self.exchanges: Dict[str, List[int]] = {}
+        # latency of every round, and device id -> [rounds, total latency]
+        self.latencies = array("d")
+        self.devices: Dict[Any, List[float]] = {}
+        # device id -> state slots after its last round
+        self.state_slots: Dict[Any, int] = {}
+        # the call stack of every thread: the names of the aggregate functions and the time of their children
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def _stack(self) -> Tuple[List[str], List[float]]:
+        local = self._local
+        try:
+            return local.names, local.children
+        except AttributeError:
+            local.names = []
+            local.children = [0.0]
+            return local.names, local.children
+
+    def call(self, engine: Any, name: str, func: Callable, args: tuple, kwargs: dict) -> Any:
+        """Run an aggregate function, as `@aggregate` does, timing it"""
+        engine.enter(name)
+        path = getattr(engine, "path", None)
+        names, children_times = self._stack()
+        names.append(name)
+        children_times.append(0.0)
+        start = perf_counter()
+        try:
+            result = func(*args, **kwargs)
+        finally:
+            elapsed = perf_counter() - start
+            children = children_times.pop()
+            children_times[-1] += elapsed
+            stack = tuple(names)
+            names.pop()
+            with self._lock:
+                self._record_call(name, path, stack, elapsed, children)
+        engine.exit()
+        return result
+
+    def _record_call(self, name: str, path: Optional[str], stack: Tuple[str, ...], elapsed: float, children: float):
+        function = self.functions.get(name)
+        if function is None:
+            function = self.functions[name] = [0, 0.0, 0.0]
+        function[0] += 1
+        function[1] += elapsed
+        function[2] += elapsed - children
+        self.stacks[stack] = self.stacks.get(stack, 0.0) + elapsed - children
+        if path is not None:
+            calls = self.paths.get(path)
+            if calls is None:
+                calls = self.paths[path] = [0, 0.0]
+            calls[0] += 1
+            calls[1] += elapsed
+
+    def round(self, id: Any, elapsed: float, messages: Dict[str, Any], state: Optional[Dict[str, Any]]):
+        """Record a device round: its latency, its exported messages (path -> value) and its state"""
+        if messages.__class__ is bytes:
+            # encoded by a `MessageCodec`: one packet for all the paths
+            messages = {"<packet>": messages}
+        # the payloads are measured before taking the lock, which the other threads may be waiting for
+        sizes = [len(value) if value.__class__ is bytes else payload_size(value) for value in messages.values()] \
+            if self.payloads else [0] * len(messages)
+        with self._lock:
+            self.latencies.append(elapsed)
+            device = self.devices.get(id)
+            if device is None:
+                device = self.devices[id] = [0, 0.0]
+            device[0] += 1
+            device[1] += elapsed
+            for path, size in zip(messages, sizes):
+                exchanges = self.exchanges.get(path)
+                if exchanges is None:
+                    exchanges = self.exchanges[path] = [0, 0]
+                exchanges[0] += 1
+                exchanges[1] += size
+            if state is not None:
+                self.state_slots[id] = len(state)
+
+    def reset(self):
+        self.__init__(self.payloads)
+
+    def folded(self) -> List[str]:
+        """The self time of every call stack, in microseconds, in the folded format of flame graphs"""
+        return [f"{';'.join(stack)} {round(time * 1e6)}" for stack, time in sorted(self.stacks.items())]
+
+    def write_folded(self, path: str):
+        with open(path, "w") as output:
+            output.write("\n".join(self.folded()) + "\n")
+
+    def report(self, top: int = 20) -> str:
+        """A table of the `top` functions and paths by time, with the exchanges, round latencies and state slots"""
+        lines = [f"{'function':<40}{'calls':>10}{'total ms':>12}{'self ms':>12}{'mean us':>10}"]
+        for name, (calls, total, own) in sorted(self.functions.items(), key=lambda item: -item[1][2])[:top]:
+            lines.append(f"{name:<40}{calls:>10}{total * 1e3:>12.2f}{own * 1e3:>12.2f}{total / calls * 1e6:>10.1f}")
+        lines.append("")
+        lines.append(f"{'path':<70}{'calls':>10}{'total ms':>12}")
+        for path, (calls, total) in sorted(self.paths.items(), key=lambda item: -item[1][1])[:top]:
+            lines.append(f"{_shorten(path):<70}{calls:>10}{total * 1e3:>12.2f}")
+        if self.exchanges:
+            lines.append("")
+            lines.append(f"{'exchange path':<70}{'exports':>10}{'bytes':>12}{'mean':>10}")
+            for path, (exports, size) in sorted(self.exchanges.items(), key=lambda item: -item[1][1])[:top]:
+                lines.append(f"{_shorten(path):<70}{exports:>10}{size:>12}{size / exports:>10.1f}")
+        rounds = self.latencies
+        if rounds:
+            means = [total / count for count, total in self.devices.values()]
+            quantiles = statistics.quantiles(rounds, n=20) if len(rounds) > 1 else [rounds[0]] * 19
+            lines.append("")
+            lines.append(f"rounds: {len(rounds)} of {len(self.devices)} devices, latency us "
+                         f"mean {statistics.fmean(rounds) * 1e6:.1f} p50 {quantiles[9] * 1e6:.1f} "
+                         f"p95 {quantiles[18] * 1e6:.1f} max {max(rounds) * 1e6:.1f}; mean per device from "
+                         f"{min(means) * 1e6:.1f} to {max(means) * 1e6:.1f}")
+        if self.state_slots:
+            slots = list(self.state_slots.values())
+            lines.append(f"state slots per device: mean {statistics.fmean(slots):.1f} max {max(slots)}")
+        return "\n".join(lines)
@@ -1,6 +1,12 @@
-import heapq
+import random
 import uuid
-from typing import Dict, Callable, Any, Optional, Tuple, List
+from typing import Dict, Callable, Any, Optional, Tuple, List, Iterable
+
+from fieldpy.simulator.events import Event, EventQueue
+from fieldpy.simulator.spatial import SpatialIndex, GridIndex
+
+# a batch of movements where more than 1 / BATCH_CLEAR_FRACTION of the nodes moved clears the whole neighbor cache
+BATCH_CLEAR_FRACTION = 8
 
 
 class Node:
@@ -9,14 +15,29 @@ class Node:
             self.id = 0
         else:
             self.id = node_id or str(uuid.uuid4())
-        self.position = position
+        self._position = position
         self.data = data
         self.environment = None
 
+    @property
+    def position(self) -> Tuple[float, ...]:
+        return self._position
+
+    @position.setter
+    def position(self, position: Tuple[float, ...]):
+        """Move the node: its environment is notified, so the spatial index and the neighbor cache follow it"""
+        self._position = position
+        if self.environment is not None:
+            self.environment.node_updated(self)
+
+    def _place(self, position: Tuple[float, ...]):
+        # move the node without notifying the environment (the caller calls `nodes_updated` for many nodes at once)
+        self._position = position
+
     def update(self, new_position: Optional[Tuple[float, ...]] = None, new_data: Any = None):
         """Update node position and/or data"""
         if new_position is not None:
-            self.position = new_position
+            self._place(new_position)
         if new_data is not None:
             self.data = new_data
         if self.environment:
@@ -30,37 +51,187 @@ class Node:
 
 
 class Environment:
-    def __init__(self, neighborhood_function: Callable[[Node, List[Node]], List[Node]] = None):
+    def __init__(self, neighborhood_function: Callable[[Node, List[Node]], List[Node]] = None,
+                 spatial_index: Optional[SpatialIndex] = None, cache_neighbors: Optional[bool] = None,
+                 arrays: Any = None):
+        """
+        :param cache_neighbors: Keep the neighbor lists until a change of the nodes may affect them. By default
+        only the neighborhoods depending on the positions alone are cached, namely the functions exposing `query`
+        or `affected` (e.g. `radius_neighborhood`): plain functions are called every time, as they may depend on
+        the data, on the time or on randomness.
+        :param arrays: A `fieldpy.simulator.storage.NodeArrays`: the nodes built by `create_node` are then stored
+        in its arrays (struct-of-arrays), with dense integer ids.
+        """
         self.nodes: Dict[any, Node] = {}
-        self.neighborhood_function = neighborhood_function or self.default_neighborhood
+        self.arrays = arrays
+        self.spatial_index: SpatialIndex = spatial_index or GridIndex()
+        self._custom_index = spatial_index is not None
+        self._query = None
+        self._affected = None
+        self._positional = False
+        # neighbor lists by node id, dropped when a membership change or a movement may affect them
+        self.cache_neighbors = cache_neighbors
+        self.neighbor_cache: Dict[any, List[Node]] = {}
+        self.cache_hits = 0
+        self.cache_misses = 0
+        # incremented every time some neighbor list may have changed
+        self.version = 0
+        self.neighborhood_function = None
+        self.set_neighborhood_function(neighborhood_function or self.default_neighborhood)
+
+    def __getstate__(self):
+        # the neighbor cache is not saved (it is rebuilt on demand)
+        state = dict(self.__dict__)
+        state["neighbor_cache"] = {}
+        return state
 
     def node_list(self) -> List[Node]:
         """Return a list of all nodes in the environment"""
         return list(self.nodes.values())
 
+    def create_node(self, position: Tuple[float, ...], data: Any = None, id = None) -> Node:
+        """Create a node (in the node arrays, if any) and add it to the environment"""
+        if self.arrays is None:
+            node = Node(position, data, id)
+        else:
+            node = self.arrays.create_node(position, data, id)
+        self.add_node(node)
+        return node
+
     def add_node(self, node: Node):
         """Add a node to the environment"""
         self.nodes[node.id] = node
         node.environment = self
+        self.spatial_index.insert(node)
+        self._invalidate(node.id, node.position)
 
     def remove_node(self, node_id: str):
         """Remove a node from the environment"""
         if node_id in self.nodes:
-            self.nodes[node_id].environment = None
-            del self.nodes[node_id]
+            position = self.spatial_index.position_of(node_id)
+            node = self.nodes.pop(node_id)
+            node.environment = None
+            if self.arrays is not None and getattr(node, "arrays", None) is self.arrays:
+                self.arrays.release(node_id)
+            self.spatial_index.remove(node_id)
+            self._invalidate(node_id, position)
 
     def node_updated(self, node: Node):
-        """Called when a node is updated"""
-        # Could trigger neighborhood recalculations or other actions
-        pass
+        """Called when a node is updated (assigning `node.position` calls it)"""
+        old_position = self.spatial_index.position_of(node.id)
+        if old_position == node.position:
+            if not self._positional:
+                # the neighborhoods of plain functions may depend on the data
+                self.clear_neighbor_cache()
+            return
+        self.spatial_index.update(node)
+        self._invalidate(node.id, old_position, node.position)
+
+    def nodes_updated(self, nodes: Iterable[Node]):
+        """
+        Called when many nodes were updated at once (e.g. by `fieldpy.simulator.mobility`): the spatial index is
+        refreshed node by node, the neighbor cache in one batch (it is cleared when many nodes moved).
+        """
+        index = self.spatial_index
+        moved = []
+        for node in nodes:
+            old_position = index.position_of(node.id)
+            position = node.position
+            if old_position != position:
+                index.update(node)
+                moved.append((node.id, old_position, position))
+        if not moved:
+            return
+        self.version += 1
+        cache = self.neighbor_cache
+        if not cache:
+            return
+        if self._affected is None or len(moved) * BATCH_CLEAR_FRACTION > len(self.nodes):
+            cache.clear()
+            return
+        for node_id, old_position, position in moved:
+            cache.pop(node_id, None)
+            for other in self._affected(old_position, index):
+                cache.pop(other.id, None)
+            for other in self._affected(position, index):
+                cache.pop(other.id, None)
+
+    def _invalidate(self, node_id: any, *positions: Tuple[float, ...]):
+        """Drop the cached neighbor lists that a node appearing at or leaving `positions` may change"""
+        self.version += 1
+        cache = self.neighbor_cache
+        if not cache:
+            return
+        if self._affected is None:
+            cache.clear()
+            return
+        cache.pop(node_id, None)
+        for position in positions:
+            if position is not None:
+                for other in self._affected(position, self.spatial_index):
+                    cache.pop(other.id, None)
+
+    def clear_neighbor_cache(self):
+        """Drop every cached neighbor list"""
+        self.neighbor_cache.clear()
+        self.version += 1
+
+    def set_spatial_index(self, index: SpatialIndex):
+        """Set the spatial index used to answer neighborhood queries (it is filled with the current nodes)"""
+        index.clear()
+        for node in self.nodes.values():
+            index.insert(node)
+        self.spatial_index = index
+        self._custom_index = True
 
     def set_neighborhood_function(self, func: Callable[[Node, List[Node]], List[Node]]):
-        """Set the function that determines neighborhoods"""
+        """
+        Set the function that determines neighborhoods.
+        Functions exposing a `query(node, index)` method (e.g. `radius_neighborhood`) are answered through the
+        spatial index; unless an index was set explicitly, the one suggested by `func.create_index()` is used.
+        Functions exposing an `affected(position, index)` method let the neighbor cache drop only the lists
+        changed by a movement, otherwise every movement clears the whole cache. Both declare that the neighborhood
+        depends on the positions alone, so it is cached (see `cache_neighbors`).
+        """
         self.neighborhood_function = func
+        self._query = getattr(func, "query", None)
+        self._affected = getattr(func, "affected", None)
+        self._positional = self._query is not None or self._affected is not None
+        create_index = getattr(func, "create_index", None)
+        if create_index is not None and not self._custom_index:
+            index = create_index()
+            for node in self.nodes.values():
+                index.insert(node)
+            self.spatial_index = index
+        self.clear_neighbor_cache()
+
+    @property
+    def neighbors_cached(self) -> bool:
+        """
+        Whether the neighbor lists are cached (see `cache_neighbors`): only then `version` changes every time a
+        neighbor list may change.
+        """
+        return self._positional if self.cache_neighbors is None else self.cache_neighbors
 
     def get_neighbors(self, node: Node) -> List[Node]:
-        """Get neighbors for a node using the neighborhood function"""
-        return self.neighborhood_function(node, list(self.nodes.values()))
+        """
+        Get neighbors for a node using the neighborhood function.
+        The returned list may be shared with the neighbor cache, so it must not be modified.
+        """
+        caching = self.neighbors_cached
+        if caching:
+            neighbors = self.neighbor_cache.get(node.id)
+            if neighbors is not None:
+                self.cache_hits += 1
+                return neighbors
+            self.cache_misses += 1
+        if self._query is not None:
+            neighbors = self._query(node, self.spatial_index)
+        else:
+            neighbors = self.neighborhood_function(node, list(self.nodes.values()))
+        if caching and node.id in self.nodes:
+            self.neighbor_cache[node.id] = neighbors
+        return neighbors
 
     @staticmethod
     def default_neighborhood(node: Node, all_nodes: List[Node]) -> List[Node]:
@@ -68,47 +239,56 @@ class Environment:
         return []
 
 
-class Event:
-    def __init__(self, time: float, action: Callable[..., None], *args, **kwargs):
-        self.time = time
-        self.action = action
-        self.args = args
-        self.kwargs = kwargs
-
-    def execute(self):
-        """Execute the event's action"""
-        return self.action(*self.args, **self.kwargs)
-
-    def __lt__(self, other):
-        """For priority queue ordering"""
-        return self.time < other.time
-
-
 class Simulator:
-    def __init__(self):
-        self.event_queue = []
+    def __init__(self, event_queue: Optional[EventQueue] = None):
+        """
+        :param event_queue: The queue of the events (a new `EventQueue` by default).
+        """
+        self.event_queue: EventQueue = event_queue if event_queue is not None else EventQueue()
         self.current_time = 0.0
         self.running = False
         self.environment = Environment()
 
-    def schedule_event(self, time_delta: float, action: Callable[..., None], *args, **kwargs):
-        """Schedule an event to occur after time_delta"""
-        event_time = self.current_time + time_delta
-        event = Event(event_time, action, *args, **kwargs)
-        heapq.heappush(self.event_queue, event)
-        return event
+    def schedule_event(self, time_delta: float, action: Callable[..., None], *args, **kwargs) -> Event:
+        """Schedule an event to occur after time_delta (the returned event can be cancelled)"""
+        return self.event_queue.push(Event(self.current_time + time_delta, action, *args, **kwargs))
 
-    def run(self, until_time: Optional[float] = None):
-        """Run the simulation until the specified time or until no more events"""
-        self.running = True
+    def schedule_rounds(self, program: Callable, time_delta: float, nodes: Optional[List[Node]] = None,
+                        shuffle: bool = False, synchronous: bool = False, jitter: float = 0.0,
+                        seed: Any = None, delay: float = 0.0):
+        """
+        Run the program every `time_delta` for many nodes, with one event per round instead of one per node.
+        :param program: The aggregate program.
+        :param time_delta: The time between two rounds.
+        :param nodes: The nodes of the rounds (every node of the environment, in insertion order, if None).
+        :param shuffle: Run the nodes in a new random order every round.
+        :param synchronous: Every node reads the messages exported in the previous round, whatever the order.
+        :param jitter: Every round, each node fires at a random offset in [0, jitter) from the round time, in an
+        event of its own (it should be smaller than `time_delta`).
+        :param seed: The seed of the shuffles and of the jitter, for reproducible rounds.
+        :param delay: The time of the first round, from now.
+        """
+        from fieldpy.simulator.runner import round_program_runner
+        return self.schedule_event(delay, round_program_runner, self, time_delta, program, nodes, shuffle,
+                                   synchronous, jitter, random.Random(seed))
 
-        while self.running and self.event_queue:
-            event = heapq.heappop(self.event_queue)
+    def run(self, until_time: Optional[float] = None, profiler: Any = None):
+        """
+        Run the simulation until the specified time or until no more events
+        :param profiler: A `fieldpy.profiling.Profiler` enabled while the simulation runs (its report is ready when
+        `run` returns).
+        """
+        if profiler is not None:
+            from fieldpy.calculus import profiling
+            with profiling(profiler):
+                return self.run(until_time)
+        self.running = True
+        queue = self.event_queue
 
-            if until_time is not None and event.time > until_time:
-                heapq.heappush(self.event_queue, event)  # Put the event back
+        while self.running:
+            event = queue.pop(until_time)
+            if event is None:
                 break
-
             self.current_time = event.time
             event.execute()
 
@@ -120,13 +300,13 @@ class Simulator:
 
     def reset(self):
         """Reset the simulator"""
-        self.event_queue = []
+        self.event_queue.clear()
         self.current_time = 0.0
         self.running = False
-        self.environment = Environment()
+        # the new environment stores its nodes like the previous one
+        arrays = self.environment.arrays
+        self.environment = Environment(arrays=None if arrays is None else arrays.empty())
 
     def create_node(self, position: Tuple[float, ...], data: Any = None, id = None) -> Node:
         """Helper method to create and add a node to the environment"""
-        node = Node(position, data, id)
-        self.environment.add_node(node)
-        return node
+        return self.environment.create_node(position, data, id)
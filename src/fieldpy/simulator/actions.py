@@ -1,8 +1,13 @@
+from fieldpy.simulator.events import register_action
 
+
+@register_action
 def move_with_velocity(simulator, delta_time, node, velocity):
     """
-    Move the node with a given velocity.
+    Move the node with a given velocity (until it is removed from the environment).
     """
+    if simulator.environment.nodes.get(node.id) is not node:
+        return
     # Update the node's position based on its velocity and the delta time
     (x, y) = node.position
     (vx, vy) = velocity
@@ -0,0 +1,91 @@
+"""
+Checkpoints of a running simulation: `save` writes the whole simulator (current time, pending events, nodes with
+their positions and data, engine state and messages, neighborhood and spatial index) with the state of the global
+random generators, and `load` restores it, ready to `run` again.
+```python
+simulator.schedule_event(600.0, checkpoint_runner, simulator, 600.0, "run.ckpt")
+simulator.run(100000)
+...
+simulator = load("run.ckpt")
+simulator.run(100000)
+```
+A checkpoint is a short header followed by one pickle stream (optionally gzip-compressed), so it can be written to
+and read from any binary stream.
+The actions of the events are saved by reference: the module-level functions by their qualified name, the actions
+registered with `fieldpy.simulator.events.register_action` (e.g. closures) by their registered name, which must be
+registered again before loading. The aggregate programs must be module-level functions too.
+"""
+import gzip
+import os
+import pickle
+import random
+from typing import BinaryIO, Union
+
+import numpy as np
+
+from fieldpy.simulator import Simulator
+from fieldpy.simulator.events import register_action
+
+MAGIC = b"FIELDPY-CHECKPOINT"
+VERSION = 2
+# the flag of the header telling that the pickle stream is gzip-compressed
+COMPRESSED = 1
+
+
+def _write(simulator: Simulator, stream: BinaryIO, compress: bool):
+    stream.write(MAGIC + bytes([VERSION, COMPRESSED if compress else 0]))
+    state = (simulator, random.getstate(), np.random.get_state())
+    try:
+        if compress:
+            with gzip.GzipFile(fileobj=stream, mode="wb", compresslevel=1) as compressed:
+                pickle.dump(state, compressed, protocol=pickle.HIGHEST_PROTOCOL)
+        else:
+            pickle.dump(state, stream, protocol=pickle.HIGHEST_PROTOCOL)
+    except (pickle.PicklingError, TypeError, AttributeError) as error:
+        raise TypeError(f"the simulator cannot be checkpointed ({error}): event actions and aggregate programs must be "
+                        f"module-level functions or registered with register_action") from error
+
+
+def save(simulator: Simulator, target: Union[str, BinaryIO], compress: bool = False):
+    """
+    Write a checkpoint of the simulator.
+    :param target: A path (written atomically: a crash while writing leaves the previous checkpoint in place) or a
+    binary stream.
+    :param compress: Compress the checkpoint with gzip (at the fastest level).
+    """
+    if not isinstance(target, str):
+        _write(simulator, target, compress)
+        return
+    temporary = target + ".tmp"
+    with open(temporary, "wb") as stream:
+        _write(simulator, stream, compress)
+    os.replace(temporary, target)
+
+
+def load(source: Union[str, BinaryIO]) -> Simulator:
+    """Restore a simulator (and the state of the global random generators) from a checkpoint"""
+    if isinstance(source, str):
+        with open(source, "rb") as stream:
+            return load(stream)
+    header = source.read(len(MAGIC) + 2)
+    if header[:len(MAGIC)] != MAGIC:
+        raise ValueError("not a fieldpy checkpoint")
+    version, flags = header[len(MAGIC):]
+    if version != VERSION:
+        raise ValueError(f"unsupported checkpoint version {version}")
+    if flags & COMPRESSED:
+        with gzip.GzipFile(fileobj=source, mode="rb") as compressed:
+            simulator, python_state, numpy_state = pickle.load(compressed)
+    else:
+        simulator, python_state, numpy_state = pickle.load(source)
+    random.setstate(python_state)
+    np.random.set_state(numpy_state)
+    simulator.running = False
+    return simulator
+
+
+@register_action
+def checkpoint_runner(simulator: Simulator, time_delta: float, path: str, compress: bool = False):
+    """Write a checkpoint of the simulator to `path` every `time_delta` (the restored simulator keeps doing it)"""
+    simulator.schedule_event(time_delta, checkpoint_runner, simulator, time_delta, path, compress)
+    save(simulator, path, compress)
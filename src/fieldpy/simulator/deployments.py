@@ -2,6 +2,7 @@ import random
 import math
 from fieldpy.simulator import Simulator
 from fieldpy.simulator import Node
+from fieldpy.simulator.events import register_action
 from typing import Tuple
 
 
@@ -48,10 +49,13 @@ def random_in_circle(simulator: Simulator, num_nodes: int, radius: float):
         y = r * math.sin(angle)
         simulator.create_node((x, y), id = index)
 
+@register_action
 def gaussian_movement(simulator: Simulator, node: Node, mean: Tuple[float, ...], stddev: float):
     """
-    Move a node according to a Gaussian distribution.
+    Move a node according to a Gaussian distribution (until it is removed from the environment).
     """
+    if simulator.environment.nodes.get(node.id) is not node:
+        return
     new_position = tuple(
         random.gauss(mean[i], stddev) for i in range(len(mean))
     )
@@ -0,0 +1,143 @@
+"""
+Event queues of the simulator.
+Events are ordered by time and, for the same time, by scheduling order (a sequence number assigned by the queue).
+The event returned by `Simulator.schedule_event` is also its handle: `event.cancel()` removes it in O(1), lazily
+(a cancelled event is skipped when it reaches the head of the queue, and the queue is compacted once enough of
+its entries are cancelled).
+Actions registered with `register_action` are saved by name in the checkpoints (see `fieldpy.simulator.checkpoint`),
+so that they can be restored even when they are closures or are moved to another module.
+"""
+import heapq
+from typing import Callable, Dict, List, Optional, Tuple
+
+# smallest number of cancelled entries that triggers a compaction (when they are also most of the queue)
+COMPACT_MIN_DEAD = 64
+
+# the registered actions, by name, and their names
+ACTIONS: Dict[str, Callable[..., None]] = {}
+_NAMES: Dict[Callable[..., None], str] = {}
+
+
+def register_action(action: Optional[Callable[..., None]] = None, name: Optional[str] = None):
+    """
+    Register an event action under a name (its qualified name by default), returning it, so it can be used as a
+    decorator. Registering another action under a taken name replaces it.
+    """
+    if action is None:
+        return lambda decorated: register_action(decorated, name)
+    name = name or f"{action.__module__}.{action.__qualname__}"
+    ACTIONS[name] = action
+    _NAMES[action] = name
+    return action
+
+
+class Event(object):
+    __slots__ = ("time", "sequence", "action", "args", "kwargs", "queue")
+
+    def __init__(self, time: float, action: Callable[..., None], *args, **kwargs):
+        self.time = time
+        self.sequence = 0
+        self.action = action
+        self.args = args
+        self.kwargs = kwargs
+        # the queue holding the event, None once it is executed or cancelled
+        self.queue: Optional['EventQueue'] = None
+
+    def execute(self):
+        """Execute the event's action"""
+        return self.action(*self.args, **self.kwargs)
+
+    def cancel(self) -> bool:
+        """Cancel the event, returning whether it was still pending"""
+        queue = self.queue
+        if queue is None:
+            return False
+        self.queue = None
+        queue._cancelled()
+        return True
+
+    @property
+    def pending(self) -> bool:
+        return self.queue is not None
+
+    def __getstate__(self):
+        action = self.action
+        try:
+            action = _NAMES.get(action, action)
+        except TypeError:  # an unhashable callable is never registered
+            pass
+        return self.time, self.sequence, action, self.args, self.kwargs, self.queue
+
+    def __setstate__(self, state):
+        self.time, self.sequence, action, self.args, self.kwargs, self.queue = state
+        if isinstance(action, str):
+            if action not in ACTIONS:
+                raise KeyError(f"the action {action} is not registered")
+            action = ACTIONS[action]
+        self.action = action
+
+    def __lt__(self, other):
+        """For priority queue ordering"""
+        return (self.time, self.sequence) < (other.time, other.sequence)
+
+
+class EventQueue(object):
+    """
+    Binary heap of events. Entries are (time, sequence, event) tuples, so that the heap compares them in C.
+    """
+
+    def __init__(self):
+        self.heap: List[Tuple[float, int, Event]] = []
+        self.sequence = 0
+        self.dead = 0  # cancelled entries still in the heap
+
+    def __len__(self) -> int:
+        return len(self.heap) - self.dead
+
+    def __bool__(self) -> bool:
+        return len(self.heap) > self.dead
+
+    def push(self, event: Event) -> Event:
+        self.sequence += 1
+        event.sequence = self.sequence
+        event.queue = self
+        heapq.heappush(self.heap, (event.time, self.sequence, event))
+        return event
+
+    def peek(self) -> Optional[Event]:
+        """The next event, without removing it (None if the queue is empty)"""
+        heap = self.heap
+        while heap and heap[0][2].queue is not self:
+            heapq.heappop(heap)
+            self.dead -= 1
+        return heap[0][2] if heap else None
+
+    def pop(self, until: Optional[float] = None) -> Optional[Event]:
+        """Remove and return the next event (None if the queue is empty or the event is after `until`)"""
+        heap = self.heap
+        while heap:
+            entry = heap[0]
+            event = entry[2]
+            if event.queue is not self:
+                heapq.heappop(heap)
+                self.dead -= 1
+            elif until is not None and entry[0] > until:
+                return None
+            else:
+                heapq.heappop(heap)
+                event.queue = None
+                return event
+        return None
+
+    def _cancelled(self):
+        self.dead += 1
+        if self.dead >= COMPACT_MIN_DEAD and self.dead * 2 > len(self.heap):
+            self.heap = [entry for entry in self.heap if entry[2].queue is self]
+            heapq.heapify(self.heap)
+            self.dead = 0
+
+    def clear(self):
+        for _, _, event in self.heap:
+            event.queue = None
+        self.heap = []
+        self.dead = 0
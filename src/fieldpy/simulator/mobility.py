@@ -0,0 +1,214 @@
+"""
+Bulk mobility: a `Mobility` moves many nodes under a `MobilityModel` with array operations, in a single event
+per time step (see `mobility_runner`), and notifies the environment of the moved nodes in one batch.
+```python
+mobility = Mobility(simulator.environment.node_list(), Bounded(RandomWaypoint((0, 0), (1, 1), (0.01, 0.05)), (0, 0), (1, 1)))
+simulator.schedule_event(0.0, mobility_runner, simulator, 0.1, mobility)
+```
+"""
+from abc import ABC, abstractmethod
+from typing import Any, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from fieldpy.simulator import Simulator, Node, Environment
+from fieldpy.simulator.events import register_action
+
+
+class MobilityModel(ABC):
+    """
+    A movement rule for many nodes at once. Positions are (n, d) arrays, one row per node; models that keep
+    per-node state (velocities, waypoints, ...) keep it in arrays aligned with the rows.
+    """
+
+    def start(self, positions: np.ndarray, rng: np.random.Generator) -> None:
+        """Initialize the per-node state for the nodes at `positions`"""
+        pass
+
+    @abstractmethod
+    def step(self, positions: np.ndarray, time_delta: float, rng: np.random.Generator) -> np.ndarray:
+        """The positions after `time_delta`"""
+        pass
+
+    def keep(self, rows: np.ndarray) -> None:
+        """Keep only the per-node state of the given rows (the other nodes left the environment)"""
+        pass
+
+    def bounced(self, crossed: np.ndarray) -> None:
+        """Called by `Bounded` with the (n, d) mask of the coordinates reflected on the border of the area"""
+        pass
+
+
+class ConstantVelocity(MobilityModel):
+    """Every node moves with its own constant velocity (one for all of them, or an (n, d) array)"""
+
+    def __init__(self, velocity: Any):
+        self.velocity = np.asarray(velocity, dtype=float)
+
+    def start(self, positions, rng):
+        self.velocity = np.broadcast_to(self.velocity, positions.shape).copy()
+
+    def step(self, positions, time_delta, rng):
+        return positions + self.velocity * time_delta
+
+    def keep(self, rows):
+        self.velocity = self.velocity[rows]
+
+    def bounced(self, crossed):
+        self.velocity[crossed] = -self.velocity[crossed]
+
+
+class GaussianJitter(MobilityModel):
+    """Brownian motion: the displacement in a unit of time is normal with standard deviation `stddev`"""
+
+    def __init__(self, stddev: float):
+        self.stddev = stddev
+
+    def step(self, positions, time_delta, rng):
+        return positions + rng.normal(0.0, self.stddev * np.sqrt(time_delta), positions.shape)
+
+
+class RandomWaypoint(MobilityModel):
+    """
+    Random waypoint: every node moves towards a uniformly drawn waypoint of the area at a uniformly drawn speed,
+    pauses there, then draws a new waypoint and a new speed.
+    """
+
+    def __init__(self, low: Sequence[float], high: Sequence[float], speed: Tuple[float, float], pause: float = 0.0):
+        """
+        :param low: The lowest corner of the area of the waypoints.
+        :param high: The highest corner of the area of the waypoints.
+        :param speed: The range of the speeds.
+        :param pause: The time spent at each waypoint.
+        """
+        self.low = np.asarray(low, dtype=float)
+        self.high = np.asarray(high, dtype=float)
+        self.speed = speed
+        self.pause = pause
+        self.targets: Optional[np.ndarray] = None
+        self.speeds: Optional[np.ndarray] = None
+        self.waiting: Optional[np.ndarray] = None
+
+    def _draw(self, rows: np.ndarray, rng: np.random.Generator):
+        self.targets[rows] = rng.uniform(self.low, self.high, (len(rows), len(self.low)))
+        self.speeds[rows] = rng.uniform(self.speed[0], self.speed[1], len(rows))
+
+    def start(self, positions, rng):
+        count = len(positions)
+        self.targets = np.empty_like(positions)
+        self.speeds = np.empty(count)
+        self.waiting = np.zeros(count)
+        self._draw(np.arange(count), rng)
+
+    def step(self, positions, time_delta, rng):
+        self.waiting = np.maximum(self.waiting - time_delta, 0.0)
+        moving = self.waiting == 0.0
+        offset = self.targets - positions
+        distance = np.sqrt((offset ** 2).sum(axis=1))
+        travel = self.speeds * time_delta
+        arrived = moving & (distance <= travel)
+        going = moving & ~arrived
+        result = positions.copy()
+        result[going] += offset[going] * (travel[going] / distance[going])[:, None]
+        rows = np.flatnonzero(arrived)
+        result[rows] = self.targets[rows]
+        self.waiting[rows] = self.pause
+        self._draw(rows, rng)
+        return result
+
+    def keep(self, rows):
+        self.targets = self.targets[rows]
+        self.speeds = self.speeds[rows]
+        self.waiting = self.waiting[rows]
+
+
+class Bounded(MobilityModel):
+    """
+    Keep the nodes moved by another model inside a box: positions crossing the border are reflected on it
+    ("reflect", the model is told through `bounced`), clamped to it ("clamp") or wrapped around ("wrap").
+    """
+
+    def __init__(self, model: MobilityModel, low: Sequence[float], high: Sequence[float], mode: str = "reflect"):
+        if mode not in ("reflect", "clamp", "wrap"):
+            raise ValueError(f"unknown mode {mode}")
+        self.model = model
+        self.low = np.asarray(low, dtype=float)
+        self.high = np.asarray(high, dtype=float)
+        self.mode = mode
+
+    def start(self, positions, rng):
+        self.model.start(positions, rng)
+
+    def step(self, positions, time_delta, rng):
+        result = self.model.step(positions, time_delta, rng)
+        low, high = self.low, self.high
+        if self.mode == "clamp":
+            return np.clip(result, low, high)
+        if self.mode == "wrap":
+            return low + np.mod(result - low, high - low)
+        below = result < low
+        above = result > high
+        result = np.where(below, 2 * low - result, np.where(above, 2 * high - result, result))
+        crossed = below | above
+        if crossed.any():
+            self.model.bounced(crossed)
+        # a step longer than the box is clamped after the reflection
+        return np.clip(result, low, high)
+
+    def keep(self, rows):
+        self.model.keep(rows)
+
+    def bounced(self, crossed):
+        self.model.bounced(crossed)
+
+
+class Mobility:
+    """
+    The nodes moved by a model. Their positions are read and written in bulk (directly in the arrays of the
+    environment for nodes stored in `NodeArrays`); nodes removed from the environment are dropped.
+    """
+
+    def __init__(self, nodes: List[Node], model: MobilityModel, seed: Any = None):
+        self.nodes = list(nodes)
+        self.model = model
+        self.rng = np.random.default_rng(seed)
+        arrays = getattr(self.nodes[0], "arrays", None) if self.nodes else None
+        same_arrays = arrays is not None and all(getattr(node, "arrays", None) is arrays for node in self.nodes)
+        self.arrays = arrays if same_arrays else None
+        self.rows = np.array([node.id for node in self.nodes], dtype=np.int64) if same_arrays else None
+        self.model.start(self.positions(), self.rng)
+
+    def positions(self) -> np.ndarray:
+        if self.arrays is not None:
+            return self.arrays.positions[self.rows]
+        return np.array([node.position for node in self.nodes], dtype=float)
+
+    def _drop_removed(self, environment: Environment):
+        present = [node.environment is environment for node in self.nodes]
+        if all(present):
+            return
+        rows = np.flatnonzero(present)
+        self.nodes = [self.nodes[row] for row in rows]
+        if self.rows is not None:
+            self.rows = self.rows[rows]
+        self.model.keep(rows)
+
+    def step(self, environment: Environment, time_delta: float):
+        """Move the nodes by `time_delta` and notify the environment"""
+        self._drop_removed(environment)
+        if not self.nodes:
+            return
+        positions = self.model.step(self.positions(), time_delta, self.rng)
+        if self.arrays is not None:
+            self.arrays.set_positions(self.rows, positions)
+        else:
+            for node, position in zip(self.nodes, positions.tolist()):
+                node._place(tuple(position))
+        environment.nodes_updated(self.nodes)
+
+
+@register_action
+def mobility_runner(simulator: Simulator, time_delta: float, mobility: Mobility):
+    """Move every node of the mobility by `time_delta`, then schedule the next step"""
+    mobility.step(simulator.environment, time_delta)
+    simulator.schedule_event(time_delta, mobility_runner, simulator, time_delta, mobility)
@@ -1,44 +1,71 @@
 from typing import List
 
 from fieldpy.simulator import Node
+from fieldpy.simulator.spatial import SpatialIndex, GridIndex, KDTreeIndex, squared_distance
 
 
-def radius_neighborhood(radius: float):
-    """Create a neighborhood function that includes nodes within a certain radius"""
+class RadiusNeighborhood:
+    """
+    Neighborhood including the nodes within a certain radius.
+    It can be called as a plain neighborhood function (scanning all the nodes), and when used by an
+    `Environment` it queries the environment spatial index instead.
+    """
 
-    def neighborhood_func(node: Node, all_nodes: List[Node]) -> List[Node]:
-        neighbors = []
-        for other in all_nodes:
-            if other.id == node.id:  # Skip self
-                continue
+    def __init__(self, radius: float):
+        self.radius = radius
 
-            # Calculate Euclidean distance
-            distance = sum((a - b) ** 2 for a, b in zip(node.position, other.position)) ** 0.5
+    def __call__(self, node: Node, all_nodes: List[Node]) -> List[Node]:
+        squared_radius = self.radius * self.radius
+        return [other for other in all_nodes
+                if other.id != node.id and squared_distance(node.position, other.position) <= squared_radius]
 
-            if distance <= radius:
-                neighbors.append(other)
-        return neighbors
+    def query(self, node: Node, index: SpatialIndex) -> List[Node]:
+        """Get the neighbors of a node using a spatial index"""
+        node_id = node.id
+        return [other for other in index.query_radius(node.position, self.radius) if other.id != node_id]
 
-    return neighborhood_func
+    def affected(self, position, index: SpatialIndex) -> List[Node]:
+        """The nodes whose neighborhood changes when a node appears at (or leaves) `position`"""
+        return index.query_radius(position, self.radius)
 
+    def create_index(self) -> SpatialIndex:
+        """The index best suited for this neighborhood: a grid whose cells are as large as the radius"""
+        return GridIndex(self.radius)
 
-def k_nearest_neighbors(k: int):
-    """Create a neighborhood function that includes the k nearest nodes"""
 
-    def neighborhood_func(node: Node, all_nodes: List[Node]) -> List[Node]:
-        others = [n for n in all_nodes if n.id != node.id]
-        if not others:
-            return []
+class KNearestNeighbors:
+    """
+    Neighborhood including the k nearest nodes (ties broken by insertion order).
+    It can be called as a plain neighborhood function (scanning all the nodes), and when used by an
+    `Environment` it queries the environment spatial index instead.
+    """
+
+    def __init__(self, k: int):
+        self.k = k
+
+    def __call__(self, node: Node, all_nodes: List[Node]) -> List[Node]:
+        index = KDTreeIndex()
+        for other in all_nodes:
+            index.insert(other)
+        return self.query(node, index)
 
-        # Calculate distances
-        distances = [(sum((a - b) ** 2 for a, b in zip(node.position, other.position)) ** 0.5, other)
-                     for other in others]
+    def query(self, node: Node, index: SpatialIndex) -> List[Node]:
+        """Get the neighbors of a node using a spatial index"""
+        return index.query_knn(node.position, self.k, exclude=node.id)
 
-        # Sort by distance and take k nearest
-        distances.sort()
-        return [other for _, other in distances[:k]]
+    def create_index(self) -> SpatialIndex:
+        """The index best suited for this neighborhood: a KD-tree, as the neighborhood size does not depend on distance"""
+        return KDTreeIndex()
 
-    return neighborhood_func
+
+def radius_neighborhood(radius: float):
+    """Create a neighborhood function that includes nodes within a certain radius"""
+    return RadiusNeighborhood(radius)
+
+
+def k_nearest_neighbors(k: int):
+    """Create a neighborhood function that includes the k nearest nodes"""
+    return KNearestNeighbors(k)
 
 
 def full_neighborhood(node: Node, all_nodes: List[Node]) -> List[Node]:
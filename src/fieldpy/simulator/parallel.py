@@ -0,0 +1,467 @@
+"""
+Parallel synchronous rounds: the nodes of the environment are split spatially across worker processes
+(see `partition`). Each worker runs the rounds of its own nodes on its own engine, and the only messages exchanged
+in a round are the ones of the nodes on the border of a partition (the "halo" of the neighboring partitions).
+As with `batch_program_runner`, every node reads the messages its neighbors exported in the previous round.
+"""
+import multiprocessing
+import os
+import threading
+from multiprocessing.connection import wait
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from fieldpy.simulator import Simulator, Node, Environment
+from fieldpy.simulator.events import register_action
+from fieldpy.simulator.runner import run_round
+
+# a node moves to the worker owning most of its neighbors only while that worker has less than
+# (1 + IMBALANCE) times its share of the nodes
+IMBALANCE = 0.1
+
+# the nodes are partitioned from scratch when the neighbor entries across workers grow REPARTITION_FACTOR times
+# the ones of the last partition
+REPARTITION_FACTOR = 2
+
+
+def partition(nodes: List[Node], parts: int) -> List[List[Node]]:
+    """
+    Split the nodes into at most `parts` spatially compact groups of (almost) the same size, by recursive
+    bisection along the widest coordinate.
+    """
+    if parts <= 1 or len(nodes) <= 1:
+        return [nodes] if nodes else []
+    dimensions = len(nodes[0].position)
+    spans = [max(n.position[d] for n in nodes) - min(n.position[d] for n in nodes) for d in range(dimensions)]
+    axis = spans.index(max(spans))
+    ordered = sorted(nodes, key=lambda n: n.position[axis])
+    left = parts // 2
+    split = len(ordered) * left // parts
+    return partition(ordered[:split], left) + partition(ordered[split:], parts - left)
+
+
+class _Failure(object):
+    """The reply of a worker that failed outside the program: the other workers may wait for it forever"""
+    __slots__ = ("error",)
+
+    def __init__(self, error: BaseException):
+        self.error = error
+
+
+def _send_halos(peers: Dict[int, Any], outgoing: Dict[int, Dict[Any, Dict[str, Any]]], targets: List[int]):
+    for target in targets:
+        peers[target].send(outgoing.get(target, {}))
+
+
+def _exchange(peers: Dict[int, Any], outgoing: Dict[int, Dict[Any, Dict[str, Any]]], targets: List[int],
+              sources: List[int]) -> Dict[Any, Dict[str, Any]]:
+    """
+    Send the messages of the border nodes to the workers that have them in their halo, and receive the ones of the
+    halo from their workers. The messages are sent by another thread, so that two workers filling the pipe between
+    them never wait for each other.
+    """
+    sender = None
+    if targets:
+        sender = threading.Thread(target=_send_halos, args=(peers, outgoing, targets))
+        sender.start()
+    received: Dict[Any, Dict[str, Any]] = {}
+    for source in sources:
+        received.update(peers[source].recv())
+    if sender is not None:
+        sender.join()
+    return received
+
+
+def _worker(connection, peers: Dict[int, Any], program: callable):
+    """Serve the commands of a `ParallelRounds` for a partition, exchanging the halos directly with the other workers"""
+    nodes: Dict[Any, Node] = {}
+    neighbors: Dict[Any, List[Any]] = {}
+    # own node id -> workers that have it in their halo
+    routes: Dict[Any, List[int]] = {}
+    targets: List[int] = []
+    sources: List[int] = []
+    halo: Dict[Any, Dict[str, Any]] = {}
+    while True:
+        command, payload = connection.recv()
+        try:
+            if command == "round":
+                # messages exported in the previous round, by the partition and by its halo
+                previous = {id: node.data.get("messages", {}) for id, node in nodes.items()}
+                previous.update(halo)
+                try:
+                    reply = {id: run_round(node, {n: previous.get(n, {}) for n in neighbors[id]}, program)
+                             for id, node in nodes.items()}
+                except Exception as error:
+                    # the other workers wait for the halo anyway
+                    reply = error
+                outgoing: Dict[int, Dict[Any, Dict[str, Any]]] = {}
+                for id, node_targets in routes.items():
+                    messages = nodes[id].data.get("messages", {})
+                    for target in node_targets:
+                        outgoing.setdefault(target, {})[id] = messages
+                halo = _exchange(peers, outgoing, targets, sources)
+                connection.send(reply)
+            elif command == "load":
+                nodes, neighbors, routes, targets, sources, halo = payload
+                connection.send(None)
+            elif command == "release":
+                released = {id: nodes.pop(id) for id in payload}
+                for id in payload:
+                    neighbors.pop(id, None)
+                    routes.pop(id, None)
+                connection.send(released)
+            elif command == "update":
+                added, removed, positions, changed_neighbors, changed_routes, targets, sources = payload
+                for id in removed:
+                    nodes.pop(id, None)
+                    neighbors.pop(id, None)
+                    routes.pop(id, None)
+                for id, position in positions.items():
+                    nodes[id].position = position
+                nodes.update(added)
+                neighbors.update(changed_neighbors)
+                # the new halo of the other workers gets the messages of the previous round right away
+                outgoing = {}
+                for id, node_targets in changed_routes.items():
+                    known = routes.get(id, ())
+                    messages = nodes[id].data.get("messages", {})
+                    for target in node_targets:
+                        if target not in known:
+                            outgoing.setdefault(target, {})[id] = messages
+                    if node_targets:
+                        routes[id] = node_targets
+                    else:
+                        routes.pop(id, None)
+                needed = {n for node_neighbors in neighbors.values() for n in node_neighbors if n not in nodes}
+                halo = {id: messages for id, messages in halo.items() if id in needed}
+                halo.update(_exchange(peers, outgoing, targets, sources))
+                connection.send(None)
+            elif command == "gather":
+                connection.send({id: {key: node.data[key] for key in ("messages", "state") if key in node.data}
+                                 for id, node in nodes.items()})
+            else:
+                connection.close()
+                return
+        except Exception as error:
+            connection.send(_Failure(error))
+
+
+class ParallelRounds:
+    """
+    Worker processes running the synchronous rounds of a program, one partition of the nodes each.
+    Every pair of workers is connected by a pipe: after a round, each worker sends the messages of its border nodes
+    straight to the workers that have them in their halo, so the parent process only collects the results.
+    When the neighborhoods of the environment may have changed (its `version`, e.g. after a mobility step) the
+    partitions are updated incrementally: the workers get the new positions and the changed neighbor lists, and a
+    node moves (with its state and messages) to the worker owning most of its neighbors, as long as the partitions
+    stay balanced. The nodes are partitioned from scratch only when too many neighbors end up on other workers.
+    The nodes data is sent to the workers only when they first get a node: changes made to it outside the program
+    are seen after `reload`.
+    The results are the ones of sequential synchronous rounds, except for programs drawing random numbers.
+    When a worker fails outside the program (e.g. while updating its partition), all the workers are stopped and the
+    error is raised: the state kept by the workers since they last sent it back is lost, and the next round starts
+    new workers from the environment.
+    Pickling the rounds (e.g. in a checkpoint of the simulator) saves the state and the messages kept by the
+    workers: the restored rounds start new workers with them.
+    """
+
+    def __init__(self, program: callable, workers: Optional[int] = None, start_method: Optional[str] = None):
+        """
+        :param program: The aggregate program (with a start method other than fork, it must be importable).
+        :param workers: The number of worker processes (the number of CPUs by default).
+        :param start_method: The multiprocessing start method (the platform default if None).
+        """
+        self.program = program
+        self.workers = workers or os.cpu_count() or 1
+        self.start_method = start_method
+        self.context = multiprocessing.get_context(start_method)
+        self.connections = []
+        self.processes = []
+        self.environment: Optional[Environment] = None
+        self.version: Any = None
+        # node id -> worker running it, its neighbors and its position as the worker knows them
+        self.owner: Dict[Any, int] = {}
+        self.neighbors: Dict[Any, List[Any]] = {}
+        self.positions: Dict[Any, Any] = {}
+        # node id -> workers that have the node in their halo
+        self.routes: Dict[Any, List[int]] = {}
+        # the neighbor entries across workers, and their number when the nodes were last partitioned from scratch
+        self.cut = 0
+        self.partitioned_cut = 0
+        # node id -> state and messages gathered from the workers of the pickled rounds, for the new workers
+        self.gathered: Dict[Any, Dict[str, Any]] = {}
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        if self.processes:
+            state["gathered"] = self._collect()
+        state.update(context=None, connections=[], processes=[], version=None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.context = multiprocessing.get_context(self.start_method)
+
+    def _start(self):
+        # one duplex pipe for every pair of workers, for the halos
+        peers: List[Dict[int, Any]] = [{} for _ in range(self.workers)]
+        for first in range(self.workers):
+            for second in range(first + 1, self.workers):
+                peers[first][second], peers[second][first] = self.context.Pipe()
+        for worker in range(self.workers):
+            connection, child = self.context.Pipe()
+            process = self.context.Process(target=_worker, args=(child, peers[worker], self.program), daemon=True)
+            process.start()
+            child.close()
+            self.connections.append(connection)
+            self.processes.append(process)
+        for worker_peers in peers:
+            for peer in worker_peers.values():
+                peer.close()
+
+    def _request(self, commands: List[tuple]) -> List[Any]:
+        """
+        Send a command to every worker (they run concurrently), then collect their replies. The replies are read as
+        they come: when a worker failed, the others are stopped instead of waiting for the ones it blocks.
+        """
+        try:
+            for connection, command in zip(self.connections, commands):
+                connection.send(command)
+        except OSError as error:
+            self._terminate()
+            raise RuntimeError("a worker process exited") from error
+        replies: List[Any] = [None] * len(self.connections)
+        pending = {connection: worker for worker, connection in enumerate(self.connections)}
+        while pending:
+            for connection in wait(list(pending)):
+                worker = pending.pop(connection)
+                try:
+                    reply = connection.recv()
+                except EOFError:
+                    reply = _Failure(RuntimeError(f"worker {worker} exited"))
+                if isinstance(reply, _Failure):
+                    self._terminate()
+                    raise reply.error
+                replies[worker] = reply
+        for reply in replies:
+            if isinstance(reply, Exception):
+                raise reply
+        return replies
+
+    def _terminate(self):
+        """Stop the workers at once, without gathering their state"""
+        for process in self.processes:
+            process.terminate()
+        for process in self.processes:
+            process.join()
+        for connection in self.connections:
+            connection.close()
+        self.connections = []
+        self.processes = []
+        self.version = None
+
+    def _collect(self) -> Dict[Any, Dict[str, Any]]:
+        """The state and the messages of the nodes kept by the workers"""
+        collected: Dict[Any, Dict[str, Any]] = {}
+        for gathered in self._request([("gather", None)] * self.workers):
+            collected.update(gathered)
+        return collected
+
+    def _gather(self):
+        """Bring the state and the messages of the nodes back to the environment"""
+        if self.processes:
+            self.gathered.update(self._collect())
+        nodes = self.environment.nodes
+        for node_id, data in self.gathered.items():
+            if node_id in nodes:
+                nodes[node_id].data.update(data)
+        self.gathered = {}
+
+    def _routes(self) -> Dict[Any, List[int]]:
+        """The workers that have each node in their halo (counting the neighbor entries across workers)"""
+        owner = self.owner
+        routes: Dict[Any, Set[int]] = {}
+        cut = 0
+        for node_id, node_neighbors in self.neighbors.items():
+            worker = owner[node_id]
+            for neighbor in node_neighbors:
+                if owner[neighbor] != worker:
+                    routes.setdefault(neighbor, set()).add(worker)
+                    cut += 1
+        self.cut = cut
+        return {node_id: sorted(workers) for node_id, workers in routes.items()}
+
+    def _links(self) -> Tuple[List[List[int]], List[List[int]]]:
+        """The workers each worker sends halo messages to, and the ones it receives them from"""
+        targets: List[Set[int]] = [set() for _ in range(self.workers)]
+        sources: List[Set[int]] = [set() for _ in range(self.workers)]
+        owner = self.owner
+        for node_id, workers in self.routes.items():
+            targets[owner[node_id]].update(workers)
+            for worker in workers:
+                sources[worker].add(owner[node_id])
+        return [sorted(t) for t in targets], [sorted(s) for s in sources]
+
+    def load(self, environment: Environment):
+        """Partition the nodes of the environment among the workers"""
+        if self.processes or self.gathered:
+            # restored rounds have no workers yet, but the state and the messages of the pickled ones
+            self._gather()
+        if not self.processes:
+            self._start()
+        self.environment = environment
+        self.version = (id(environment), environment.version)
+        parts = partition(environment.node_list(), self.workers)
+        parts += [[] for _ in range(self.workers - len(parts))]
+        self.owner = {node.id: worker for worker, part in enumerate(parts) for node in part}
+        self.neighbors = {node.id: [n.id for n in environment.get_neighbors(node)]
+                          for part in parts for node in part}
+        self.positions = {node.id: node.position for part in parts for node in part}
+        self.routes = self._routes()
+        self.partitioned_cut = self.cut
+        targets, sources = self._links()
+        commands = []
+        for worker, part in enumerate(parts):
+            ids = [node.id for node in part]
+            halo = {node_id: environment.nodes[node_id].data.get("messages", {})
+                    for node_id, workers in self.routes.items() if worker in workers}
+            commands.append(("load", (
+                {node.id: Node(node.position, dict(node.data), node.id) for node in part},
+                {node_id: self.neighbors[node_id] for node_id in ids},
+                {node_id: self.routes[node_id] for node_id in ids if node_id in self.routes},
+                targets[worker],
+                sources[worker],
+                halo,
+            )))
+        self._request(commands)
+
+    def update(self, environment: Environment):
+        """
+        Bring the partitions up to date with the environment without partitioning it again: only the new positions,
+        the changed neighbor lists and the nodes that move to another worker are sent.
+        """
+        nodes = environment.nodes
+        owner = self.owner
+        self.version = (id(environment), environment.version)
+        removed = [node_id for node_id in owner if node_id not in nodes]
+        for node_id in removed:
+            del self.neighbors[node_id]
+            del self.positions[node_id]
+        neighbors = {node_id: [n.id for n in environment.get_neighbors(node)] for node_id, node in nodes.items()}
+        changed = {node_id for node_id, node_neighbors in neighbors.items()
+                   if self.neighbors.get(node_id) != node_neighbors}
+        loads = [0] * self.workers
+        for node_id in nodes:
+            if node_id in owner:
+                loads[owner[node_id]] += 1
+        capacity = len(nodes) * (1 + IMBALANCE) / self.workers
+        removed_owners = {node_id: owner.pop(node_id) for node_id in removed}
+        moves: Dict[Any, Tuple[int, int]] = {}
+        added: List[Any] = []
+        for node_id in neighbors:
+            if node_id not in changed:
+                continue
+            votes = [0] * self.workers
+            for neighbor in neighbors[node_id]:
+                if neighbor in owner:
+                    votes[owner[neighbor]] += 1
+            current = owner.get(node_id)
+            best = max(range(self.workers), key=lambda worker: (votes[worker], -loads[worker]))
+            if current is None:
+                if votes[best] == 0:
+                    best = loads.index(min(loads))
+                owner[node_id] = best
+                loads[best] += 1
+                added.append(node_id)
+            elif best != current and votes[best] > votes[current] and loads[best] < capacity:
+                owner[node_id] = best
+                loads[best] += 1
+                loads[current] -= 1
+                moves[node_id] = (current, best)
+        self.neighbors = neighbors
+        previous = self.routes
+        self.routes = self._routes()
+        if self.cut > REPARTITION_FACTOR * max(self.partitioned_cut, len(nodes) // self.workers):
+            self.load(environment)
+            return
+        migrated: Dict[Any, Node] = {}
+        if moves:
+            releases = [[] for _ in range(self.workers)]
+            for node_id, (source, _) in moves.items():
+                releases[source].append(node_id)
+            for released in self._request([("release", ids) for ids in releases]):
+                migrated.update(released)
+        targets, sources = self._links()
+        commands = [({}, [], {}, {}, {}, targets[worker], sources[worker]) for worker in range(self.workers)]
+        for node_id, worker in removed_owners.items():
+            commands[worker][1].append(node_id)
+        for node_id in added:
+            node = nodes[node_id]
+            commands[owner[node_id]][0][node_id] = Node(node.position, dict(node.data), node_id)
+        for node_id, node in migrated.items():
+            node.position = nodes[node_id].position
+            commands[owner[node_id]][0][node_id] = node
+        positions = self.positions
+        for node_id, node in nodes.items():
+            worker = owner[node_id]
+            if positions.get(node_id) != node.position:
+                positions[node_id] = node.position
+                if node_id not in commands[worker][0]:
+                    commands[worker][2][node_id] = node.position
+            if node_id in changed or node_id in moves:
+                commands[worker][3][node_id] = neighbors[node_id]
+        for node_id, workers in self.routes.items():
+            if previous.get(node_id) != workers or node_id in moves or node_id in commands[owner[node_id]][0]:
+                commands[owner[node_id]][4][node_id] = workers
+        for node_id, workers in previous.items():
+            if node_id in owner and node_id not in self.routes:
+                commands[owner[node_id]][4][node_id] = []
+        self._request([("update", command) for command in commands])
+
+    def reload(self):
+        """Partition the nodes from scratch (sending the current nodes data) before the next round"""
+        self.version = None
+
+    def round(self, environment: Environment) -> Dict[Any, Any]:
+        """Run a round for every node of the environment, returning the results by node id"""
+        if self.version is None or self.version[0] != id(environment):
+            self.load(environment)
+        elif self.version[1] != environment.version:
+            self.update(environment)
+        results: Dict[Any, Any] = {}
+        for part_results in self._request([("round", None)] * self.workers):
+            results.update(part_results)
+        return results
+
+    def close(self):
+        """Stop the workers (the state and the messages of the nodes are brought back to the environment)"""
+        if self.gathered and self.environment is not None:
+            self._gather()
+        if self.processes:
+            self._gather()
+            for connection in self.connections:
+                connection.send(("close", None))
+            for process in self.processes:
+                process.join()
+            self.connections = []
+            self.processes = []
+            self.version = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exception_type, exception_value, traceback):
+        self.close()
+
+
+@register_action
+def parallel_program_runner(simulator: Simulator, time_delta: float, program: callable,
+                            rounds: Optional[ParallelRounds] = None):
+    """
+    Run a synchronous round of the program for all the nodes, split across worker processes (see `ParallelRounds`).
+    Only `result` is written in the nodes data: state and messages are kept by the workers until they are closed.
+    """
+    rounds = rounds or ParallelRounds(program)
+    nodes = simulator.environment.nodes
+    for id, result in rounds.round(simulator.environment).items():
+        nodes[id].data["result"] = result
+    simulator.schedule_event(time_delta, parallel_program_runner, simulator, time_delta, program, rounds)
@@ -1,8 +1,31 @@
-from typing import Tuple
+"""
+Rendering of the nodes of an environment, with their links and (optionally) their ids.
+A `Renderer` draws all the links as one line (the segments separated by NaN points, which matplotlib draws
+much faster than a `LineCollection`) and all the nodes as one scatter, then updates these artists in place at
+every frame. It renders on screen without blocking the simulation, or off-screen (when it has
+an `output`) into PNG frames or an animation:
+```python
+renderer = Renderer(color_from="result", output="out/frame_{:05d}.png")  # or "out.gif", "out.mp4"
+simulator.schedule_event(0.0, render_sync, simulator, renderer=renderer, period=0.5)
+simulator.run(100)
+renderer.close()
+```
+"""
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Tuple, Optional, List, Any
 
-from matplotlib import pyplot as plt
+import numpy as np
+import matplotlib.image
+from matplotlib.colors import to_rgba_array
+from matplotlib.figure import Figure
+
+from fieldpy.simulator import Simulator, Environment
+from fieldpy.simulator.events import register_action
+
+# the margin around the nodes, as a fraction of the size of the area they cover
+VIEW_MARGIN = 0.05
 
-from fieldpy.simulator import Simulator
 
 class Link:
     def __init__(self, node1: Tuple[float, ...], node2: Tuple[float, ...]):
@@ -16,34 +39,210 @@ class Link:
         if isinstance(other, Link):
             return frozenset((self.node1, self.node2)) == frozenset((other.node1, other.node2))
         return False
-def render_sync(simulator: Simulator, color_from: str = None):
+
+
+def link_segments(environment: Environment, positions: np.ndarray, rows: dict) -> np.ndarray:
+    """
+    The links of the environment as an (E, 2, d) array of segments, each undirected link once.
+    :param positions: The positions of the nodes, one row per node.
+    :param rows: The row of every node id.
+    """
+    sources: List[int] = []
+    targets: List[int] = []
+    for node in environment.nodes.values():
+        row = rows[node.id]
+        neighbors = [rows[neighbor.id] for neighbor in environment.get_neighbors(node) if neighbor.id in rows]
+        sources.extend([row] * len(neighbors))
+        targets.extend(neighbors)
+    if not sources:
+        return np.empty((0, 2, positions.shape[1]))
+    first = np.asarray(sources, dtype=np.int64)
+    second = np.asarray(targets, dtype=np.int64)
+    low = np.minimum(first, second)
+    high = np.maximum(first, second)
+    keys = np.unique((low * len(positions) + high)[low != high])
+    return positions[np.stack((keys // len(positions), keys % len(positions)), axis=1)]
+
+
+class Renderer:
+    """
+    Incremental renderer: the figure is built at the first frame, the next frames only update its artists.
+    """
+
+    def __init__(self, color_from: Optional[str] = None, output: Optional[str] = None, labels: bool = True,
+                 max_labels: int = 200, every: int = 1, fps: int = 10, dpi: int = 100,
+                 figsize: Tuple[float, float] = (6.4, 4.8)):
+        """
+        :param color_from: The key of the node data holding the color of the nodes (a color, or a number mapped
+        through the colormap), blue for the nodes without it.
+        :param output: Where the frames are written, off-screen: a path ending in ".gif" or ".mp4" for an animation,
+        otherwise a format string for the path of every PNG frame (e.g. "frames/{:05d}.png"). None renders on screen.
+        :param labels: Show the ids of the nodes.
+        :param max_labels: Labels are culled when more nodes than this are visible.
+        :param every: Draw one frame out of `every` (frame decimation).
+        :param fps: The frames per second of an animation.
+        :param dpi: The resolution of the off-screen frames.
+        """
+        self.color_from = color_from
+        self.output = output
+        self.labels = labels
+        self.max_labels = max_labels
+        self.every = max(every, 1)
+        self.fps = fps
+        self.dpi = dpi
+        self.figsize = figsize
+        self.calls = 0
+        self.frames = 0
+        self.figure = None
+        self.axes = None
+        self.links = None
+        self.scatter = None
+        self.texts: List[Any] = []
+        self.writer = None
+        self.executor: Optional[ThreadPoolExecutor] = None
+        self.pending = []
+
+    def _setup(self):
+        if self.output is None:
+            from matplotlib import pyplot as plt
+            plt.ion()
+            self.figure = plt.figure(figsize=self.figsize)
+        else:
+            # no pyplot: an off-screen figure never touches the GUI event loop
+            self.figure = Figure(figsize=self.figsize, dpi=self.dpi)
+            from matplotlib.backends.backend_agg import FigureCanvasAgg
+            FigureCanvasAgg(self.figure)
+            extension = os.path.splitext(self.output)[1].lower()
+            if extension in (".gif", ".mp4"):
+                from matplotlib import animation
+                writer = animation.PillowWriter if extension == ".gif" else animation.FFMpegWriter
+                self.writer = writer(fps=self.fps)
+                self.writer.setup(self.figure, self.output, self.dpi)
+            else:
+                self.executor = ThreadPoolExecutor(max_workers=1)
+        self.axes = self.figure.add_subplot()
+        (self.links,) = self.axes.plot([], [], "r--", alpha=0.1)
+        self.scatter = self.axes.scatter([], [], c="blue")
+        self.axes.set_title("Node Positions")
+        self.axes.set_xlabel("X Position")
+        self.axes.set_ylabel("Y Position")
+        self.axes.set_aspect("equal")
+
+    def _colors(self, environment: Environment):
+        if not self.color_from:
+            return None
+        values = [(node.data or {}).get(self.color_from, "blue") for node in environment.nodes.values()]
+        if all(isinstance(value, (int, float, np.number)) for value in values):
+            return np.asarray(values, dtype=float)
+        return to_rgba_array(values)
+
+    def _update_labels(self, environment: Environment, positions: np.ndarray):
+        if self.labels and len(positions):
+            (left, right), (bottom, top) = self.axes.get_xlim(), self.axes.get_ylim()
+            visible = np.flatnonzero((positions[:, 0] >= left) & (positions[:, 0] <= right) &
+                                     (positions[:, 1] >= bottom) & (positions[:, 1] <= top))
+            if len(visible) > self.max_labels:
+                visible = visible[:0]
+        else:
+            visible = []
+        ids = list(environment.nodes)
+        while len(self.texts) > len(visible):
+            self.texts.pop().remove()
+        while len(self.texts) < len(visible):
+            self.texts.append(self.axes.text(0, 0, "", fontsize=8, ha="center", va="center",
+                                             bbox=dict(facecolor="white", alpha=0.1, edgecolor="none")))
+        for text, row in zip(self.texts, visible):
+            text.set_position((positions[row, 0] + 0.02, positions[row, 1]))
+            text.set_text(str(ids[row]))
+
+    def _update_limits(self, positions: np.ndarray):
+        if not len(positions):
+            return
+        low = positions.min(axis=0)
+        high = positions.max(axis=0)
+        margin = np.maximum((high - low) * VIEW_MARGIN, 1e-9)
+        self.axes.set_xlim(low[0] - margin[0], high[0] + margin[0])
+        self.axes.set_ylim(low[1] - margin[1], high[1] + margin[1])
+
+    def render(self, environment: Environment):
+        """Draw a frame of the environment (skipped, with decimation, unless it is one out of `every`)"""
+        self.calls += 1
+        if (self.calls - 1) % self.every:
+            return
+        if self.figure is None:
+            self._setup()
+        nodes = environment.nodes
+        positions = np.array([node.position for node in nodes.values()], dtype=float).reshape(len(nodes), -1)[:, :2]
+        rows = {node_id: row for row, node_id in enumerate(nodes)}
+        segments = link_segments(environment, positions, rows)
+        path = np.full((len(segments), 3, 2), np.nan)
+        path[:, :2] = segments
+        path = path.reshape(-1, 2)
+        self.links.set_data(path[:, 0], path[:, 1])
+        self.scatter.set_offsets(positions)
+        colors = self._colors(environment)
+        if colors is None:
+            pass
+        elif colors.ndim == 1:
+            self.scatter.set_array(colors)
+            self.scatter.autoscale()
+        else:
+            self.scatter.set_array(None)
+            self.scatter.set_facecolors(colors)
+        self._update_limits(positions)
+        self._update_labels(environment, positions)
+        self._show()
+        self.frames += 1
+
+    def _show(self):
+        if self.output is None:
+            self.figure.canvas.draw_idle()
+            self.figure.canvas.flush_events()
+        elif self.writer is not None:
+            self.writer.grab_frame()
+        else:
+            self.figure.canvas.draw()
+            frame = np.asarray(self.figure.canvas.buffer_rgba()).copy()
+            path = self.output.format(self.frames)
+            # PNG encoding happens off the simulation thread
+            self.pending = [future for future in self.pending if not future.done()]
+            self.pending.append(self.executor.submit(matplotlib.image.imsave, path, frame))
+
+    def __getstate__(self):
+        # the figure is not saved: a restored renderer builds a new one (and restarts its animation) at the next frame
+        state = dict(self.__dict__)
+        state.update(figure=None, axes=None, links=None, scatter=None, texts=[], writer=None, executor=None,
+                     pending=[])
+        return state
+
+    def show(self):
+        """Keep the on-screen window open until it is closed (e.g. at the end of a script, after the simulation)"""
+        if self.output is None and self.figure is not None:
+            from matplotlib import pyplot as plt
+            plt.ioff()
+            plt.show()
+
+    def close(self):
+        """Finish the animation and wait for the frames still being written"""
+        if self.writer is not None:
+            self.writer.finish()
+            self.writer = None
+        if self.executor is not None:
+            for future in self.pending:
+                future.result()
+            self.executor.shutdown()
+            self.executor = None
+            self.pending = []
+
+
+@register_action
+def render_sync(simulator: Simulator, color_from: str = None, renderer: Optional[Renderer] = None,
+                period: float = 1.0):
     """
-    Render the nodes in the simulator's environment.
+    Render the nodes in the simulator's environment, then schedule the next frame after `period`.
+    :param renderer: The renderer of the frames (a new on-screen one, coloring by `color_from`, if None).
     """
-    positions = [node.position for node in simulator.environment.nodes.values()]
-    x, y = zip(*positions)
-    # plot also the neighbors, avoiding duplicates
-    all_neighbors_tuple = set()
-    for node in simulator.environment.nodes.values():
-        neighbors = node.get_neighbors()
-        for neighbor in neighbors:
-            all_neighbors_tuple.add(Link(node.position, neighbor.position))
-    for link in all_neighbors_tuple:
-        plt.plot([link.node1[0], link.node2[0]], [link.node1[1], link.node2[1]], 'r--', alpha=0.1)
-    # take the colors from the node data
-    if color_from:
-        colors = [node.data.get(color_from, 'blue') for node in simulator.environment.nodes.values()]
-        plt.scatter(x, y, c=colors)
-    else:
-        plt.scatter(x, y, c='blue')
-    # Add node IDs as text labels
-    for node in simulator.environment.nodes.values():
-        plt.text(node.position[0] + 0.02, node.position[1], str(node.id),
-                 fontsize=8, ha='center', va='center',
-                 bbox=dict(facecolor='white', alpha=0.1, edgecolor='none'))
-    plt.title("Node Positions")
-    plt.xlabel("X Position")
-    plt.ylabel("Y Position")
-    plt.axis('equal')
-    plt.show()
-    simulator.schedule_event(1.0, render_sync, simulator, color_from)  # Schedule next render
\ No newline at end of file
+    if renderer is None:
+        renderer = Renderer(color_from)
+    renderer.render(simulator.environment)
+    simulator.schedule_event(period, render_sync, simulator, color_from, renderer, period)
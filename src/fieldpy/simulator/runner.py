@@ -1,21 +1,281 @@
-from fieldpy import engine
-from fieldpy.data import State
-from fieldpy.simulator import Simulator, Node
+import random
+import threading
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter
+from typing import Dict, List, Any, Optional
 
+from fieldpy import calculus
+from fieldpy.calculus import current_engine, use_engine
+from fieldpy.data import STATES
+from fieldpy.data.batch import Topology, TupleColumn, as_column, column_from_values, to_list
+from fieldpy.internal import MutableEngine
+from fieldpy.internal.batch import BatchEngine
+from fieldpy.simulator import Simulator, Node, Environment
+from fieldpy.simulator.events import register_action
 
+
+@register_action
 def aggregate_program_runner(simulator: Simulator, time_delta: float, node: Node, program: callable):
     """
-    Run the program for a node.
+    Run the program for a node (and schedule the next run, until the node is removed from the environment).
     """
+    if simulator.environment.nodes.get(node.id) is not node:
+        return
     # get neighbors
     all_neighbors = simulator.environment.get_neighbors(node)
     # take the messages from the neighbors, create a dict like id -> messages (that is a dict)
     neighbors_messages = {neighbor.id: neighbor.data.get("messages", {}) for neighbor in all_neighbors}
+    run_round(node, neighbors_messages, program)
+    simulator.schedule_event(time_delta, aggregate_program_runner, simulator, time_delta, node, program)
+
+
+def _run_nodes(environment: Environment, nodes: List[Node], program: callable,
+               previous: Optional[Dict[Any, Any]]):
+    for node in nodes:
+        if node.environment is not environment:
+            continue
+        if previous is None:
+            neighbors_messages = {n.id: n.data.get("messages", {}) for n in environment.get_neighbors(node)}
+        else:
+            neighbors_messages = {n.id: previous[n.id] if n.id in previous else n.data.get("messages", {})
+                                  for n in environment.get_neighbors(node)}
+        run_round(node, neighbors_messages, program)
+
+
+@register_action
+def round_program_runner(simulator: Simulator, time_delta: float, program: callable,
+                         nodes: Optional[List[Node]] = None, shuffle: bool = False, synchronous: bool = False,
+                         jitter: float = 0.0, rng: Optional[random.Random] = None):
+    """
+    Run a round of the program for many nodes in a single event (see `Simulator.schedule_rounds`).
+    :param nodes: The nodes of the round (every node of the environment, in insertion order, if None).
+    :param shuffle: Run the nodes in a new random order every round.
+    :param synchronous: Every node reads the messages its neighbors exported in the previous round (they are
+    double buffered); otherwise it reads the latest ones, as with one `aggregate_program_runner` event per node.
+    :param jitter: Every round, each node fires at a random offset in [0, jitter) from the round time: the nodes
+    sharing an offset run in an event of their own (see `jittered_round_runner`), so the other events scheduled
+    within the jitter window run in between.
+    :param rng: The random generator used for shuffles and jitter.
+    """
+    environment = simulator.environment
+    rng = rng or random.Random()
+    # removed nodes are skipped
+    order = [node for node in (environment.node_list() if nodes is None else nodes) if node.environment is environment]
+    previous = {node.id: node.data.get("messages", {}) for node in order} if synchronous else None
+    if jitter > 0:
+        offsets: Dict[float, List[Node]] = {}
+        for node in order:
+            offsets.setdefault(rng.uniform(0.0, jitter), []).append(node)
+        steps = sorted(offsets.items(), key=lambda step: step[0])
+        if steps:
+            simulator.schedule_event(steps[0][0], jittered_round_runner, simulator, program, steps, 0, previous)
+    else:
+        if shuffle:
+            rng.shuffle(order)
+        _run_nodes(environment, order, program, previous)
+    simulator.schedule_event(time_delta, round_program_runner, simulator, time_delta, program, nodes, shuffle,
+                             synchronous, jitter, rng)
+
+
+@register_action
+def jittered_round_runner(simulator: Simulator, program: callable, steps: List[tuple], index: int,
+                          previous: Optional[Dict[Any, Any]]):
+    """
+    Run the nodes of a jittered round that fire at the same offset, then schedule the ones of the next offset.
+    :param steps: The (offset, nodes) of the round, by offset.
+    :param index: The step to run.
+    :param previous: The messages of the previous round, for synchronous rounds (None otherwise).
+    """
+    offset, nodes = steps[index]
+    _run_nodes(simulator.environment, nodes, program, previous)
+    if index + 1 < len(steps):
+        simulator.schedule_event(steps[index + 1][0] - offset, jittered_round_runner, simulator, program, steps,
+                                 index + 1, previous)
+
+
+class ThreadedRounds:
+    """
+    The thread pool of `threaded_program_runner`: each worker thread runs its nodes on its own (plain)
+    `MutableEngine`, set with `use_engine` (which only affects the current thread). The threads start with the first
+    round and stop with `close` (or when the rounds are garbage collected, or at exit):
+    ```python
+    with ThreadedRounds(workers=4) as threads:
+        simulator.schedule_event(0.0, threaded_program_runner, simulator, 1.0, program, threads=threads)
+        simulator.run(100)
+    ```
+    Pickling the rounds (e.g. in a checkpoint of the simulator) leaves the threads out: the restored rounds start
+    new ones.
+    """
+
+    def __init__(self, workers: int = 4):
+        self.workers = workers
+        self.executor: Optional[ThreadPoolExecutor] = None
+        # the engine of each worker thread
+        self.engines = threading.local()
+        self._finalizer = None
+
+    def _run_part(self, nodes: List[Node], neighborhoods: List[List[Node]], previous: Dict[Any, Any],
+                  program: callable):
+        engine = getattr(self.engines, "engine", None)
+        if engine is None:
+            engine = self.engines.engine = MutableEngine()
+        with use_engine(engine):
+            for node, neighbors in zip(nodes, neighborhoods):
+                run_round(node, {n.id: previous[n.id] if n.id in previous else n.data.get("messages", {})
+                                 for n in neighbors}, program)
+
+    def round(self, environment: Environment, program: callable, nodes: Optional[List[Node]] = None):
+        """Run a synchronous round of the program for the nodes (every node of the environment if None)"""
+        order = [node for node in (environment.node_list() if nodes is None else nodes)
+                 if node.environment is environment]
+        previous = {node.id: node.data.get("messages", {}) for node in order}
+        # the neighborhoods are computed (and cached) here: the threads only read them
+        neighborhoods = [environment.get_neighbors(node) for node in order]
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(self.workers, thread_name_prefix="fieldpy-round")
+            self._finalizer = weakref.finalize(self, self.executor.shutdown)
+        size = max(1, -(-len(order) // self.workers))
+        parts = [self.executor.submit(self._run_part, order[start:start + size], neighborhoods[start:start + size],
+                                      previous, program) for start in range(0, len(order), size)]
+        for part in parts:
+            part.result()
+
+    def close(self):
+        """Stop the threads"""
+        if self.executor is not None:
+            self._finalizer()
+            self.executor = None
+            self.engines = threading.local()
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state.update(executor=None, engines=None, _finalizer=None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.engines = threading.local()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exception_type, exception_value, traceback):
+        self.close()
+
+
+@register_action
+def threaded_program_runner(simulator: Simulator, time_delta: float, program: callable, workers: int = 4,
+                            nodes: Optional[List[Node]] = None, threads: Optional[ThreadedRounds] = None):
+    """
+    Run a synchronous round of the program for many nodes, split across `workers` threads (see `ThreadedRounds`).
+    Every node reads the messages its neighbors exported in the previous round, as with
+    `round_program_runner(..., synchronous=True)`: the results are the same, unless the program draws random
+    numbers (the threads draw them in no fixed order). The threads run at the same time on free-threaded builds of
+    Python; otherwise they take turns.
+    :param nodes: The nodes of the round (every node of the environment, in insertion order, if None).
+    :param threads: The thread pool of the rounds (by default a new one, kept by the next events of the runner until
+    they are dropped); pass one to close it when the simulation ends.
+    """
+    threads = threads or ThreadedRounds(workers)
+    threads.round(simulator.environment, program, nodes)
+    simulator.schedule_event(time_delta, threaded_program_runner, simulator, time_delta, program, workers, nodes,
+                             threads)
+
+
+def run_round(node: Node, neighbors_messages: Dict[Any, Dict[str, Any]], program: callable) -> Any:
+    """
+    Run a round of the program for a node, given the messages of its neighbors (id -> messages).
+    The result, the exported messages and the state are stored in the node data; the result is also returned.
+    If the program raises, the round is abandoned (see `MutableEngine.rollback`): the node data is left as it was, and
+    the state goes back to its values before the round.
+    """
+    profiler = calculus.profiler
+    start = perf_counter() if profiler is not None else 0.0
+    # the engine of `use_engine` in the current thread or asyncio task
+    engine = current_engine.get()
     engine.setup(neighbors_messages, node.id, node.data.get("state", {}))
-    result = program(node)
-    if isinstance(result, State):
+    try:
+        result = program(node)
+    except BaseException:
+        engine.rollback()
+        raise
+    if isinstance(result, STATES):
         result = result.value
     node.data["result"] = result
-    node.data["messages"] = engine.cooldown()
+    node.data["messages"] = messages = engine.cooldown()
     node.data["state"] = engine.state
-    simulator.schedule_event(time_delta, aggregate_program_runner, simulator, time_delta, node, program)
\ No newline at end of file
+    if profiler is not None:
+        profiler.round(node.id, perf_counter() - start, messages, engine.state)
+    return result
+
+
+class BatchData:
+    """Read-only view of a key of every node data as a column"""
+
+    def __init__(self, nodes: List[Node]):
+        self.nodes = nodes
+        self.columns = {}
+
+    def __getitem__(self, key: str) -> Any:
+        column = self.columns.get(key)
+        if column is None:
+            column = column_from_values([node.data[key] for node in self.nodes])
+            self.columns[key] = column
+        return column
+
+    def get(self, key: str, default: Any = None) -> Any:
+        if all(key in node.data for node in self.nodes):
+            return self[key]
+        return column_from_values([node.data.get(key, default) for node in self.nodes])
+
+    def __contains__(self, key: str) -> bool:
+        return all(key in node.data for node in self.nodes)
+
+
+class BatchContext:
+    """
+    The nodes of a batched round, seen as a single context: `id`, `position` and `data` are columns
+    (the batched counterpart of the `Node` passed to programs by `aggregate_program_runner`).
+    """
+
+    def __init__(self, nodes: List[Node], topology: Topology):
+        self.nodes = nodes
+        self.id = topology.ids
+        self.position = TupleColumn(column_from_values(list(c)) for c in zip(*(node.position for node in nodes)))
+        self.data = BatchData(nodes)
+
+
+def environment_topology(environment: Environment, nodes: List[Node]) -> Topology:
+    """The topology of the current neighborhoods of the environment"""
+    return Topology([node.id for node in nodes],
+                    [[neighbor.id for neighbor in environment.get_neighbors(node)] for node in nodes])
+
+
+@register_action
+def batch_program_runner(simulator: Simulator, time_delta: float, program: callable,
+                         batch_engine: Optional[BatchEngine] = None):
+    """
+    Run a synchronous round of the program for all the nodes at once, with a `BatchEngine`.
+    Every node reads the values exported by its neighbors in the previous round; state and messages are kept by
+    the engine (only `result` is written in the nodes data). When the environment caches its neighbor lists, the
+    topology is rebuilt only when the environment changed since the previous round; otherwise (e.g. with a
+    neighborhood function depending on the data, on the time or on randomness) it is rebuilt every round.
+    """
+    batch_engine = batch_engine or BatchEngine()
+    environment = simulator.environment
+    version = (id(environment), environment.version) if environment.neighbors_cached else None
+    if batch_engine.topology is None or version is None or batch_engine.topology_version != version:
+        nodes = environment.node_list()
+        topology = environment_topology(environment, nodes)
+        batch_engine.topology_version = version
+    else:
+        topology = batch_engine.topology
+        nodes = [environment.nodes[id] for id in topology.id_list]
+    batch_engine.setup(topology)
+    with use_engine(batch_engine):
+        result = program(BatchContext(nodes, topology))
+    for node, value in zip(nodes, to_list(as_column(result, topology.size))):
+        node.data["result"] = value
+    batch_engine.cooldown()
+    simulator.schedule_event(time_delta, batch_program_runner, simulator, time_delta, program, batch_engine)
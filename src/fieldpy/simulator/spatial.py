@@ -0,0 +1,363 @@
+import heapq
+import itertools
+import math
+from abc import ABC, abstractmethod
+from typing import Dict, List, Tuple, Optional, Iterable
+
+"""
+Spatial indexes used by the environment to answer neighborhood queries without scanning every node.
+The environment keeps the index up to date through `add_node`, `remove_node` and `node_updated`,
+while the neighborhood functions (see `fieldpy.simulator.neighborhood`) query it.
+"""
+
+
+def squared_distance(a: Tuple[float, ...], b: Tuple[float, ...]) -> float:
+    """Squared Euclidean distance between two positions"""
+    if len(a) == 2:
+        dx = a[0] - b[0]
+        dy = a[1] - b[1]
+        return dx * dx + dy * dy
+    return sum((x - y) * (x - y) for x, y in zip(a, b))
+
+
+class SpatialIndex(ABC):
+    """
+    Abstract base class for spatial indexes over the nodes of an environment.
+    Nodes are stored by id together with the last position the index has seen for them.
+    """
+
+    def __init__(self):
+        self.nodes: Dict[any, any] = {}
+        self.positions: Dict[any, Tuple[float, ...]] = {}
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def position_of(self, node_id: any) -> Optional[Tuple[float, ...]]:
+        """Return the position the index has recorded for a node (None if not indexed)"""
+        return self.positions.get(node_id)
+
+    def insert(self, node) -> None:
+        """Add a node to the index"""
+        self.nodes[node.id] = node
+        self.positions[node.id] = node.position
+        self._insert(node.id, node.position)
+
+    def remove(self, node_id: any) -> None:
+        """Remove a node from the index"""
+        if node_id in self.nodes:
+            self._remove(node_id, self.positions[node_id])
+            del self.nodes[node_id]
+            del self.positions[node_id]
+
+    def update(self, node) -> None:
+        """Refresh the position of a node already in the index"""
+        old_position = self.positions.get(node.id)
+        if old_position is None:
+            self.insert(node)
+        elif old_position != node.position:
+            self.positions[node.id] = node.position
+            self._move(node.id, old_position, node.position)
+
+    def clear(self) -> None:
+        """Remove every node from the index"""
+        self.nodes = {}
+        self.positions = {}
+        self._clear()
+
+    @abstractmethod
+    def _insert(self, node_id: any, position: Tuple[float, ...]) -> None:
+        pass
+
+    @abstractmethod
+    def _remove(self, node_id: any, position: Tuple[float, ...]) -> None:
+        pass
+
+    @abstractmethod
+    def _move(self, node_id: any, old_position: Tuple[float, ...], new_position: Tuple[float, ...]) -> None:
+        pass
+
+    @abstractmethod
+    def _clear(self) -> None:
+        pass
+
+    @abstractmethod
+    def query_radius(self, position: Tuple[float, ...], radius: float) -> List[any]:
+        """
+        Return the nodes within `radius` (inclusive) of `position`.
+        :param position: The center of the query.
+        :param radius: The radius of the query.
+        :return: The nodes within the radius, in no particular order.
+        """
+        pass
+
+    @abstractmethod
+    def query_knn(self, position: Tuple[float, ...], k: int, exclude: any = None) -> List[any]:
+        """
+        Return the `k` nodes closest to `position`, nearest first.
+        :param position: The center of the query.
+        :param k: The number of nodes to return.
+        :param exclude: An optional node id to skip (usually the querying node itself).
+        :return: The nearest nodes, ties broken by insertion order.
+        """
+        pass
+
+
+class GridIndex(SpatialIndex):
+    """
+    Uniform grid (spatial hashing) index. Each node is stored in the cell containing its position;
+    radius queries only visit the cells overlapping the query ball, so with a cell size close to the
+    neighborhood radius every query costs O(k). Moving a node costs O(1).
+    """
+
+    def __init__(self, cell_size: float = 1.0):
+        super().__init__()
+        if cell_size <= 0:
+            raise ValueError("cell_size must be positive")
+        self.cell_size = cell_size
+        self.cells: Dict[Tuple[int, ...], Dict[any, int]] = {}
+        self.order: Dict[any, int] = {}
+        self._counter = itertools.count()
+
+    def _cell(self, position: Tuple[float, ...]) -> Tuple[int, ...]:
+        size = self.cell_size
+        return tuple(math.floor(c / size) for c in position)
+
+    def _insert(self, node_id, position):
+        self.order[node_id] = next(self._counter)
+        self.cells.setdefault(self._cell(position), {})[node_id] = self.order[node_id]
+
+    def _remove(self, node_id, position):
+        cell = self._cell(position)
+        bucket = self.cells.get(cell)
+        if bucket is not None:
+            bucket.pop(node_id, None)
+            if not bucket:
+                del self.cells[cell]
+        del self.order[node_id]
+
+    def _move(self, node_id, old_position, new_position):
+        old_cell = self._cell(old_position)
+        new_cell = self._cell(new_position)
+        if old_cell == new_cell:
+            return
+        bucket = self.cells[old_cell]
+        bucket.pop(node_id, None)
+        if not bucket:
+            del self.cells[old_cell]
+        self.cells.setdefault(new_cell, {})[node_id] = self.order[node_id]
+
+    def _clear(self):
+        self.cells = {}
+        self.order = {}
+
+    def _cells_around(self, cell: Tuple[int, ...], reach: int) -> Iterable[Tuple[int, ...]]:
+        if len(cell) == 2:
+            cx, cy = cell
+            for x in range(cx - reach, cx + reach + 1):
+                for y in range(cy - reach, cy + reach + 1):
+                    yield x, y
+        else:
+            ranges = [range(c - reach, c + reach + 1) for c in cell]
+            yield from itertools.product(*ranges)
+
+    def query_radius(self, position, radius):
+        squared_radius = radius * radius
+        reach = math.ceil(radius / self.cell_size)
+        cells = self.cells
+        positions = self.positions
+        nodes = self.nodes
+        result = []
+        if (2 * reach + 1) ** len(position) > len(cells):
+            # the query ball covers more cells than are occupied: scan occupied cells only
+            candidates = (bucket for bucket in cells.values())
+        else:
+            candidates = (cells[c] for c in self._cells_around(self._cell(position), reach) if c in cells)
+        for bucket in candidates:
+            for node_id in bucket:
+                if squared_distance(position, positions[node_id]) <= squared_radius:
+                    result.append(nodes[node_id])
+        return result
+
+    def query_knn(self, position, k, exclude=None):
+        if k <= 0 or not self.nodes:
+            return []
+        cells = self.cells
+        positions = self.positions
+        center = self._cell(position)
+        # bounded max-heap of (-distance, -order, id): the root is the worst of the current best k
+        heap: List[Tuple[float, int, any]] = []
+        visited = 0
+        reach = 0
+        while True:
+            ring = self._ring(center, reach)
+            for cell in ring:
+                bucket = cells.get(cell)
+                if bucket is None:
+                    continue
+                visited += len(bucket)
+                for node_id, order in bucket.items():
+                    if node_id == exclude:
+                        continue
+                    entry = (-squared_distance(position, positions[node_id]), -order, node_id)
+                    if len(heap) < k:
+                        heapq.heappush(heap, entry)
+                    elif entry > heap[0]:
+                        heapq.heapreplace(heap, entry)
+            if visited >= len(self.nodes):
+                break
+            if len(heap) == k:
+                # every node outside the visited block is at least `reach * cell_size` away
+                bound = reach * self.cell_size
+                if -heap[0][0] <= bound * bound:
+                    break
+            reach += 1
+        heap.sort(reverse=True)
+        return [self.nodes[node_id] for _, _, node_id in heap]
+
+    def _ring(self, center: Tuple[int, ...], reach: int) -> Iterable[Tuple[int, ...]]:
+        """Cells at Chebyshev distance exactly `reach` from `center`"""
+        if reach == 0:
+            return [center]
+        return (cell for cell in self._cells_around(center, reach)
+                if max(abs(a - b) for a, b in zip(cell, center)) == reach)
+
+
+class _KDNode:
+    __slots__ = ("node_id", "position", "order", "axis", "left", "right")
+
+    def __init__(self, node_id, position, order, axis):
+        self.node_id = node_id
+        self.position = position
+        self.order = order
+        self.axis = axis
+        self.left = None
+        self.right = None
+
+
+class KDTreeIndex(SpatialIndex):
+    """
+    KD-tree index (balanced, by median split), which suits unevenly distributed nodes where a fixed grid
+    cell size is hard to pick. Nodes inserted or moved after the tree was built are kept aside (as stale
+    entries): queries skip their old tree entries and check their current positions one by one, and the
+    tree is rebuilt only once the stale entries are too many (so moving a node costs O(1), and a batch
+    of movements costs a single rebuild, on the first query after it).
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.root: Optional[_KDNode] = None
+        self.order: Dict[any, int] = {}
+        self._counter = itertools.count()
+        # ids inserted or moved since the tree was built (their tree entries, if any, are outdated)
+        self.pending: Dict[any, None] = {}
+        # tree entries of removed nodes, still in the tree
+        self._removed = 0
+
+    def _insert(self, node_id, position):
+        self.order[node_id] = next(self._counter)
+        self.pending[node_id] = None
+
+    def _remove(self, node_id, position):
+        del self.order[node_id]
+        if node_id in self.pending:
+            del self.pending[node_id]
+        else:
+            self._removed += 1
+
+    def _move(self, node_id, old_position, new_position):
+        self.pending[node_id] = None
+
+    def _clear(self):
+        self.root = None
+        self.order = {}
+        self.pending = {}
+        self._removed = 0
+
+    def _stale(self) -> bool:
+        """Whether the outdated entries cost more to scan than the tree to rebuild"""
+        stale = len(self.pending) + self._removed
+        if stale <= 32:
+            return False
+        # rebuilding costs n log n, scanning the stale entries costs one pass per query
+        count = len(self.nodes)
+        return stale * stale > count * max(1, count.bit_length())
+
+    def _rebuild(self):
+        points = [(self.positions[node_id], self.order[node_id], node_id) for node_id in self.nodes]
+        self.root = self._build(points, 0)
+        self.pending = {}
+        self._removed = 0
+
+    def _build(self, points, depth) -> Optional[_KDNode]:
+        if not points:
+            return None
+        axis = depth % len(points[0][0])
+        points.sort(key=lambda p: p[0][axis])
+        median = len(points) // 2
+        position, order, node_id = points[median]
+        kd_node = _KDNode(node_id, position, order, axis)
+        kd_node.left = self._build(points[:median], depth + 1)
+        kd_node.right = self._build(points[median + 1:], depth + 1)
+        return kd_node
+
+    def query_radius(self, position, radius):
+        if self._stale():
+            self._rebuild()
+        squared_radius = radius * radius
+        nodes = self.nodes
+        pending = self.pending
+        positions = self.positions
+        result = [nodes[node_id] for node_id in pending
+                  if squared_distance(position, positions[node_id]) <= squared_radius]
+        stack = [self.root]
+        while stack:
+            kd_node = stack.pop()
+            if kd_node is None:
+                continue
+            node_id = kd_node.node_id
+            if squared_distance(position, kd_node.position) <= squared_radius \
+                    and node_id in nodes and node_id not in pending:
+                result.append(nodes[node_id])
+            delta = position[kd_node.axis] - kd_node.position[kd_node.axis]
+            if delta <= radius:
+                stack.append(kd_node.left)
+            if delta >= -radius:
+                stack.append(kd_node.right)
+        return result
+
+    def query_knn(self, position, k, exclude=None):
+        if self._stale():
+            self._rebuild()
+        if k <= 0:
+            return []
+        nodes = self.nodes
+        pending = self.pending
+        heap: List[Tuple[float, int, any]] = []
+
+        def offer(entry):
+            if len(heap) < k:
+                heapq.heappush(heap, entry)
+            elif entry > heap[0]:
+                heapq.heapreplace(heap, entry)
+
+        # the stale entries first: a full heap prunes more of the tree
+        for node_id in pending:
+            if node_id != exclude:
+                offer((-squared_distance(position, self.positions[node_id]), -self.order[node_id], node_id))
+
+        def visit(kd_node):
+            if kd_node is None:
+                return
+            node_id = kd_node.node_id
+            if node_id != exclude and node_id in nodes and node_id not in pending:
+                offer((-squared_distance(position, kd_node.position), -kd_node.order, node_id))
+            delta = position[kd_node.axis] - kd_node.position[kd_node.axis]
+            near, far = (kd_node.left, kd_node.right) if delta <= 0 else (kd_node.right, kd_node.left)
+            visit(near)
+            if len(heap) < k or delta * delta <= -heap[0][0]:
+                visit(far)
+
+        visit(self.root)
+        heap.sort(reverse=True)
+        return [nodes[node_id] for _, _, node_id in heap]
@@ -0,0 +1,190 @@
+"""
+Struct-of-arrays storage for the nodes of an environment (see `Environment(arrays=...)`).
+Positions live in one contiguous (N, d) NumPy array and every declared numeric sensor column in one array;
+ids are dense integers (the row of the node) and nodes are thin views onto their row. The other keys of the
+nodes data (e.g. the `messages`, `state` and `result` written by the runners) are kept in a per-row dictionary,
+created only for the rows that use it.
+"""
+from collections.abc import MutableMapping
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from fieldpy.simulator import Node
+
+
+class NodeArrays(object):
+    """
+    The rows of the nodes: positions, numeric columns and the other data. Rows are never reused, so the ids of
+    removed nodes stay unique.
+    """
+
+    def __init__(self, dimensions: int = 2, columns: Optional[Dict[str, Any]] = None, capacity: int = 1024):
+        """
+        :param dimensions: The dimensions of the positions.
+        :param columns: The numeric columns of the nodes data, as name -> NumPy dtype (e.g. {"temperature": float}).
+        Every node has all of them, starting from zero.
+        :param capacity: The initial number of rows (the arrays double when they are full).
+        """
+        self.dimensions = dimensions
+        self.size = 0
+        self.positions: np.ndarray = np.zeros((capacity, dimensions))
+        self.columns: Dict[str, np.ndarray] = {name: np.zeros(capacity, dtype=dtype)
+                                               for name, dtype in (columns or {}).items()}
+        self.extra: List[Optional[Dict[str, Any]]] = []
+        # the positions as tuples, built on the first read of each row (None until then or after a write)
+        self.tuples: List[Optional[Tuple[float, ...]]] = []
+
+    def __getstate__(self):
+        # the position tuples are not saved (they are rebuilt on demand)
+        state = dict(self.__dict__)
+        state["tuples"] = [None] * self.size
+        return state
+
+    def empty(self) -> 'NodeArrays':
+        """New arrays without rows, with the same dimensions and columns"""
+        return NodeArrays(self.dimensions, {name: column.dtype for name, column in self.columns.items()})
+
+    def set_positions(self, rows: np.ndarray, positions: np.ndarray):
+        """Write the positions of many rows at once (writing `positions` directly would leave stale tuples)"""
+        self.positions[rows] = positions
+        tuples = self.tuples
+        for row in rows.tolist():
+            tuples[row] = None
+
+    def _grow(self):
+        capacity = max(2 * len(self.positions), 1)
+        positions = np.zeros((capacity, self.dimensions))
+        positions[:self.size] = self.positions[:self.size]
+        self.positions = positions
+        for name, column in self.columns.items():
+            grown = np.zeros(capacity, dtype=column.dtype)
+            grown[:self.size] = column[:self.size]
+            self.columns[name] = grown
+
+    def add(self, position: Tuple[float, ...], data: Optional[Dict[str, Any]] = None) -> int:
+        """Add a row, returning its index"""
+        if self.size == len(self.positions):
+            self._grow()
+        row = self.size
+        self.size += 1
+        self.positions[row] = position
+        self.extra.append(None)
+        self.tuples.append(None)
+        if data:
+            self.set_data(row, data)
+        return row
+
+    def create_node(self, position: Tuple[float, ...], data: Optional[Dict[str, Any]] = None,
+                    id: Optional[int] = None) -> 'ArrayNode':
+        """Add a row and return its node (the id, if given, must be the index of the new row)"""
+        if id is not None and id != self.size:
+            raise ValueError(f"node ids of the node arrays are dense: expected {self.size}, got {id}")
+        return ArrayNode(self, self.add(position, data))
+
+    def release(self, row: int):
+        """Drop the data of a removed node (its row is not reused)"""
+        self.extra[row] = None
+
+    def set_data(self, row: int, data: Dict[str, Any]):
+        """Replace the data of a row"""
+        for column in self.columns.values():
+            column[row] = 0
+        self.extra[row] = None
+        values = RowData(self, row)
+        for key, value in data.items():
+            values[key] = value
+
+
+class RowData(MutableMapping):
+    """The data of a node, as a mapping over its row (numeric columns first, then the other keys)"""
+    __slots__ = ("arrays", "row")
+
+    def __init__(self, arrays: NodeArrays, row: int):
+        self.arrays = arrays
+        self.row = row
+
+    def __getitem__(self, key: str) -> Any:
+        column = self.arrays.columns.get(key)
+        if column is not None:
+            return column[self.row].item()
+        extra = self.arrays.extra[self.row]
+        if extra is None:
+            raise KeyError(key)
+        return extra[key]
+
+    def __setitem__(self, key: str, value: Any):
+        column = self.arrays.columns.get(key)
+        if column is not None:
+            column[self.row] = value
+            return
+        extra = self.arrays.extra[self.row]
+        if extra is None:
+            extra = self.arrays.extra[self.row] = {}
+        extra[key] = value
+
+    def __delitem__(self, key: str):
+        if key in self.arrays.columns:
+            raise KeyError(f"{key} is a column of the node arrays and cannot be removed")
+        extra = self.arrays.extra[self.row]
+        if extra is None:
+            raise KeyError(key)
+        del extra[key]
+
+    def __contains__(self, key: object) -> bool:
+        if key in self.arrays.columns:
+            return True
+        extra = self.arrays.extra[self.row]
+        return extra is not None and key in extra
+
+    def __iter__(self) -> Iterator[str]:
+        yield from self.arrays.columns
+        extra = self.arrays.extra[self.row]
+        if extra is not None:
+            yield from list(extra)
+
+    def __len__(self) -> int:
+        extra = self.arrays.extra[self.row]
+        return len(self.arrays.columns) + (len(extra) if extra is not None else 0)
+
+    def __repr__(self):
+        return repr(dict(self))
+
+
+class ArrayNode(object):
+    """A node stored in `NodeArrays`: the same interface as `Node`, as a view onto its row"""
+    __slots__ = ("arrays", "id", "environment")
+
+    def __init__(self, arrays: NodeArrays, row: int):
+        self.arrays = arrays
+        self.id = row
+        self.environment = None
+
+    @property
+    def position(self) -> Tuple[float, ...]:
+        tuples = self.arrays.tuples
+        position = tuples[self.id]
+        if position is None:
+            position = tuples[self.id] = tuple(self.arrays.positions[self.id].tolist())
+        return position
+
+    @position.setter
+    def position(self, position: Tuple[float, ...]):
+        self._place(position)
+        if self.environment is not None:
+            self.environment.node_updated(self)
+
+    def _place(self, position: Tuple[float, ...]):
+        self.arrays.positions[self.id] = position
+        self.arrays.tuples[self.id] = None
+
+    @property
+    def data(self) -> RowData:
+        return RowData(self.arrays, self.id)
+
+    @data.setter
+    def data(self, data: Dict[str, Any]):
+        self.arrays.set_data(self.id, data)
+
+    update = Node.update
+    get_neighbors = Node.get_neighbors
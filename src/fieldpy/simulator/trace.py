@@ -0,0 +1,278 @@
+"""
+Columnar traces of a simulation: a `TraceRecorder` snapshots chosen fields of the nodes data (and their positions)
+and streams them to a directory, a `TraceReader` loads time slices or the history of single nodes back.
+```python
+recorder = TraceRecorder("trace", fields=("result",), every=10)
+simulator.schedule_event(0.0, trace_runner, simulator, 0.1, recorder)
+simulator.run(1000)
+recorder.close()
+times, values = TraceReader("trace").history(42, "result")
+```
+On disk, the snapshots are grouped in chunks of `chunk_size` snapshots; every column of a chunk is an `.npy` file
+(`<chunk>.<column>.npy`, memory-mapped when read), and `index.bin` is an append-only array of (time, chunk,
+first row, rows) records, one per snapshot, appended only once the chunk is written. The recorder keeps at most
+one chunk in memory, whatever the length of the run.
+"""
+import json
+import os
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from fieldpy.simulator import Simulator, Environment
+from fieldpy.simulator.events import register_action
+
+INDEX_DTYPE = np.dtype([("time", "<f8"), ("chunk", "<i8"), ("start", "<i8"), ("count", "<i8")])
+
+
+def _column(name: str, values: List[Any]) -> np.ndarray:
+    column = np.asarray(values)
+    if column.dtype == object:
+        raise TypeError(f"the values of {name} cannot be stored in a trace (they are not numbers, strings, "
+                        f"or arrays of the same shape)")
+    return column
+
+
+class TraceRecorder:
+    """Records snapshots of the nodes of an environment in a trace directory"""
+
+    def __init__(self, directory: str, fields: Sequence[str] = ("result",), positions: bool = True,
+                 every: int = 1, chunk_size: int = 64):
+        """
+        :param directory: The directory of the trace (created if needed, it must not already hold a trace).
+        :param fields: The keys of the nodes data to record; nodes without a key (or where it holds None) have it
+        masked in the trace.
+        :param positions: Record the positions of the nodes.
+        :param every: Record one snapshot out of `every` calls of `record`.
+        :param chunk_size: The number of snapshots of a chunk (the snapshots kept in memory before writing them).
+        """
+        if any(field in ("id", "position") for field in fields):
+            raise ValueError("id and position are reserved column names")
+        self.directory = directory
+        self.fields = tuple(fields)
+        self.positions = positions
+        self.every = max(every, 1)
+        self.chunk_size = chunk_size
+        self.calls = 0
+        self.chunk = 0
+        os.makedirs(directory, exist_ok=True)
+        if os.path.exists(os.path.join(directory, "index.bin")):
+            raise FileExistsError(f"{directory} already holds a trace")
+        with open(os.path.join(directory, "meta.json"), "w") as meta:
+            json.dump({"fields": list(self.fields), "positions": positions}, meta)
+        self.index = open(os.path.join(directory, "index.bin"), "ab")
+        # the size of the index at the checkpoint of a restored recorder, until it is resumed
+        self.index_size: Optional[int] = None
+        self._reset()
+
+    def _reset(self):
+        self.times: List[float] = []
+        self.counts: List[int] = []
+        self.ids: List[Any] = []
+        self.coordinates: List[Tuple[float, ...]] = []
+        self.values: Dict[str, List[Any]] = {field: [] for field in self.fields}
+        self.present: Dict[str, List[bool]] = {field: [] for field in self.fields}
+
+    def record(self, time: float, environment: Environment):
+        """Snapshot the nodes of the environment (unless the call is skipped by `every`)"""
+        self.calls += 1
+        if (self.calls - 1) % self.every:
+            return
+        nodes = list(environment.nodes.values())
+        self.times.append(time)
+        self.counts.append(len(nodes))
+        self.ids.extend(node.id for node in nodes)
+        if self.positions:
+            self.coordinates.extend(node.position for node in nodes)
+        for field in self.fields:
+            values = self.values[field]
+            present = self.present[field]
+            for node in nodes:
+                data = node.data
+                value = data.get(field) if data is not None else None
+                if value is not None:
+                    values.append(value)
+                    present.append(True)
+                else:
+                    values.append(None)
+                    present.append(False)
+        if len(self.times) >= self.chunk_size:
+            self.flush()
+
+    def _save(self, column: str, array: np.ndarray):
+        np.save(os.path.join(self.directory, f"{self.chunk:06d}.{column}.npy"), array)
+
+    def flush(self):
+        """
+        Write the snapshots kept in memory as a chunk. The columns are checked before any file is written: if a
+        field holds values that cannot be stored, the chunk is dropped (no file of it is written) and TypeError is
+        raised, so the next chunks are recorded normally.
+        """
+        if self.index is None:
+            self.resume()
+        if not self.times:
+            return
+        try:
+            columns = {"id": _column("id", self.ids)}
+            if self.positions:
+                columns["position"] = _column("position", self.coordinates)
+            for field in self.fields:
+                values = self.values[field]
+                present = self.present[field]
+                if not all(present):
+                    # masked entries take the value of a present one (or 0), so the column keeps its dtype
+                    fill = next((value for value, found in zip(values, present) if found), 0)
+                    values = [value if found else fill for value, found in zip(values, present)]
+                    columns[f"{field}.mask"] = np.asarray(present)
+                columns[field] = _column(field, values)
+        except (TypeError, ValueError) as error:
+            dropped = len(self.times)
+            self._reset()
+            raise TypeError(f"{error}: the chunk of {dropped} snapshots is dropped") from error
+        for column, array in columns.items():
+            self._save(column, array)
+        records = np.empty(len(self.times), dtype=INDEX_DTYPE)
+        records["time"] = self.times
+        records["chunk"] = self.chunk
+        records["count"] = self.counts
+        records["start"] = np.cumsum(self.counts) - self.counts
+        self.index.write(records.tobytes())
+        self.index.flush()
+        self.chunk += 1
+        self._reset()
+
+    def close(self):
+        """Write the last chunk and close the trace"""
+        if self.index is None or not self.index.closed:
+            self.flush()
+            self.index.close()
+
+    def resume(self):
+        """
+        Continue the trace from the checkpoint this recorder was restored from: the snapshots written after it are
+        dropped from the index (the next chunks overwrite their files). Restoring a checkpoint leaves the trace
+        untouched until then; the first `flush` (or `close`) resumes it anyway.
+        """
+        if self.index is None:
+            self.index = open(os.path.join(self.directory, "index.bin"), "r+b")
+            self.index.truncate(self.index_size)
+            self.index.seek(self.index_size)
+            self.index_size = None
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        index = state.pop("index")
+        if index is not None:
+            state["index_size"] = index.tell() if not index.closed else None
+        return state
+
+    def __setstate__(self, state):
+        # the index is opened (and truncated to its size at the checkpoint) by `resume`
+        self.__dict__.update(state)
+        self.index = None
+        if self.index_size is None:
+            # closed at the checkpoint
+            self.index = open(os.path.join(self.directory, "index.bin"), "rb")
+            self.index.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+@register_action
+def trace_runner(simulator: Simulator, time_delta: float, recorder: TraceRecorder):
+    """Record a snapshot of the simulator's environment, then schedule the next one after `time_delta`"""
+    recorder.record(simulator.current_time, simulator.environment)
+    simulator.schedule_event(time_delta, trace_runner, simulator, time_delta, recorder)
+
+
+class TraceReader:
+    """
+    Reads a trace directory. The index is memory-mapped and the columns are loaded one chunk at a time, so reading a
+    time slice only touches its chunks, and the history of a node only the ids and the requested column.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        with open(os.path.join(directory, "meta.json")) as meta:
+            meta = json.load(meta)
+        self.fields: Tuple[str, ...] = tuple(meta["fields"])
+        self.positions: bool = meta["positions"]
+        path = os.path.join(directory, "index.bin")
+        size = os.path.getsize(path) // INDEX_DTYPE.itemsize
+        self.index = np.memmap(path, dtype=INDEX_DTYPE, mode="r", shape=(size,)) if size else \
+            np.empty(0, dtype=INDEX_DTYPE)
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    @property
+    def times(self) -> np.ndarray:
+        """The time of every snapshot"""
+        return self.index["time"]
+
+    def columns(self) -> Tuple[str, ...]:
+        return ("id",) + (("position",) if self.positions else ()) + self.fields
+
+    def _load(self, chunk: int, column: str) -> np.ndarray:
+        return np.load(os.path.join(self.directory, f"{chunk:06d}.{column}.npy"), mmap_mode="r")
+
+    def _mask(self, chunk: int, field: str) -> Optional[np.ndarray]:
+        path = os.path.join(self.directory, f"{chunk:06d}.{field}.mask.npy")
+        return np.load(path, mmap_mode="r") if os.path.exists(path) else None
+
+    def snapshot(self, number: int, columns: Optional[Sequence[str]] = None) -> Dict[str, Any]:
+        """
+        A snapshot, as a dictionary with its `time` and an array for every column (all of them if None); the masked
+        entries of a field are listed by a boolean `<field>.mask` array.
+        """
+        record = self.index[number]
+        chunk, start, count = int(record["chunk"]), int(record["start"]), int(record["count"])
+        snapshot: Dict[str, Any] = {"time": float(record["time"])}
+        for column in columns or self.columns():
+            snapshot[column] = np.array(self._load(chunk, column)[start:start + count])
+            if column in self.fields:
+                mask = self._mask(chunk, column)
+                if mask is not None:
+                    snapshot[f"{column}.mask"] = np.array(mask[start:start + count])
+        return snapshot
+
+    def between(self, start: float, end: float, columns: Optional[Sequence[str]] = None) -> Iterator[Dict[str, Any]]:
+        """The snapshots taken in [start, end], in order"""
+        times = self.times
+        first = int(np.searchsorted(times, start, side="left"))
+        last = int(np.searchsorted(times, end, side="right"))
+        for number in range(first, last):
+            yield self.snapshot(number, columns)
+
+    def history(self, node_id: Any, column: str = "result") -> Tuple[np.ndarray, np.ndarray]:
+        """
+        The times of the snapshots holding a node and its values of a column in them (the snapshots in which the
+        field of the node is masked are left out).
+        """
+        times: List[np.ndarray] = []
+        values: List[np.ndarray] = []
+        index = self.index
+        chunks = index["chunk"]
+        bounds = np.flatnonzero(np.diff(chunks)) + 1
+        for first, last in zip(np.concatenate(([0], bounds)), np.concatenate((bounds, [len(index)]))):
+            if first == last:
+                continue
+            records = index[first:last]
+            chunk = records["chunk"][0]
+            ids = self._load(int(chunk), "id")
+            rows = np.flatnonzero(ids == node_id)
+            if not len(rows):
+                continue
+            mask = self._mask(int(chunk), column) if column in self.fields else None
+            if mask is not None:
+                rows = rows[np.asarray(mask[rows])]
+            snapshots = np.searchsorted(records["start"], rows, side="right") - 1
+            times.append(np.asarray(records["time"][snapshots]))
+            values.append(np.asarray(self._load(int(chunk), column)[rows]))
+        if not times:
+            return np.empty(0), np.empty(0)
+        return np.concatenate(times), np.concatenate(values)
@@ -0,0 +1,146 @@
+import itertools
+import random
+
+import pytest
+
+from fieldpy.calculus import aggregate, current_engine, mux, neighbors, neighbors_distances
+from fieldpy.data import Field
+from fieldpy.internal.batch import BatchEngine
+from fieldpy.libraries.collect import count_nodes
+from fieldpy.libraries.diffusion import cast_from, distance_to
+from fieldpy.simulator import Simulator
+from fieldpy.simulator.deployments import deformed_lattice
+from fieldpy.simulator.events import register_action
+from fieldpy.simulator.neighborhood import k_nearest_neighbors, radius_neighborhood
+from fieldpy.simulator.runner import batch_program_runner
+
+
+def same_group(node, nodes):
+    return [other for other in nodes if other is not node and other.data["group"] == node.data["group"]]
+
+
+@aggregate
+def neighborhood_size(context):
+    return neighbors(1).fold(lambda a, b: a + b, 0)
+
+
+@register_action
+def regroup_runner(simulator):
+    # the groups change in the node data, without notifying the environment
+    for node in simulator.environment.node_list():
+        node.data["group"] = (node.id + int(simulator.current_time)) % 3
+    simulator.schedule_event(1.0, regroup_runner, simulator)
+
+
+def group_simulator():
+    simulator = Simulator()
+    simulator.environment.set_neighborhood_function(same_group)
+    for id in range(9):
+        simulator.environment.create_node((float(id), 0.0), {"group": 0}, id)
+    simulator.schedule_event(0.0, regroup_runner, simulator)
+    return simulator
+
+
+def test_topology_follows_a_neighborhood_function_that_is_not_cached():
+    batched = group_simulator()
+    batched.schedule_event(0.5, batch_program_runner, batched, 1.0, neighborhood_size)
+    batched.run(3.9)
+    sequential = group_simulator()
+    sequential.schedule_rounds(neighborhood_size, 1.0, synchronous=True, delay=0.5)
+    sequential.run(3.9)
+    results = [node.data["result"] for node in batched.environment.node_list()]
+    assert results == [node.data["result"] for node in sequential.environment.node_list()] == [3] * 9
+
+
+def test_field_comparisons_are_explicit():
+    first, second = Field({1: 2}, None), Field({1: 3}, None)
+    assert first != second and first == first
+    assert first not in [second]
+    assert first.eq(second).data == {1: False}
+    assert first.ne(second).data == {1: True}
+
+
+@aggregate
+def gradient_cast_count(context):
+    distances = neighbors_distances(context.position)
+    distance = distance_to(context.data["source"], distances)
+    closest = cast_from(context.data["source"], context.id, distances)
+    count = count_nodes(context, distance)
+    return distance.value, closest.value, count.value, mux(distance < 2.0, "near", "far")
+
+
+@register_action
+def churn_runner(simulator, rng, ids):
+    environment = simulator.environment
+    nodes = environment.node_list()
+    for node in nodes[::4]:
+        x, y = node.position
+        node.position = (x + rng.uniform(-0.3, 0.3), y + rng.uniform(-0.3, 0.3))
+    environment.remove_node(nodes[rng.randrange(1, len(nodes))].id)
+    environment.create_node((rng.uniform(0, 6), rng.uniform(0, 6)), {"source": False}, next(ids))
+    simulator.schedule_event(3.0, churn_runner, simulator, rng, ids)
+
+
+def churning_lattice(neighborhood):
+    random.seed(4)
+    simulator = Simulator()
+    simulator.environment.set_neighborhood_function(neighborhood)
+    deformed_lattice(simulator, 7, 7, 1.0, 0.2)
+    for node in simulator.environment.node_list():
+        node.data = {"source": node.id == 0}
+    simulator.schedule_event(2.5, churn_runner, simulator, random.Random(9), itertools.count(100))
+    return simulator
+
+
+@pytest.mark.parametrize("neighborhood", [radius_neighborhood(1.5), k_nearest_neighbors(4)], ids=["radius", "knn"])
+def test_batched_rounds_match_sequential_rounds_of_a_changing_network(neighborhood):
+    batched = churning_lattice(neighborhood)
+    batched.schedule_event(0.0, batch_program_runner, batched, 1.0, gradient_cast_count)
+    batched.run(20.2)
+    sequential = churning_lattice(neighborhood)
+    sequential.schedule_rounds(gradient_cast_count, 1.0, synchronous=True)
+    sequential.run(20.2)
+    expected = {id: node.data["result"] for id, node in sequential.environment.nodes.items()}
+    assert {id: node.data["result"] for id, node in batched.environment.nodes.items()} == expected
+
+
+@aggregate
+def probe(value):
+    # what `neighbors` does, reading the alignment of the engine on the way
+    engine = current_engine.get()
+    engine.send(value)
+    if isinstance(engine, BatchEngine):
+        return list(zip(engine.topology.id_list, engine.aligned(), engine.aligned_values(engine.path)))
+    return [(engine.id, engine.aligned(), engine.aligned_values(engine.path))]
+
+
+def exchange_into(seen):
+    @aggregate
+    def exchange(context):
+        for id, aligned, values in probe(context.data["value"]):
+            seen[id] = (sorted(aligned), values)
+        return 0
+    return exchange
+
+
+def exchanging_line(batched, seen):
+    simulator = Simulator()
+    simulator.environment.set_neighborhood_function(radius_neighborhood(1.1))
+    for id in range(5):
+        simulator.environment.create_node((float(id), 0.0), {"value": id * 10}, id)
+    if batched:
+        simulator.schedule_event(0.0, batch_program_runner, simulator, 1.0, exchange_into(seen))
+    else:
+        simulator.schedule_rounds(exchange_into(seen), 1.0, synchronous=True)
+    # node 2 leaves after the second round: its neighbors drop its value
+    simulator.schedule_event(1.5, simulator.environment.remove_node, 2)
+    simulator.run(2.5)
+
+
+def test_batch_engine_aligned_neighbors_match_sequential_rounds():
+    batched, sequential = {}, {}
+    exchanging_line(True, batched)
+    exchanging_line(False, sequential)
+    assert batched == sequential
+    assert batched[1] == ([0], {0: 0})
+    assert batched[3] == ([4], {4: 40})
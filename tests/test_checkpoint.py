@@ -0,0 +1,110 @@
+import io
+import random
+
+import numpy as np
+import pytest
+
+from fieldpy.calculus import aggregate, neighbors_distances
+from fieldpy.libraries.diffusion import distance_to
+from fieldpy.simulator import Simulator, checkpoint
+from fieldpy.simulator.events import register_action
+from fieldpy.simulator.mobility import Bounded, GaussianJitter, Mobility, mobility_runner
+from fieldpy.simulator.neighborhood import radius_neighborhood
+from fieldpy.simulator.trace import TraceReader, TraceRecorder, trace_runner
+
+
+@aggregate
+def noisy_gradient(context):
+    # the global random generator takes part in the rounds, so it must be restored too
+    distances = neighbors_distances(context.position) * (1.0 + random.random() * 0.01)
+    return distance_to(context.data["source"], distances).value
+
+
+@register_action
+def noted(simulator, notes):
+    notes.append(simulator.current_time)
+
+
+def moving_network(directory=None):
+    random.seed(2)
+    simulator = Simulator()
+    simulator.environment.set_neighborhood_function(radius_neighborhood(0.3))
+    for id in range(30):
+        simulator.environment.create_node((random.random(), random.random()), {"source": id == 0}, id)
+    simulator.schedule_rounds(noisy_gradient, 1.0, shuffle=True, seed=1)
+    mobility = Mobility(simulator.environment.node_list(), Bounded(GaussianJitter(0.05), (0, 0), (1, 1)), seed=3)
+    simulator.schedule_event(0.5, mobility_runner, simulator, 1.0, mobility)
+    if directory is not None:
+        simulator.trace = TraceRecorder(directory, chunk_size=3)
+        simulator.schedule_event(0.0, trace_runner, simulator, 1.0, simulator.trace)
+    return simulator
+
+
+def snapshot(simulator):
+    return simulator.current_time, {id: (node.position, node.data.get("result"))
+                                    for id, node in simulator.environment.nodes.items()}
+
+
+@pytest.mark.parametrize("compress", [False, True])
+def test_restored_runs_match_uninterrupted_runs(tmp_path, compress):
+    uninterrupted = moving_network()
+    uninterrupted.run(20.5)
+    interrupted = moving_network()
+    interrupted.run(8.7)
+    path = str(tmp_path / "run.ckpt")
+    checkpoint.save(interrupted, path, compress)
+    # the original simulator goes on: the checkpoint does not share anything with it
+    interrupted.run(15.0)
+    restored = checkpoint.load(path)
+    assert restored.current_time == 8.5 and len(restored.event_queue) == 2
+    restored.run(20.5)
+    assert snapshot(restored) == snapshot(uninterrupted)
+
+
+def test_cancelled_events_stay_cancelled():
+    simulator = Simulator()
+    notes = []
+    simulator.schedule_event(1.0, noted, simulator, notes)
+    simulator.schedule_event(2.0, noted, simulator, notes).cancel()
+    stream = io.BytesIO()
+    checkpoint.save(simulator, stream)
+    stream.seek(0)
+    restored = checkpoint.load(stream)
+    assert len(restored.event_queue) == 1
+    notes = restored.event_queue.peek().args[1]
+    restored.run()
+    assert notes == [1.0]
+
+
+def test_unregistered_closures_and_foreign_streams_are_rejected():
+    simulator = Simulator()
+    simulator.schedule_event(1.0, lambda: None)
+    with pytest.raises(TypeError, match="register_action"):
+        checkpoint.save(simulator, io.BytesIO())
+    with pytest.raises(ValueError, match="not a fieldpy checkpoint"):
+        checkpoint.load(io.BytesIO(b"something else"))
+    with pytest.raises(ValueError, match="version"):
+        checkpoint.load(io.BytesIO(checkpoint.MAGIC + bytes([checkpoint.VERSION + 1, 0])))
+
+
+def test_restored_traces_drop_the_snapshots_after_the_checkpoint(tmp_path):
+    uninterrupted = moving_network(str(tmp_path / "uninterrupted"))
+    uninterrupted.run(12.5)
+    uninterrupted.trace.close()
+    interrupted = moving_network(str(tmp_path / "interrupted"))
+    interrupted.run(4.5)
+    stream = io.BytesIO()
+    checkpoint.save(interrupted, stream)
+    # the run goes on (writing chunks) and stops: the trace is truncated at the checkpoint when it resumes
+    interrupted.run(10.5)
+    interrupted.trace.close()
+    assert len(TraceReader(str(tmp_path / "interrupted"))) == 11
+    stream.seek(0)
+    restored = checkpoint.load(stream)
+    restored.run(12.5)
+    restored.trace.close()
+    expected, resumed = TraceReader(str(tmp_path / "uninterrupted")), TraceReader(str(tmp_path / "interrupted"))
+    assert resumed.times.tolist() == expected.times.tolist() == [float(time) for time in range(13)]
+    for number in range(13):
+        for column in ("id", "position", "result"):
+            assert np.array_equal(resumed.snapshot(number)[column], expected.snapshot(number)[column])
@@ -0,0 +1,128 @@
+import random
+
+import pytest
+
+from fieldpy.calculus import aggregate, neighbors_distances, use_engine
+from fieldpy.internal import MutableEngine
+from fieldpy.internal.codec import (MessageCodec, MessageDecoder, MessageEncoder, _read_value, _read_varint,
+                                    _write_value, _write_varint)
+from fieldpy.libraries.collect import count_nodes
+from fieldpy.libraries.diffusion import distance_to
+from fieldpy.simulator import Simulator
+from fieldpy.simulator.deployments import deformed_lattice
+from fieldpy.simulator.neighborhood import radius_neighborhood
+
+
+@pytest.mark.parametrize("number", [0, 1, 127, 128, 255, 16383, 16384, 2 ** 32, 2 ** 70])
+def test_varints_round_trip_at_the_byte_boundaries(number):
+    buffer = bytearray(b"\xff")
+    _write_varint(buffer, number)
+    assert _read_varint(bytes(buffer), 1) == (number, len(buffer))
+    assert len(buffer) - 1 == max(1, -(-number.bit_length() // 7))
+
+
+@pytest.mark.parametrize("value", [
+    None, True, False, 0, -1, 63, -64, 64, -2 ** 40, 2 ** 80, 0.1, -0.0, float("inf"), "", "nodo è", (),
+    (1, (2.5, "x", None), True), [1, 2], {"a": 1},
+])
+def test_values_round_trip_with_their_types(value):
+    buffer = bytearray()
+    _write_value(buffer, value)
+    decoded, offset = _read_value(bytes(buffer), 0)
+    assert offset == len(buffer)
+    assert decoded == value and type(decoded) is type(value)
+
+
+def test_pickled_values_are_refused_when_pickling_is_off():
+    with pytest.raises(TypeError):
+        _write_value(bytearray(), (1, [2]), pickled=False)
+    buffer = bytearray()
+    _write_value(buffer, [2])
+    with pytest.raises(ValueError):
+        _read_value(bytes(buffer), 0, pickled=False)
+
+
+def changing_messages(rounds=60, seed=0):
+    rng = random.Random(seed)
+    paths = [str(["program@0", "neighbors@%d" % index]) for index in range(8)]
+    messages = {path: 0.0 for path in paths}
+    for _ in range(rounds):
+        messages = dict(messages)
+        for path in rng.sample(paths, 2):
+            messages[path] = rng.choice([rng.random(), (rng.randrange(10), "x"), None])
+        # some paths stop being exported, others come back
+        if rng.random() < 0.2:
+            messages.pop(rng.choice(paths), None)
+        if rng.random() < 0.2:
+            messages[rng.choice(paths)] = rng.randrange(-5, 5)
+        yield messages
+
+
+@pytest.mark.parametrize("delta", [True, False])
+def test_decoded_packets_match_the_encoded_messages(delta):
+    encoder, decoder = MessageEncoder(delta, keyframe_every=8), MessageDecoder()
+    sizes = []
+    for messages in changing_messages():
+        packet = encoder.encode(messages)
+        sizes.append(len(packet))
+        assert decoder.decode(packet) == messages
+    if delta:
+        assert sum(sizes) < sum(len(MessageEncoder(False).encode(messages)) for messages in changing_messages())
+
+
+def test_a_lost_delta_packet_is_recovered_at_the_next_keyframe():
+    encoder, decoder = MessageEncoder(True, keyframe_every=5), MessageDecoder()
+    decoded = []
+    for sequence, messages in enumerate(changing_messages(15)):
+        packet = encoder.encode(messages)
+        if sequence == 2:
+            continue  # lost
+        decoded.append((sequence, decoder.decode(packet), messages))
+    assert all(view == messages for sequence, view, messages in decoded if sequence < 2 or sequence >= 5)
+    assert all(view is None for sequence, view, _ in decoded if 2 < sequence < 5)
+
+
+def test_late_receivers_decode_from_the_next_keyframe():
+    encoder = MessageEncoder(True, keyframe_every=4)
+    packets = [(encoder.encode(messages), messages) for messages in changing_messages(12)]
+    late = MessageDecoder()
+    views = [late.decode(packet) for packet, _ in packets[6:]]
+    assert views[:2] == [None, None]
+    assert views[2:] == [messages for _, messages in packets[8:]]
+
+
+def test_the_previous_packet_is_still_readable():
+    encoder, decoder = MessageEncoder(True), MessageDecoder()
+    first, second = encoder.encode({"a": 1, "b": 2}), encoder.encode({"a": 1, "b": 3})
+    assert decoder.decode(first) == {"a": 1, "b": 2}
+    assert decoder.decode(second) == {"a": 1, "b": 3}
+    # a neighbor that reads the previous packet after the new one was decoded
+    assert decoder.decode(first) == {"a": 1, "b": 2}
+    assert decoder.decode(second) == {"a": 1, "b": 3}
+
+
+@aggregate
+def gradient_count(context):
+    distance = distance_to(context.data["source"], neighbors_distances(context.position))
+    return distance.value, count_nodes(context, distance).value
+
+
+def lattice_results(engine):
+    random.seed(5)
+    simulator = Simulator()
+    simulator.environment.set_neighborhood_function(radius_neighborhood(1.5))
+    deformed_lattice(simulator, 6, 6, 1.0, 0.2)
+    for node in simulator.environment.node_list():
+        node.data = {"source": node.id == 0}
+    simulator.schedule_rounds(gradient_count, 1.0, shuffle=True, seed=2)
+    with use_engine(engine):
+        simulator.run(15.5)
+    return {id: node.data["result"] for id, node in simulator.environment.nodes.items()}, simulator
+
+
+@pytest.mark.parametrize("delta", [True, False])
+def test_encoded_rounds_match_plain_rounds(delta):
+    expected, _ = lattice_results(MutableEngine())
+    results, simulator = lattice_results(MutableEngine(codec=MessageCodec(delta, keyframe_every=4)))
+    assert results == expected
+    assert all(node.data["messages"].__class__ is bytes for node in simulator.environment.node_list())
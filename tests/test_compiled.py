@@ -0,0 +1,110 @@
+import random
+
+from fieldpy.calculus import MAX_TAPES, aggregate, align, compiled, neighbors, remember, use_engine
+from fieldpy.internal import MutableEngine
+from fieldpy.simulator import Simulator
+from fieldpy.simulator.events import register_action
+from fieldpy.simulator.neighborhood import radius_neighborhood
+from fieldpy.simulator.runner import run_round
+
+
+@aggregate
+def step(value):
+    return neighbors(value).sum()
+
+
+@aggregate
+def wandering(context):
+    # the sites reached depend on the data: branches, loops, early returns and failures
+    rounds = remember(0)
+    rounds.update(rounds + 1)
+    if context.data["fail"]:
+        raise RuntimeError("failed round")
+    if context.data["branch"]:
+        with align("left"):
+            total = step(1.0)
+    else:
+        with align("right"):
+            total = step(2.0) + step(context.id * 1.0)
+    if context.data["stop"]:
+        return total
+    for index in range(context.data["loops"]):
+        total += step(index * 1.0)
+    return total, rounds.value
+
+
+@register_action
+def shuffle_data(simulator, rng, history):
+    nodes = simulator.environment.node_list()
+    history.append({node.id: (node.data.get("result"), node.data.get("messages"), dict(node.data.get("state", {})))
+                    for node in nodes})
+    for node in nodes:
+        node.data.update(branch=rng.random() < 0.5, stop=rng.random() < 0.2, loops=rng.randrange(3),
+                         fail=rng.random() < 0.05)
+    simulator.schedule_event(1.0, shuffle_data, simulator, rng, history)
+
+
+@register_action
+def failing_rounds(simulator, program):
+    # a failed round leaves the node as it was, the others go on
+    for node in simulator.environment.node_list():
+        try:
+            run_round(node, {neighbor.id: neighbor.data.get("messages", {})
+                             for neighbor in simulator.environment.get_neighbors(node)}, program)
+        except RuntimeError:
+            pass
+    simulator.schedule_event(1.0, failing_rounds, simulator, program)
+
+
+def wandering_history(program):
+    simulator = Simulator()
+    simulator.environment.set_neighborhood_function(radius_neighborhood(1.1))
+    for id in range(6):
+        simulator.environment.create_node((float(id), 0.0), {"branch": True, "stop": False, "loops": 1,
+                                                              "fail": False}, id)
+    history = []
+    simulator.schedule_event(0.0, shuffle_data, simulator, random.Random(8), history)
+    simulator.schedule_event(0.5, failing_rounds, simulator, program)
+    with use_engine(MutableEngine()):
+        simulator.run(40.0)
+    return history
+
+
+def test_compiled_programs_match_plain_programs_when_the_sites_change():
+    plain = wandering_history(wandering)
+    assert wandering_history(compiled(wandering)) == plain
+    # the rounds did take different branches
+    assert len({str(sorted(messages)) for round in plain for _, messages, _ in round.values() if messages}) > 5
+
+
+def test_compiled_programs_run_as_they_are_outside_traceable_engines():
+    program = compiled(wandering)
+    context = type("Context", (), {})()
+    context.id, context.data = 0, {"branch": False, "stop": False, "loops": 2, "fail": False}
+    engine = MutableEngine()
+    with use_engine(engine):
+        engine.setup({}, 0)
+        engine.enter("outer")
+        # called inside another program: no tracing
+        assert program(context) == (3.0, 1)
+        assert not engine.tracing
+
+
+def test_the_tapes_kept_are_bounded():
+    @aggregate
+    def looping(context):
+        return sum(step(1.0) for _ in range(context.data["loops"]))
+
+    program = compiled(looping)
+    known = program.__closure__[program.__code__.co_freevars.index("known")].cell_contents
+    engine = MutableEngine()
+    context = type("Context", (), {})()
+    context.id = 0
+    with use_engine(engine):
+        # a new tape for every number of loops
+        for loops in range(3 * MAX_TAPES):
+            context.data = {"loops": loops % (2 * MAX_TAPES)}
+            engine.setup({}, 0, engine.state)
+            assert program(context) == loops % (2 * MAX_TAPES)
+            engine.cooldown()
+            assert len(known) <= MAX_TAPES
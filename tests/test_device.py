@@ -0,0 +1,141 @@
+import asyncio
+
+import pytest
+
+from fieldpy.calculus import aggregate, neighbors
+from fieldpy.device import MAGIC, DeviceRuntime
+from fieldpy.libraries.diffusion import distance_to
+from fieldpy.simulator import Simulator
+from fieldpy.simulator.neighborhood import radius_neighborhood
+
+
+def program(context):
+    return 0
+
+
+def test_delta_mode_works_with_the_default_parameters():
+    device = DeviceRuntime(program, 1, delta=True)
+    assert device.codec.keyframe_every * device.period <= device.expiry
+    device = DeviceRuntime(program, 1, delta=True, period=0.05, expiry=1.0)
+    assert device.codec.keyframe_every > 1
+    assert device.codec.keyframe_every * device.period <= device.expiry
+
+
+def test_delta_mode_rejects_keyframes_rarer_than_the_expiry():
+    with pytest.raises(ValueError):
+        DeviceRuntime(program, 1, delta=True, keyframe_every=16)
+    DeviceRuntime(program, 1, keyframe_every=16)
+
+
+@aggregate
+def hops(context):
+    return distance_to(context.data["source"], neighbors(1.0)).value
+
+
+def line_topology(id):
+    # devices only hear their neighbors on a line
+    return lambda sender: abs(sender - id) == 1
+
+
+async def started_line(size, **options):
+    devices = [DeviceRuntime(hops, id, data={"source": id == 0}, accept=line_topology(id), **options)
+               for id in range(size)]
+    for device in devices:
+        await device.start()
+    for device in devices:
+        device.peers = {other.address for other in devices if other is not device}
+    return devices
+
+
+async def synchronous_step(devices):
+    start = asyncio.get_running_loop().time()
+    results = [device.round() for device in devices]
+    # let the datagrams of the round arrive (a lost one only makes the wait longer)
+    expected = [(device, other.id) for device in devices for other in devices if device.accept(other.id)]
+    for _ in range(50):
+        await asyncio.sleep(0.001)
+        if all(id in device.inbox and device.inbox[id][0] >= start for device, id in expected):
+            break
+    return results
+
+
+def simulated_hops(size, rounds):
+    simulator = Simulator()
+    simulator.environment.set_neighborhood_function(radius_neighborhood(1.1))
+    for id in range(size):
+        simulator.environment.create_node((float(id), 0.0), {"source": id == 0}, id)
+    steps = []
+    simulator.schedule_rounds(hops, 1.0, synchronous=True)
+    for round in range(rounds):
+        simulator.run(round + 0.5)
+        steps.append([node.data["result"] for node in simulator.environment.node_list()])
+    return steps
+
+
+@pytest.mark.parametrize("delta", [False, True])
+def test_devices_on_loopback_match_synchronous_simulated_rounds(delta):
+    async def main():
+        devices = await started_line(5, delta=delta, period=0.01, expiry=1.0)
+        try:
+            return [await synchronous_step(devices) for _ in range(8)]
+        finally:
+            for device in devices:
+                device.close()
+
+    assert asyncio.run(main()) == simulated_hops(5, 8)
+
+
+def test_silent_neighbors_expire():
+    async def main():
+        devices = await started_line(3, period=0.01, expiry=0.05)
+        try:
+            for _ in range(4):
+                await synchronous_step(devices)
+            assert sorted(devices[1].neighbors) == [0, 2] and devices[2].round() == 2.0
+            # the source goes down: the others keep running past the expiry
+            devices[0].close()
+            results = []
+            for _ in range(6):
+                results = await synchronous_step(devices[1:])
+                await asyncio.sleep(0.02)
+            assert devices[1].neighbors == [2] and 0 in devices[1].expired
+            return results
+        finally:
+            for device in devices:
+                device.close()
+
+    # without the source the distances keep growing (they were 1 and 2)
+    assert min(asyncio.run(main())) > 2.0
+
+
+def test_a_lost_delta_datagram_is_recovered_at_the_next_keyframe():
+    async def main():
+        devices = await started_line(2, delta=True, period=0.1, expiry=0.4)
+        try:
+            assert devices[0].codec.keyframe_every == 4
+            send = devices[0]._send
+            for step in range(10):
+                # the datagram of the second round of the source is lost
+                devices[0]._send = (lambda datagram: None) if step == 1 else send
+                await synchronous_step(devices)
+            return devices[1].dropped, devices[1].node.data["result"]
+        finally:
+            for device in devices:
+                device.close()
+
+    dropped, result = asyncio.run(main())
+    # the deltas of the rounds before the keyframe (sequences 2 and 3) cannot be decoded
+    assert dropped == 2 and result == 1.0
+
+
+def test_foreign_datagrams_are_dropped():
+    async def main():
+        (device,) = await started_line(1)
+        try:
+            device._received(b"not a fieldpy datagram", ("127.0.0.1", 9))
+            device._received(MAGIC + b"\xff", ("127.0.0.1", 9))
+            return device.dropped, device.inbox
+        finally:
+            device.close()
+
+    assert asyncio.run(main()) == (2, {})
@@ -0,0 +1,122 @@
+import random
+
+from fieldpy.calculus import aggregate, align, neighbors, remember, use_engine
+from fieldpy.internal import MutableEngine, StateStore
+
+
+@aggregate
+def branching(context):
+    # the devices in the two branches are not aligned with each other
+    if context.id % 2:
+        with align("odd"):
+            return neighbors(context.id).data
+    with align("even"):
+        return neighbors(context.id).data
+
+
+def device_round(engine, program, id, messages, state=None):
+    class Context:
+        pass
+    context = Context()
+    context.id = id
+    with use_engine(engine):
+        engine.setup(messages, id, state)
+        result = program(context)
+        exported = engine.cooldown()
+    return result, exported, engine.state
+
+
+def test_message_keys_are_the_string_of_the_alignment_stack():
+    engine = MutableEngine()
+    _, exported, _ = device_round(engine, branching, 1, {})
+    assert list(exported) == [str(["branching@0", "odd@0", "neighbors@0"])]
+    engine.setup({}, 1)
+    engine.enter("branching")
+    engine.enter("odd")
+    assert engine.path == str(engine.stack) == engine.key(list(engine.stack))
+
+
+def test_interned_paths_are_shared_by_the_devices_of_an_engine():
+    engine = MutableEngine()
+    first = device_round(engine, branching, 1, {})[1]
+    second = device_round(engine, branching, 3, {})[1]
+    assert first.keys() == second.keys()
+    assert next(iter(first)) is next(iter(second))
+
+
+def test_neighbors_only_see_the_devices_aligned_on_the_same_path():
+    engine = MutableEngine()
+    exported = {id: device_round(engine, branching, id, {})[1] for id in range(4)}
+    result, _, _ = device_round(engine, branching, 1, {id: exported[id] for id in (0, 2, 3)})
+    assert result == {1: 1, 3: 3}
+    result, _, _ = device_round(engine, branching, 2, {id: exported[id] for id in (0, 1, 3)})
+    assert result == {0: 0, 2: 2}
+
+
+def test_aligned_values_are_indexed_by_path_and_owned_by_the_caller():
+    engine = MutableEngine()
+    odd = str(["branching@0", "odd@0", "neighbors@0"])
+    engine.setup({1: {odd: "a"}, 3: {odd: "b"}, 2: {"other": "c"}}, 5)
+    values = engine.aligned_values(odd)
+    assert values == {1: "a", 3: "b"}
+    values[5] = "local"
+    assert engine.aligned_values(odd) == {1: "a", 3: "b"}
+    assert engine.aligned_values(["branching@0", "odd@0", "neighbors@0"]) == {1: "a", 3: "b"}
+    assert engine.aligned_values("missing") == {}
+
+
+@aggregate
+def rounds_counter(context):
+    count = remember(0)
+    return count.update(count + 1)
+
+
+def test_state_is_kept_across_rounds_and_unread_state_is_dropped():
+    engine = MutableEngine()
+    state = None
+    for expected in (1, 2, 3):
+        result, _, state = device_round(engine, rounds_counter, 0, {}, state)
+        assert result == expected
+    _, _, state = device_round(engine, branching, 0, {}, state)
+    assert dict(state) == {}
+
+
+def test_collected_state_matches_a_sweep_of_the_unread_slots():
+    rng = random.Random(3)
+    keys = ["slot%d" % index for index in range(12)]
+    engine = MutableEngine()
+    engine.setup({}, 0, {})
+    expected = {}
+    for round in range(200):
+        engine.setup({}, 0, engine.state)
+        # most rounds read the same slots (the steady state), some of them change the shape of the program
+        used = keys[:8] if round % 5 else rng.sample(keys, rng.randrange(len(keys)))
+        reads = set()
+        for key in used:
+            operation = rng.choice(["read", "init", "write", "read write"])
+            if "read" in operation:
+                assert engine.read_state(key) == expected.get(key)
+                reads.add(key)
+            if operation == "init":
+                assert engine.init_state(round, key) == expected.setdefault(key, round)
+                reads.add(key)
+            if "write" in operation:
+                engine.write_state(round, key)
+                expected[key] = round
+        engine.cooldown()
+        expected = {key: value for key, value in expected.items() if key in reads}
+        assert dict(engine.state) == expected
+        assert isinstance(engine.state, StateStore)
+
+
+def test_forgotten_slots_are_dropped():
+    engine = MutableEngine()
+    initial = {"kept": 1, "forgotten": 2}
+    engine.setup({}, 0, initial)
+    engine.read_state("kept")
+    engine.read_state("forgotten")
+    engine.forget("forgotten")
+    engine.cooldown()
+    assert dict(engine.state) == {"kept": 1}
+    # plain mappings are copied into a store of the engine
+    assert initial == {"kept": 1, "forgotten": 2}
@@ -0,0 +1,69 @@
+import random
+
+from fieldpy.simulator import Simulator
+from fieldpy.simulator.events import COMPACT_MIN_DEAD, Event, EventQueue
+from fieldpy.simulator.runner import aggregate_program_runner
+
+
+def test_events_run_by_time_then_by_scheduling_order():
+    rng = random.Random(2)
+    queue = EventQueue()
+    events = [queue.push(Event(rng.choice([0.0, 0.5, 1.0]), print)) for _ in range(100)]
+    popped = []
+    while queue:
+        popped.append(queue.pop())
+    assert popped == sorted(events, key=lambda event: (event.time, events.index(event)))
+    assert queue.pop() is None
+
+
+def test_cancelled_events_are_skipped():
+    simulator = Simulator()
+    ran = []
+    first = simulator.schedule_event(1.0, ran.append, "first")
+    second = simulator.schedule_event(1.0, ran.append, "second")
+    simulator.schedule_event(2.0, ran.append, "third")
+    assert first.cancel() and not first.pending
+    assert not first.cancel()
+    assert len(simulator.event_queue) == 2
+    assert simulator.event_queue.peek() is second
+    simulator.run()
+    assert ran == ["second", "third"]
+    # executed events cannot be cancelled any more
+    assert not second.cancel()
+    assert not simulator.event_queue
+
+
+def test_pop_stops_at_the_time_limit():
+    queue = EventQueue()
+    early, late = queue.push(Event(1.0, print)), queue.push(Event(3.0, print))
+    assert queue.pop(2.0) is early
+    assert queue.pop(2.0) is None and late.pending
+    assert queue.pop() is late
+
+
+def test_the_queue_is_compacted_when_most_entries_are_cancelled():
+    queue = EventQueue()
+    events = [queue.push(Event(float(index), print)) for index in range(4 * COMPACT_MIN_DEAD)]
+    rng = random.Random(5)
+    cancelled = set(rng.sample(range(len(events)), 3 * COMPACT_MIN_DEAD))
+    for index in sorted(cancelled):
+        events[index].cancel()
+    # the heap never holds more than twice the live entries once compacted
+    assert len(queue.heap) < 2 * len(queue) + COMPACT_MIN_DEAD
+    assert len(queue) == COMPACT_MIN_DEAD
+    remaining = []
+    while queue:
+        remaining.append(queue.pop())
+    assert remaining == [event for index, event in enumerate(events) if index not in cancelled]
+    # the cancelled entries left at the tail are dropped on the way
+    assert queue.pop() is None and queue.dead == 0 and not queue.heap
+
+
+def test_removed_nodes_stop_rescheduling():
+    simulator = Simulator()
+    node = simulator.environment.create_node((0.0, 0.0), {})
+    simulator.schedule_event(0.0, aggregate_program_runner, simulator, 1.0, node, lambda context: 0)
+    simulator.run(2.5)
+    simulator.environment.remove_node(node.id)
+    simulator.run(10.0)
+    assert not simulator.event_queue
@@ -0,0 +1,153 @@
+import functools
+
+import pytest
+
+from fieldpy.data import COMPACT_MIN_SIZE, Field
+from fieldpy.internal import MutableEngine
+
+SIZE = 2 * COMPACT_MIN_SIZE
+
+
+def view(values, own=0):
+    engine = MutableEngine()
+    engine.setup({}, own, {})
+    return Field.view({id: value for id, value in enumerate(values) if id != own}, own, values[own], engine)
+
+
+def test_mixed_numeric_values_keep_their_types():
+    values = [0.5] + [id if id % 2 else float(id) for id in range(1, SIZE)]
+    field = view(values)
+    assert [value.__class__ for value in field.data.values()] == [value.__class__ for value in values]
+    flags = [True] + [1] * (SIZE - 1)
+    assert [value.__class__ for value in view(flags).data.values()] == [bool] + [int] * (SIZE - 1)
+
+
+def test_compact_fields_match_the_dictionary_form():
+    values = [float(id) * 0.5 for id in range(SIZE)]
+    compact = view(values) + 1.0
+    plain = Field(dict(enumerate(values)), None) + 1.0
+    assert compact.data == plain.data
+    assert compact._values is not None
+    assert (compact < 4.0).data == (plain < 4.0).data
+    assert compact.min(None, include_self=False) == 1.5
+
+
+@pytest.mark.parametrize("op", [
+    lambda a, b: a + b, lambda a, b: a - b, lambda a, b: a * b, lambda a, b: a / b, lambda a, b: a < b,
+    lambda a, b: a >= b, lambda a, b: a.eq(b) if isinstance(a, Field) else a == b,
+], ids=["add", "sub", "mul", "truediv", "lt", "ge", "eq"])
+def test_compact_operators_match_the_dictionary_form(op):
+    values = [float(id % 5) + 1.0 for id in range(SIZE)]
+    others = [float(id % 3) + 1.0 for id in range(SIZE)]
+    compact, other = view(values), view(others)
+    plain, plain_other = Field(dict(enumerate(values)), None), Field(dict(enumerate(others)), None)
+    assert op(compact, other).data == op(plain, plain_other).data
+    assert op(compact, 2.0).data == op(plain, 2.0).data
+    assert op(compact, 2).data == op(plain, 2).data
+
+
+def test_compact_fields_without_self_keep_it_out_of_every_result():
+    values = [float(id) for id in range(SIZE)]
+    field = view(values, own=3)
+    excluded = field.exclude_self()
+    assert 3 not in excluded.data and len(excluded.data) == SIZE - 1
+    assert 3 not in (excluded + field).data
+    assert 3 not in excluded.filter(field > 1.0).data
+    assert (excluded * 2.0).data == {id: value * 2.0 for id, value in enumerate(values) if id != 3}
+    # the original field still has the local entry
+    assert field.data[3] == 3.0
+
+
+def test_fields_over_different_ids_keep_the_common_ones():
+    values = [float(id) for id in range(SIZE)]
+    compact = view(values)
+    partial = Field({id: 1.0 for id in range(0, SIZE, 2)}, None)
+    assert (compact + partial).data == {id: float(id) + 1.0 for id in range(0, SIZE, 2)}
+    assert compact.filter(partial.eq(1.0)).data == {id: float(id) for id in range(0, SIZE, 2)}
+
+
+def test_small_and_non_numeric_fields_stay_in_dictionary_form():
+    small = view([float(id) for id in range(COMPACT_MIN_SIZE - 1)])
+    small = small + 1.0
+    assert small.data[2] == 3.0 and small._values is None
+    names = view(["node-%d" % id for id in range(SIZE)])
+    assert (names + "!").data[1] == "node-1!" and names._values is None
+
+
+@pytest.mark.parametrize("size", [4, SIZE], ids=["dictionary", "compact"])
+def test_chained_view_operations_match_eager_fields(size):
+    values = [float(id) * 0.25 for id in range(size)]
+    distances = Field({id: 1.0 for id in range(size)}, None)
+    lazy = (view(values, own=1) + distances) * 2.0 < 3.0
+    eager = (Field(dict(enumerate(values)), None) + distances) * 2.0 < 3.0
+    assert lazy.data == eager.data
+    assert list(lazy) == list(eager)
+    assert (~view([id % 2 == 0 for id in range(size)])).exclude_self().data == \
+        {id: ~(id % 2 == 0) for id in range(1, size)}
+
+
+def test_views_read_the_messages_without_changing_them():
+    aligned = {2: 2.0, 0: 0.0}
+    engine = MutableEngine()
+    engine.setup({}, 1, {})
+    field = Field.view(aligned, 1, 1.0, engine)
+    assert field.data == {0: 0.0, 1: 1.0, 2: 2.0}
+    assert list(field.data) == [0, 1, 2]
+    assert aligned == {2: 2.0, 0: 0.0}
+
+
+def test_local_values_of_views_skip_the_neighbors():
+    field = view([float(id) for id in range(SIZE)], own=2)
+    shifted = field + 1.0
+    assert shifted.local() == 3.0
+    assert shifted._view is not None
+    assert (field + field).local() == 4.0
+    assert field.exclude_self().local() is None
+
+
+@pytest.mark.parametrize("size", [4, SIZE], ids=["dictionary", "compact"])
+@pytest.mark.parametrize("include_self", [True, False])
+def test_reductions_match_python_builtins(size, include_self):
+    values = [float((id * 7) % 5) for id in range(size)]
+    values[2] = -1.0
+    own = 2
+    field = view(values, own)
+    entries = {id: value for id, value in enumerate(values) if include_self or id != own}
+    assert field.min(include_self=include_self) == min(entries.values())
+    assert field.max(include_self=include_self) == max(entries.values())
+    assert field.sum(include_self=include_self) == sum(entries.values())
+    assert field.argmin(include_self=include_self) == min(entries.items(), key=lambda entry: entry[1])
+    assert field.argmax(include_self=include_self) == max(entries.items(), key=lambda entry: entry[1])
+    assert field.fold(lambda a, b: a * 10 + b, 0.0, include_self) == \
+        functools.reduce(lambda a, b: a * 10 + b, entries.values(), 0.0)
+    flags = view([value > 0 for value in values], own)
+    assert flags.sum(include_self=include_self) == sum(value > 0 for value in entries.values())
+    assert flags.any(include_self=include_self) is any(value > 0 for value in entries.values())
+    assert flags.all(include_self=include_self) is all(value > 0 for value in entries.values())
+
+
+@pytest.mark.parametrize("size", [4, SIZE], ids=["dictionary", "compact"])
+def test_ties_resolve_to_the_first_id(size):
+    field = view([1.0] * size, own=size - 1)
+    assert field.argmin() == (0, 1.0)
+    assert field.argmax(include_self=False) == (0, 1.0)
+    keys = view([0.0 if id in (1, 3) else 5.0 for id in range(size)])
+    assert view([float(id) for id in range(size)]).min_by(keys) == 1.0
+
+
+def test_min_and_max_take_the_default_into_account():
+    field = view([2.0, 3.0, 4.0])
+    assert field.min(1.0) == 1.0 and field.min(5.0) == 2.0
+    assert field.max(9.0) == 9.0 and field.max(0.0) == 4.0
+    alone = view([2.0])
+    assert alone.min(float("inf"), include_self=False) == float("inf")
+    assert alone.sum(include_self=False) == 0
+    assert alone.all(include_self=False) and not alone.any(include_self=False)
+
+
+def test_min_by_reads_the_ids_of_both_fields():
+    values = Field({0: "a", 1: "b", 2: "c"}, None)
+    keys = Field({1: 3.0, 2: 1.0, 5: 0.0}, None)
+    assert values.min_by(keys) == "c"
+    with pytest.raises(ValueError):
+        values.min_by(Field({7: 0.0}, None))
@@ -0,0 +1,90 @@
+import numpy as np
+import pytest
+
+from fieldpy.simulator import Environment, Simulator
+from fieldpy.simulator.mobility import (Bounded, ConstantVelocity, GaussianJitter, Mobility, RandomWaypoint,
+                                        mobility_runner)
+from fieldpy.simulator.neighborhood import radius_neighborhood
+from fieldpy.simulator.storage import NodeArrays
+
+
+def positions(nodes):
+    return np.array([node.position for node in nodes])
+
+
+def moving_nodes(arrays=None):
+    simulator = Simulator()
+    simulator.environment = Environment(radius_neighborhood(0.3), arrays=arrays)
+    nodes = [simulator.environment.create_node((0.1 * id, 0.5), None, id) for id in range(10)]
+    return simulator, nodes
+
+
+@pytest.mark.parametrize("mode, expected", [
+    # 0.9 + 0.3 crosses the border at 1.0 by 0.2
+    ("reflect", 0.8), ("clamp", 1.0), ("wrap", 0.2),
+])
+def test_bounded_modes_at_the_border(mode, expected):
+    model = Bounded(ConstantVelocity((0.3, -0.3)), (0.0, 0.0), (1.0, 1.0), mode)
+    model.start(np.array([[0.9, 0.1]]), np.random.default_rng(0))
+    result = model.step(np.array([[0.9, 0.1]]), 1.0, np.random.default_rng(0))
+    assert result[0, 0] == pytest.approx(expected)
+    assert result[0, 1] == pytest.approx(1.0 - expected if mode != "clamp" else 0.0)
+    if mode == "reflect":
+        # the velocity is reflected too: the node comes back
+        assert model.model.velocity.tolist() == [[-0.3, 0.3]]
+    else:
+        assert model.model.velocity.tolist() == [[0.3, -0.3]]
+
+
+@pytest.mark.parametrize("mode", ["reflect", "clamp", "wrap"])
+def test_bounded_models_never_leave_the_box(mode):
+    simulator, nodes = moving_nodes()
+    mobility = Mobility(nodes, Bounded(GaussianJitter(2.0), (0.0, 0.0), (1.0, 1.0), mode), seed=1)
+    simulator.schedule_event(0.0, mobility_runner, simulator, 0.5, mobility)
+    simulator.run(20.0)
+    moved = positions(nodes)
+    assert (moved >= 0.0).all() and (moved <= 1.0).all()
+
+
+def test_bulk_steps_match_per_node_steps_and_update_the_neighbors():
+    simulator, nodes = moving_nodes()
+    mobility = Mobility(nodes, ConstantVelocity([(0.0, 0.01 * id) for id in range(10)]))
+    simulator.schedule_event(0.0, mobility_runner, simulator, 1.0, mobility)
+    simulator.run(5.5)
+    expected = [(0.1 * id, 0.5 + 0.06 * id) for id in range(10)]
+    assert positions(nodes) == pytest.approx(np.array(expected))
+    for node in nodes:
+        brute = [other.id for other in nodes if other is not node
+                 and np.hypot(*np.subtract(other.position, node.position)) <= 0.3]
+        assert sorted(neighbor.id for neighbor in node.get_neighbors()) == sorted(brute)
+
+
+def test_array_nodes_move_like_plain_nodes_and_removed_nodes_are_dropped():
+    def run(arrays):
+        simulator, nodes = moving_nodes(arrays)
+        model = Bounded(RandomWaypoint((0.0, 0.0), (1.0, 1.0), (0.05, 0.2), pause=1.0), (0.0, 0.0), (1.0, 1.0))
+        mobility = Mobility(nodes, model, seed=4)
+        simulator.schedule_event(0.0, mobility_runner, simulator, 0.5, mobility)
+        simulator.run(5.2)
+        simulator.environment.remove_node(3)
+        simulator.run(15.2)
+        assert len(mobility.nodes) == 9 and len(model.model.speeds) == 9
+        return positions(nodes)
+
+    assert (run(NodeArrays()) == run(None)).all()
+
+
+def test_waypoints_are_reached_and_the_nodes_pause_there():
+    model = RandomWaypoint((0.0, 0.0), (1.0, 1.0), (10.0, 10.0), pause=2.0)
+    rng = np.random.default_rng(0)
+    start = np.array([[0.5, 0.5]])
+    model.start(start, rng)
+    target = model.targets.copy()
+    reached = model.step(start, 1.0, rng)
+    assert (reached == target).all()
+    assert (model.step(reached, 1.0, rng) == reached).all()
+
+
+def test_unknown_modes_are_rejected():
+    with pytest.raises(ValueError):
+        Bounded(GaussianJitter(1.0), (0.0, 0.0), (1.0, 1.0), "bounce")
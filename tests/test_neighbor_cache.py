@@ -0,0 +1,81 @@
+import random
+
+from fieldpy.simulator import Environment
+from fieldpy.simulator.neighborhood import k_nearest_neighbors, radius_neighborhood
+
+
+def ids(nodes):
+    return sorted(node.id for node in nodes)
+
+
+def deploy(environment, count=150, seed=2):
+    rng = random.Random(seed)
+    for id in range(count):
+        environment.create_node((rng.random(), rng.random()), {"group": id % 2}, id)
+    return rng
+
+
+def test_static_neighborhoods_are_computed_once():
+    environment = Environment(radius_neighborhood(0.2))
+    deploy(environment)
+    for _ in range(3):
+        for node in environment.node_list():
+            environment.get_neighbors(node)
+    assert environment.cache_misses == 150
+    assert environment.cache_hits == 300
+
+
+def test_cached_neighbors_follow_moves_additions_and_removals():
+    for neighborhood in (radius_neighborhood(0.15), k_nearest_neighbors(5)):
+        cached = Environment(neighborhood)
+        plain = Environment(neighborhood, cache_neighbors=False)
+        rng = deploy(cached)
+        deploy(plain)
+        for step in range(200):
+            action = rng.random()
+            id = rng.choice(list(cached.nodes))
+            if action < 0.5:
+                position = (rng.random(), rng.random())
+                cached.nodes[id].update(position)
+                plain.nodes[id].update(position)
+            elif action < 0.6:
+                moved = rng.sample(list(cached.nodes), 30)
+                for environment in (cached, plain):
+                    for other in moved:
+                        x, y = environment.nodes[other].position
+                        environment.nodes[other]._place((x + 0.01, y))
+                    environment.nodes_updated([environment.nodes[other] for other in moved])
+            elif action < 0.8:
+                cached.remove_node(id)
+                plain.remove_node(id)
+            else:
+                position = (rng.random(), rng.random())
+                cached.create_node(position, {}, 1000 + step)
+                plain.create_node(position, {}, 1000 + step)
+            for node in list(cached.nodes.values())[::15]:
+                assert ids(cached.get_neighbors(node)) == ids(plain.get_neighbors(plain.nodes[node.id]))
+
+
+def same_group(node, nodes):
+    return [other for other in nodes if other is not node and other.data["group"] == node.data["group"]]
+
+
+def test_plain_neighborhood_functions_are_not_cached_by_default():
+    environment = Environment(same_group)
+    deploy(environment, 10)
+    node = environment.nodes[0]
+    assert ids(environment.get_neighbors(node)) == [2, 4, 6, 8]
+    environment.nodes[1].data["group"] = 0
+    assert ids(environment.get_neighbors(node)) == [1, 2, 4, 6, 8]
+    assert environment.cache_hits == environment.cache_misses == 0
+
+
+def test_data_updates_clear_cached_plain_neighborhoods():
+    environment = Environment(same_group, cache_neighbors=True)
+    deploy(environment, 10)
+    node = environment.nodes[0]
+    assert ids(environment.get_neighbors(node)) == [2, 4, 6, 8]
+    version = environment.version
+    environment.nodes[1].update(new_data={"group": 0})
+    assert environment.version > version
+    assert ids(environment.get_neighbors(node)) == [1, 2, 4, 6, 8]
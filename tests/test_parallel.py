@@ -0,0 +1,141 @@
+import io
+import os
+import random
+
+import pytest
+
+from fieldpy.calculus import aggregate, neighbors_distances
+from fieldpy.libraries.collect import count_nodes
+from fieldpy.libraries.diffusion import distance_to
+from fieldpy.simulator import Node, Simulator, checkpoint
+from fieldpy.simulator.deployments import deformed_lattice
+from fieldpy.simulator.events import register_action
+from fieldpy.simulator.neighborhood import radius_neighborhood
+from fieldpy.simulator.parallel import ParallelRounds, parallel_program_runner
+
+PARENT = os.getpid()
+
+
+@aggregate
+def gradient_count(context):
+    distance = distance_to(context.data["source"], neighbors_distances(context.position))
+    return distance.value, count_nodes(context, distance).value
+
+
+def lattice():
+    random.seed(7)
+    simulator = Simulator()
+    simulator.environment.set_neighborhood_function(radius_neighborhood(0.15))
+    deformed_lattice(simulator, 8, 8, 0.1, 0.01)
+    for node in simulator.environment.nodes.values():
+        node.data = {"source": node.id == 0}
+    return simulator
+
+
+@register_action
+def drift_runner(simulator):
+    for node in list(simulator.environment.nodes.values())[::5]:
+        x, y = node.position
+        node.position = (x + 0.02, y)
+    simulator.schedule_event(1.0, drift_runner, simulator)
+
+
+def results(simulator):
+    return {id: node.data["result"] for id, node in simulator.environment.nodes.items()}
+
+
+def sequential(until):
+    simulator = lattice()
+    simulator.schedule_rounds(gradient_count, 1.0, synchronous=True)
+    simulator.schedule_event(0.5, drift_runner, simulator)
+    simulator.run(until)
+    return results(simulator)
+
+
+def parallel(rounds):
+    simulator = lattice()
+    simulator.schedule_event(0.0, parallel_program_runner, simulator, 1.0, gradient_count, rounds)
+    simulator.schedule_event(0.5, drift_runner, simulator)
+    return simulator
+
+
+def test_parallel_rounds_match_sequential_rounds_of_moving_nodes():
+    with ParallelRounds(gradient_count, workers=3, start_method="fork") as rounds:
+        simulator = parallel(rounds)
+        simulator.run(12.5)
+    assert results(simulator) == sequential(12.5)
+    assert all("state" in node.data for node in simulator.environment.nodes.values())
+
+
+def test_a_pending_parallel_round_is_checkpointed_with_the_state_of_the_workers():
+    rounds = ParallelRounds(gradient_count, workers=2, start_method="fork")
+    simulator = parallel(rounds)
+    simulator.run(6.5)
+    stream = io.BytesIO()
+    checkpoint.save(simulator, stream)
+    rounds.close()
+    stream.seek(0)
+    restored = checkpoint.load(stream)
+    restored.run(12.5)
+    restored_rounds = next(event.args[-1] for _, _, event in restored.event_queue.heap
+                           if event.action is parallel_program_runner)
+    restored_rounds.close()
+    assert results(restored) == sequential(12.5)
+
+
+def test_a_worker_failing_to_update_stops_all_the_workers(monkeypatch):
+    setter = Node.position.fset
+
+    def failing_position(node, position):
+        # only in the workers
+        if os.getpid() != PARENT:
+            raise RuntimeError("update failed")
+        setter(node, position)
+
+    monkeypatch.setattr(Node, "position", property(Node.position.fget, failing_position))
+    with ParallelRounds(gradient_count, workers=3, start_method="fork") as rounds:
+        simulator = lattice()
+        rounds.round(simulator.environment)
+        processes = rounds.processes
+        for node in simulator.environment.node_list()[::3]:
+            x, y = node.position
+            node.position = (x + 0.01, y)
+        with pytest.raises(RuntimeError, match="update failed"):
+            rounds.round(simulator.environment)
+        assert not rounds.processes and not any(process.is_alive() for process in processes)
+        monkeypatch.undo()
+        # new workers start from the environment
+        assert len(rounds.round(simulator.environment)) == len(simulator.environment.nodes)
+
+
+@register_action
+def sweep_runner(simulator, owners, rounds, ids):
+    # a band of nodes crosses the deployment, while others leave and join: nodes change worker
+    if rounds is not None:
+        owners.append(dict(rounds.owner))
+    environment = simulator.environment
+    for node in environment.node_list()[::4]:
+        x, y = node.position
+        node.position = ((x + 0.25) % 0.8, y)
+    environment.remove_node(environment.node_list()[-1].id)
+    environment.create_node((0.35, 0.35), {"source": False}, next(ids))
+    simulator.schedule_event(2.0, sweep_runner, simulator, owners, rounds, ids)
+
+
+def test_parallel_rounds_match_sequential_rounds_of_nodes_changing_worker():
+    def sweeping(rounds, owners):
+        simulator = lattice()
+        if rounds is None:
+            simulator.schedule_rounds(gradient_count, 1.0, synchronous=True)
+        else:
+            simulator.schedule_event(0.0, parallel_program_runner, simulator, 1.0, gradient_count, rounds)
+        simulator.schedule_event(1.5, sweep_runner, simulator, owners, rounds, iter(range(1000, 2000)))
+        simulator.run(12.5)
+        return results(simulator)
+
+    owners = []
+    with ParallelRounds(gradient_count, workers=3, start_method="fork") as rounds:
+        parallel_results = sweeping(rounds, owners)
+    assert parallel_results == sweeping(None, [])
+    assert any(before.get(id, worker) != worker for before, after in zip(owners, owners[1:])
+               for id, worker in after.items())
@@ -0,0 +1,77 @@
+import pytest
+
+from fieldpy import calculus
+from fieldpy.calculus import aggregate, neighbors, profiling, remember, use_engine
+from fieldpy.internal import MutableEngine
+from fieldpy.profiling import Profiler, payload_size
+from fieldpy.simulator import Simulator
+from fieldpy.simulator.neighborhood import radius_neighborhood
+
+
+@aggregate
+def inner(value):
+    return neighbors(value).sum()
+
+
+@aggregate
+def outer(context):
+    rounds = remember(0)
+    rounds.update(rounds + 1)
+    return inner(context.id) + inner(1.5)
+
+
+def line(profiler=None):
+    simulator = Simulator()
+    simulator.environment.set_neighborhood_function(radius_neighborhood(1.1))
+    for id in range(4):
+        simulator.environment.create_node((float(id), 0.0), {}, id)
+    simulator.schedule_rounds(outer, 1.0)
+    simulator.run(2.5, profiler=profiler)
+    return {id: node.data["result"] for id, node in simulator.environment.nodes.items()}
+
+
+def test_profiled_runs_match_plain_runs_and_count_every_call():
+    profiler = Profiler()
+    assert line(profiler) == line()
+    assert calculus.profiler is None
+    # 3 rounds of 4 devices
+    assert profiler.functions["outer"][0] == 12
+    assert profiler.functions["inner"][0] == 24
+    assert profiler.functions["neighbors"][0] == 24
+    # the calls of a function are told apart by their position among the calls of the parent
+    assert profiler.paths[str(["outer@0", "inner@2"])][0] == 12
+    first = str(["outer@0", "inner@1", "neighbors@0"])
+    assert profiler.exchanges[first] == [12, 3 * sum(payload_size(id) for id in range(4))]
+    assert len(profiler.latencies) == 12 and set(profiler.devices) == {0, 1, 2, 3}
+    assert all(slots == 1 for slots in profiler.state_slots.values())
+    for calls, total, own in profiler.functions.values():
+        assert 0.0 <= own <= total
+
+
+def test_folded_stacks_add_up_to_the_self_times():
+    profiler = Profiler(payloads=False)
+    line(profiler)
+    folded = dict(line.rsplit(" ", 1) for line in profiler.folded())
+    assert set(folded) == {"outer", "outer;remember", "outer;inner", "outer;inner;neighbors"}
+    assert all(size == 0 for _, size in profiler.exchanges.values())
+    report = profiler.report()
+    assert "outer" in report and "rounds: 12 of 4 devices" in report
+
+
+@aggregate
+def failing(context):
+    return inner(context["fail"])
+
+
+def test_a_failing_call_leaves_the_stacks_balanced():
+    profiler = Profiler()
+    engine = MutableEngine()
+    with profiling(profiler), use_engine(engine):
+        engine.setup({}, 0)
+        with pytest.raises(KeyError):
+            failing({})
+        engine.setup({}, 0)
+        assert failing({"fail": 2.0}) == 2.0
+    names, _ = profiler._stack()
+    assert names == []
+    assert profiler.functions["failing"][0] == 2 and profiler.functions["inner"][0] == 1
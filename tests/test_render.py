@@ -0,0 +1,61 @@
+import pickle
+import random
+
+import numpy as np
+
+from fieldpy.simulator import Simulator
+from fieldpy.simulator.neighborhood import radius_neighborhood
+from fieldpy.simulator.render import Link, Renderer, link_segments, render_sync
+
+
+def scattered(count=40):
+    rng = random.Random(6)
+    simulator = Simulator()
+    simulator.environment.set_neighborhood_function(radius_neighborhood(0.25))
+    for id in range(count):
+        simulator.environment.create_node((rng.random(), rng.random()), {"value": float(id)}, id)
+    return simulator
+
+
+def test_link_segments_are_the_deduplicated_links():
+    environment = scattered().environment
+    nodes = environment.node_list()
+    positions = np.array([node.position for node in nodes])
+    segments = link_segments(environment, positions, {node.id: row for row, node in enumerate(nodes)})
+    links = {Link(node.position, neighbor.position) for node in nodes for neighbor in environment.get_neighbors(node)}
+    assert len(segments) == len(links)
+    assert {Link(tuple(first), tuple(second)) for first, second in segments.tolist()} == links
+
+
+def test_off_screen_frames_are_decimated_and_reuse_the_artists(tmp_path):
+    simulator = scattered()
+    renderer = Renderer(color_from="value", output=str(tmp_path / "frame_{:03d}.png"), every=2)
+    simulator.schedule_event(0.0, render_sync, simulator, renderer=renderer, period=1.0)
+    simulator.run(0.5)
+    scatter, links = renderer.scatter, renderer.links
+    simulator.run(4.5)
+    renderer.close()
+    assert (renderer.calls, renderer.frames) == (5, 3)
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["frame_000.png", "frame_001.png", "frame_002.png"]
+    assert renderer.scatter is scatter and renderer.links is links
+    assert len(renderer.texts) == 40
+
+
+def test_labels_are_culled_beyond_the_limit(tmp_path):
+    simulator = scattered()
+    renderer = Renderer(output=str(tmp_path / "{}.png"), max_labels=10)
+    renderer.render(simulator.environment)
+    renderer.close()
+    assert renderer.texts == []
+
+
+def test_pickled_renderers_build_a_new_figure(tmp_path):
+    simulator = scattered(5)
+    renderer = Renderer(output=str(tmp_path / "{}.png"))
+    renderer.render(simulator.environment)
+    restored = pickle.loads(pickle.dumps(renderer))
+    renderer.close()
+    assert restored.figure is None and restored.frames == 1
+    restored.render(simulator.environment)
+    restored.close()
+    assert (tmp_path / "1.png").exists()
@@ -0,0 +1,99 @@
+from fieldpy.calculus import aggregate, neighbors
+from fieldpy.libraries.diffusion import distance_to
+from fieldpy.simulator import Simulator
+from fieldpy.simulator.events import register_action
+from fieldpy.simulator.neighborhood import radius_neighborhood
+from fieldpy.simulator.runner import aggregate_program_runner
+
+
+@aggregate
+def hops(context):
+    # the hop count from the source: it depends on the order of the nodes unless the rounds are synchronous
+    return distance_to(context.data["source"], neighbors(1.0)).value
+
+
+def line(size=12):
+    simulator = Simulator()
+    simulator.environment.set_neighborhood_function(radius_neighborhood(1.1))
+    # the source is the last node inserted, so information flows against the insertion order
+    for id in range(size):
+        simulator.environment.create_node((float(id), 0.0), {"source": id == size - 1}, id)
+    return simulator
+
+
+def results(simulator):
+    return {id: node.data.get("result") for id, node in simulator.environment.nodes.items()}
+
+
+def test_rounds_match_one_event_per_node():
+    per_node = line()
+    for node in per_node.environment.node_list():
+        per_node.schedule_event(0.0, aggregate_program_runner, per_node, 1.0, node, hops)
+    per_node.run(5.5)
+    rounds = line()
+    rounds.schedule_rounds(hops, 1.0)
+    assert len(rounds.event_queue) == 1
+    rounds.run(5.5)
+    assert results(rounds) == results(per_node)
+
+
+def test_synchronous_rounds_do_not_depend_on_the_order_of_the_nodes():
+    ordered = line()
+    ordered.schedule_rounds(hops, 1.0, synchronous=True)
+    ordered.run(5.5)
+    shuffled = line()
+    shuffled.schedule_rounds(hops, 1.0, synchronous=True, shuffle=True, seed=3)
+    shuffled.run(5.5)
+    jittered = line()
+    jittered.schedule_rounds(hops, 1.0, synchronous=True, jitter=0.5, seed=3)
+    jittered.run(5.5)
+    assert results(ordered) == results(shuffled) == results(jittered)
+    # one hop per round: after 6 rounds only the 6 nodes closest to the source know their distance
+    assert [results(ordered)[id] for id in (11, 6, 5)] == [0.0, 5.0, float("inf")]
+    # the nodes of asynchronous rounds read the messages of the nodes that ran before them in the round
+    asynchronous = line()
+    asynchronous.schedule_rounds(hops, 1.0, nodes=asynchronous.environment.node_list()[::-1])
+    asynchronous.run(0.5)
+    assert results(asynchronous)[0] == 11.0
+
+
+def test_rounds_with_the_same_seed_are_reproducible():
+    def shuffled(seed):
+        simulator = line()
+        order = []
+        simulator.schedule_rounds(lambda context: order.append(context.id), 1.0, shuffle=True, seed=seed)
+        simulator.run(3.5)
+        return order
+
+    assert shuffled(5) == shuffled(5)
+    assert shuffled(5) != shuffled(6)
+    assert sorted(shuffled(5)[:12]) == list(range(12))
+
+
+@register_action
+def note_time(simulator, times):
+    times.append(simulator.current_time)
+
+
+def test_jittered_nodes_fire_within_the_window_and_let_other_events_run():
+    simulator = line()
+    fired = []
+    simulator.schedule_rounds(lambda context: fired.append((simulator.current_time, context.id)), 1.0, jitter=0.4,
+                              seed=1)
+    times = []
+    simulator.schedule_event(0.2, note_time, simulator, times)
+    simulator.run(0.9)
+    assert sorted(id for _, id in fired) == list(range(12))
+    assert all(0.0 <= time < 0.4 for time, _ in fired)
+    assert [time for time, _ in fired] == sorted(time for time, _ in fired)
+    assert times == [0.2] and any(time > 0.2 for time, _ in fired)
+
+
+def test_removed_nodes_are_skipped():
+    simulator = line()
+    nodes = simulator.environment.node_list()
+    ran = []
+    simulator.schedule_rounds(lambda context: ran.append(context.id), 1.0, nodes=nodes)
+    simulator.environment.remove_node(4)
+    simulator.run(0.5)
+    assert ran == [id for id in range(12) if id != 4]
@@ -0,0 +1,91 @@
+import random
+
+import pytest
+
+from fieldpy.simulator import Environment
+from fieldpy.simulator.neighborhood import k_nearest_neighbors, radius_neighborhood
+from fieldpy.simulator.spatial import GridIndex, KDTreeIndex
+from fieldpy.simulator.storage import NodeArrays
+
+
+def ids(nodes):
+    return sorted(node.id for node in nodes)
+
+
+@pytest.mark.parametrize("arrays", [None, NodeArrays()], ids=["nodes", "arrays"])
+def test_assigning_a_position_updates_the_neighborhoods(arrays):
+    environment = Environment(radius_neighborhood(1.5), arrays=arrays)
+    first = environment.create_node((0.0, 0.0), {}, 0)
+    second = environment.create_node((5.0, 0.0), {}, 1)
+    assert environment.get_neighbors(first) == []
+    second.position = (1.0, 0.0)
+    assert ids(environment.get_neighbors(first)) == [1]
+    assert ids(environment.get_neighbors(second)) == [0]
+    second.position = (5.0, 0.0)
+    assert environment.get_neighbors(first) == []
+
+
+class Point:
+    def __init__(self, id, position):
+        self.id = id
+        self.position = position
+
+
+def brute_radius(points, position, radius):
+    return sorted(p.id for p in points.values()
+                  if sum((a - b) ** 2 for a, b in zip(p.position, position)) <= radius * radius)
+
+
+def brute_knn(points, position, k, exclude):
+    order = {id: rank for rank, id in enumerate(points)}
+    candidates = [p for p in points.values() if p.id != exclude]
+    candidates.sort(key=lambda p: (sum((a - b) ** 2 for a, b in zip(p.position, position)), order[p.id]))
+    return [p.id for p in candidates[:k]]
+
+
+@pytest.mark.parametrize("index", [GridIndex(0.2), KDTreeIndex()], ids=["grid", "kdtree"])
+def test_queries_match_a_scan_while_nodes_come_move_and_go(index):
+    rng = random.Random(3)
+    points = {}
+    for id in range(300):
+        points[id] = Point(id, (rng.random(), rng.random()))
+        index.insert(points[id])
+    for step in range(600):
+        action = rng.random()
+        if action < 0.6:
+            point = points[rng.choice(list(points))]
+            point.position = (rng.random(), rng.random())
+            index.update(point)
+        elif action < 0.8 and len(points) > 50:
+            id = rng.choice(list(points))
+            del points[id]
+            index.remove(id)
+        else:
+            id = 1000 + step
+            points[id] = Point(id, (rng.random(), rng.random()))
+            index.insert(points[id])
+        if step % 20 == 0:
+            position = (rng.random(), rng.random())
+            assert ids(index.query_radius(position, 0.15)) == brute_radius(points, position, 0.15)
+            exclude = rng.choice(list(points))
+            assert [p.id for p in index.query_knn(position, 7, exclude)] == brute_knn(points, position, 7, exclude)
+
+
+def test_knn_ties_are_broken_by_insertion_order():
+    index = KDTreeIndex()
+    for id, position in ((5, (1.0, 0.0)), (3, (-1.0, 0.0)), (9, (0.0, 1.0)), (1, (0.0, 2.0))):
+        index.insert(Point(id, position))
+    assert [p.id for p in index.query_knn((0.0, 0.0), 3)] == [5, 3, 9]
+
+
+@pytest.mark.parametrize("neighborhood", [radius_neighborhood(0.2), k_nearest_neighbors(4)], ids=["radius", "knn"])
+def test_environment_neighbors_match_the_plain_neighborhood_function(neighborhood):
+    rng = random.Random(5)
+    environment = Environment(neighborhood)
+    for id in range(120):
+        environment.create_node((rng.random(), rng.random()), {}, id)
+    for step in range(40):
+        node = environment.nodes[rng.randrange(120)]
+        node.update((rng.random(), rng.random()))
+        for other in environment.node_list()[::10]:
+            assert ids(environment.get_neighbors(other)) == ids(neighborhood(other, environment.node_list()))
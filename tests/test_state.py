@@ -0,0 +1,75 @@
+import pickle
+import random
+
+import pytest
+
+from fieldpy.calculus import aggregate, neighbors_distances, remember, use_engine
+from fieldpy.data import STATES, State, StateHandle
+from fieldpy.internal import MutableEngine
+from fieldpy.libraries.collect import collect_or, count_nodes, sum_values
+from fieldpy.libraries.diffusion import cast_from, distance_to
+from fieldpy.libraries.leader_election import elect_leader
+from fieldpy.libraries.utils import counter
+from fieldpy.simulator import Simulator
+from fieldpy.simulator.deployments import deformed_lattice
+from fieldpy.simulator.neighborhood import radius_neighborhood
+
+
+def libraries(handle):
+    @aggregate
+    def program(context):
+        distances = neighbors_distances(context.position)
+        source = context.data["source"]
+        distance = distance_to(source, distances, handle)
+        values = (distance, cast_from(source, context.id, distances, handle), count_nodes(context, distance, handle),
+                  sum_values(context, distance, context.id, handle), collect_or(context, distance, source, handle),
+                  elect_leader(context, 2.0, distances, handle), counter(handle))
+        # the leader is a plain id either way
+        assert all(isinstance(value, STATES) != handle for value in values[:5] + values[6:])
+        return tuple(value.value if isinstance(value, STATES) else value for value in values)
+    return program
+
+
+def run(program):
+    random.seed(3)
+    simulator = Simulator()
+    simulator.environment.set_neighborhood_function(radius_neighborhood(1.5))
+    deformed_lattice(simulator, 5, 5, 1.0, 0.2)
+    for node in simulator.environment.node_list():
+        node.data = {"source": node.id == 0}
+    simulator.schedule_rounds(program, 1.0, synchronous=True)
+    simulator.run(15.5)
+    return {id: (node.data["result"], node.data["messages"], dict(node.data["state"]))
+            for id, node in simulator.environment.nodes.items()}
+
+
+def test_libraries_with_handles_match_libraries_with_states():
+    assert run(libraries(True)) == run(libraries(False))
+
+
+@pytest.mark.parametrize("handle", [True, False])
+def test_handles_and_states_store_the_same_values(handle):
+    engine = MutableEngine()
+    with use_engine(engine):
+        engine.setup({}, 0)
+        state = remember(1, handle=handle)
+        assert isinstance(state, StateHandle if handle else State)
+        updated = state.update(2)
+        assert updated == 2 and state.value == 2
+        assert type(updated) is int if handle else updated is state
+        state.update_fn(lambda value: value * 10)
+        assert state.value == 20 and dict(engine.state) == {str(["remember@0"]): 20}
+        # a state is copied and pickled as its value
+        assert pickle.loads(pickle.dumps((state, 1))) == (20, 1)
+        state.forget()
+        assert state.value is None and dict(engine.state) == {}
+
+
+def test_states_given_to_updates_are_stored_as_their_values():
+    engine = MutableEngine()
+    with use_engine(engine):
+        engine.setup({}, 0)
+        first, second = remember(1), remember(5, handle=True)
+        second.update(first)
+        first.update(second)
+        assert [type(value) for value in engine.state.values()] == [int, int]
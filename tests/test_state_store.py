@@ -0,0 +1,107 @@
+import pickle
+import random
+
+import pytest
+
+from fieldpy.calculus import aggregate, neighbors, remember, use_engine
+from fieldpy.internal import CHUNK_SIZE, MutableEngine, PersistentStateStore, StateStore
+from fieldpy.simulator import Simulator
+from fieldpy.simulator.events import register_action
+from fieldpy.simulator.neighborhood import radius_neighborhood
+from fieldpy.simulator.runner import run_round
+
+
+@pytest.mark.parametrize("seed", range(4))
+def test_persistent_stores_match_plain_stores(seed):
+    rng = random.Random(seed)
+    # enough keys for the chunks of the persistent store to grow
+    keys = [str(["program@0", "remember@%d" % index]) for index in range(4 * CHUNK_SIZE)]
+    plain, persistent = StateStore(), PersistentStateStore()
+    for _ in range(3000):
+        operation = rng.choice(["read", "init", "write", "write", "forget", "collect", "rollback"])
+        key, value = rng.choice(keys[:rng.choice([8, len(keys)])]), rng.randrange(100)
+        if operation == "read":
+            assert plain.read(key) == persistent.read(key)
+        elif operation == "init":
+            assert plain.init(key, value) == persistent.init(key, value)
+        elif operation == "write":
+            plain.write(key, value)
+            persistent.write(key, value)
+        else:
+            getattr(plain, operation)(*([key] if operation == "forget" else []))
+            getattr(persistent, operation)(*([key] if operation == "forget" else []))
+        assert dict(plain) == dict(persistent) and len(plain) == len(persistent)
+
+
+def test_snapshots_keep_their_version_and_share_the_unchanged_chunks():
+    store = PersistentStateStore({"key%d" % index: index for index in range(4 * CHUNK_SIZE)})
+    first = store.snapshot()
+    store["key0"] = -1
+    assert first["key0"] == 0 and store["key0"] == -1
+    changed = hash("key0") & store.mask
+    assert all((chunk is store.chunks[index]) != (index == changed) for index, chunk in enumerate(first.chunks))
+    # growing the store leaves the snapshots as they were
+    for index in range(4 * CHUNK_SIZE, 16 * CHUNK_SIZE):
+        store["key%d" % index] = index
+    assert len(first) == 4 * CHUNK_SIZE and dict(first) == {"key%d" % index: index for index in range(4 * CHUNK_SIZE)}
+    store.restore(first)
+    assert dict(store) == dict(first)
+    store["key1"] = -1
+    assert first["key1"] == 1
+
+
+def test_rollback_goes_back_to_the_last_collected_version():
+    store = PersistentStateStore({"a": 1, "b": 2})
+    store.read("a")
+    store.write("b", 3)
+    store.read("b")
+    store.collect()
+    store.write("a", 10)
+    store.write("c", 4)
+    store.forget("b")
+    store.rollback()
+    assert dict(store) == {"a": 1, "b": 3}
+    assert pickle.loads(pickle.dumps(store)) == store
+
+
+@aggregate
+def sometimes_failing(context, rng):
+    # a varying number of slots, some of them written before the round fails
+    total = 0
+    for index in range(rng.randrange(1, 6)):
+        slot = remember(index)
+        total += slot.update(slot + neighbors(1).sum())
+        if rng.random() < 0.05:
+            raise RuntimeError("failed round")
+    return total
+
+
+@register_action
+def failing_rounds(simulator, rng, history):
+    for node in simulator.environment.node_list():
+        messages = {neighbor.id: neighbor.data.get("messages", {})
+                    for neighbor in simulator.environment.get_neighbors(node)}
+        try:
+            run_round(node, messages, lambda context: sometimes_failing(context, rng))
+        except RuntimeError:
+            pass
+    history.append({node.id: (node.data.get("result"), dict(node.data.get("state", {})))
+                    for node in simulator.environment.node_list()})
+    simulator.schedule_event(1.0, failing_rounds, simulator, rng, history)
+
+
+def test_persistent_engines_match_plain_engines():
+    def history(engine):
+        simulator = Simulator()
+        simulator.environment.set_neighborhood_function(radius_neighborhood(1.1))
+        for id in range(6):
+            simulator.environment.create_node((float(id), 0.0), {}, id)
+        rounds = []
+        simulator.schedule_event(0.0, failing_rounds, simulator, random.Random(3), rounds)
+        with use_engine(engine):
+            simulator.run(30.0)
+        return rounds
+
+    persistent = MutableEngine(persistent=True)
+    assert history(persistent) == history(MutableEngine())
+    assert isinstance(persistent.state, PersistentStateStore)
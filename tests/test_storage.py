@@ -0,0 +1,75 @@
+import pytest
+
+from fieldpy.calculus import aggregate, neighbors_distances
+from fieldpy.libraries.diffusion import distance_to
+from fieldpy.simulator import Environment, Simulator
+from fieldpy.simulator.neighborhood import radius_neighborhood
+from fieldpy.simulator.storage import NodeArrays
+
+
+@aggregate
+def gradient(context):
+    return distance_to(context.data["source"], neighbors_distances(context.position)).value
+
+
+def grid(arrays=None):
+    simulator = Simulator()
+    simulator.environment = Environment(radius_neighborhood(1.5), arrays=arrays)
+    for id in range(36):
+        simulator.environment.create_node((float(id % 6), float(id // 6)), {"source": id == 0}, id)
+    return simulator
+
+
+def results(simulator):
+    return {id: node.data["result"] for id, node in simulator.environment.nodes.items()}
+
+
+def test_array_nodes_match_plain_nodes():
+    plain, stored = grid(), grid(NodeArrays(columns={"source": bool}, capacity=4))
+    for simulator in (plain, stored):
+        simulator.schedule_rounds(gradient, 1.0, synchronous=True)
+        simulator.run(3.5)
+        for id in (7, 20):
+            simulator.environment.nodes[id].update((2.5, 2.5))
+        simulator.environment.remove_node(14)
+        simulator.run(12.5)
+    assert results(stored) == results(plain)
+    assert stored.environment.nodes[7].position == (2.5, 2.5)
+    # the arrays grew from their initial capacity
+    assert stored.environment.arrays.size == 36
+
+
+def test_row_data_is_a_mapping_over_the_columns_and_the_other_keys():
+    arrays = NodeArrays(columns={"temperature": float})
+    node = arrays.create_node((0.0, 1.0), {"temperature": 21.5, "name": "a"})
+    assert dict(node.data) == {"temperature": 21.5, "name": "a"}
+    node.data["temperature"] += 1.0
+    assert arrays.columns["temperature"][node.id] == 22.5
+    with pytest.raises(KeyError):
+        del node.data["temperature"]
+    del node.data["name"]
+    assert "name" not in node.data and len(node.data) == 1
+    # replacing the data resets the columns
+    node.data = {"other": True}
+    assert dict(node.data) == {"temperature": 0.0, "other": True}
+
+
+def test_ids_are_dense_and_never_reused():
+    environment = Environment(arrays=NodeArrays())
+    first = environment.create_node((0.0, 0.0), {"name": "first"})
+    second = environment.create_node((1.0, 0.0))
+    assert (first.id, second.id) == (0, 1)
+    with pytest.raises(ValueError):
+        environment.create_node((2.0, 0.0), None, 5)
+    environment.remove_node(first.id)
+    assert environment.create_node((2.0, 0.0)).id == 2
+    assert environment.arrays.extra[0] is None
+
+
+def test_position_writes_are_seen_by_the_environment():
+    environment = Environment(radius_neighborhood(1.1), arrays=NodeArrays())
+    nodes = [environment.create_node((float(id), 0.0)) for id in range(3)]
+    assert nodes[0].get_neighbors() == [nodes[1]]
+    nodes[2].position = (0.5, 0.0)
+    assert nodes[2].position == (0.5, 0.0)
+    assert sorted(node.id for node in nodes[0].get_neighbors()) == [1, 2]
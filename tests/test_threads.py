@@ -0,0 +1,135 @@
+import asyncio
+import io
+import random
+import threading
+import time
+
+import fieldpy
+from fieldpy import calculus
+from fieldpy.calculus import aggregate, compiled, current_engine, neighbors_distances, profiling, use_engine
+from fieldpy.internal import MutableEngine
+from fieldpy.libraries.diffusion import distance_to
+from fieldpy.profiling import Profiler
+from fieldpy.simulator import Simulator, checkpoint
+from fieldpy.simulator.deployments import deformed_lattice
+from fieldpy.simulator.neighborhood import radius_neighborhood
+from fieldpy.simulator.runner import ThreadedRounds, threaded_program_runner
+
+
+@aggregate
+def gradient(context):
+    return distance_to(context.data["source"], neighbors_distances(context.position))
+
+
+def lattice(side=8):
+    random.seed(1)
+    simulator = Simulator()
+    deformed_lattice(simulator, side, side, 1.0, 0.2)
+    simulator.environment.set_neighborhood_function(radius_neighborhood(1.6))
+    for node in simulator.environment.node_list():
+        node.data = {"source": node.id == 0}
+    return simulator
+
+
+def results(simulator):
+    return [node.data.get("result") for node in simulator.environment.node_list()]
+
+
+def sequential(until=10.5):
+    simulator = lattice()
+    simulator.schedule_rounds(gradient, 1.0, synchronous=True)
+    simulator.run(until)
+    return results(simulator)
+
+
+def test_threaded_rounds_match_sequential_rounds():
+    for program in (gradient, compiled(gradient)):
+        with ThreadedRounds(workers=3) as threads:
+            simulator = lattice()
+            simulator.schedule_event(0.0, threaded_program_runner, simulator, 1.0, program, threads=threads)
+            simulator.run(10.5)
+        assert results(simulator) == sequential()
+    assert current_engine.get() is fieldpy.engine
+
+
+def test_closing_the_rounds_stops_their_threads():
+    threads = ThreadedRounds(workers=2)
+    simulator = lattice()
+    simulator.schedule_event(0.0, threaded_program_runner, simulator, 1.0, gradient, threads=threads)
+    simulator.run(2.5)
+    assert any(thread.name.startswith("fieldpy-round") for thread in threading.enumerate())
+    threads.close()
+    assert not any(thread.name.startswith("fieldpy-round") for thread in threading.enumerate())
+
+
+def test_threaded_rounds_are_checkpointed_without_their_threads():
+    simulator = lattice()
+    simulator.schedule_event(0.0, threaded_program_runner, simulator, 1.0, gradient, 2)
+    simulator.run(5.5)
+    stream = io.BytesIO()
+    checkpoint.save(simulator, stream)
+    stream.seek(0)
+    restored = checkpoint.load(stream)
+    restored.run(10.5)
+    assert results(restored) == sequential()
+
+
+def test_use_engine_only_affects_the_current_thread():
+    stop = threading.Event()
+    seen = []
+    engine = MutableEngine()
+
+    def hold():
+        with use_engine(engine):
+            while not stop.is_set():
+                seen.append(current_engine.get() is engine)
+                time.sleep(0.001)
+
+    holder = threading.Thread(target=hold)
+    holder.start()
+    try:
+        simulator = lattice()
+        simulator.schedule_event(0.0, threaded_program_runner, simulator, 1.0, gradient, 3)
+        simulator.run(10.5)
+    finally:
+        stop.set()
+        holder.join()
+    assert seen and all(seen)
+    assert results(simulator) == sequential()
+    assert current_engine.get() is fieldpy.engine
+
+
+def test_use_engine_is_local_to_asyncio_tasks():
+    async def task():
+        with use_engine(MutableEngine()):
+            simulator = lattice(5)
+            simulator.schedule_rounds(gradient, 1.0, synchronous=True)
+            for round in range(8):
+                simulator.run(round + 0.5)
+                await asyncio.sleep(0)
+            return results(simulator)
+
+    async def main():
+        return await asyncio.gather(*[task() for _ in range(4)])
+
+    reference = lattice(5)
+    reference.schedule_rounds(gradient, 1.0, synchronous=True)
+    reference.run(7.5)
+    assert all(result == results(reference) for result in asyncio.run(main()))
+
+
+def test_profiling_threaded_rounds_counts_every_call():
+    profiles = []
+    for schedule in (lambda s: s.schedule_rounds(gradient, 1.0, synchronous=True),
+                     lambda s: s.schedule_event(0.0, threaded_program_runner, s, 1.0, gradient, 3)):
+        simulator = lattice()
+        schedule(simulator)
+        with profiling(Profiler()) as profiler:
+            simulator.run(5.5)
+        profiles.append(profiler)
+    sequential_profile, threaded_profile = profiles
+    assert len(threaded_profile.latencies) == len(sequential_profile.latencies) == 6 * 64
+    assert {name: calls[0] for name, calls in threaded_profile.functions.items()} == \
+        {name: calls[0] for name, calls in sequential_profile.functions.items()}
+    assert set(threaded_profile.stacks) == set(sequential_profile.stacks)
+    assert calculus.profiler is None
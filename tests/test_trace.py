@@ -0,0 +1,98 @@
+import os
+
+import numpy as np
+import pytest
+
+from fieldpy.simulator import Simulator
+from fieldpy.simulator.events import register_action
+from fieldpy.simulator.trace import TraceReader, TraceRecorder, trace_runner
+
+
+@register_action
+def sensing_runner(simulator, observed):
+    # every node senses the time, node 2 only at even times; node 3 leaves and node 9 joins at time 5
+    now = simulator.current_time
+    environment = simulator.environment
+    if now == 5.0:
+        environment.remove_node(3)
+        environment.create_node((9.0, 0.0), {}, 9)
+    for node in environment.node_list():
+        node.data["result"] = None if node.id == 2 and now % 2 else now * 10 + node.id
+        node.position = (node.position[0], now)
+    observed[now] = {node.id: (node.position, node.data["result"]) for node in environment.node_list()}
+    simulator.schedule_event(1.0, sensing_runner, simulator, observed)
+
+
+def run(directory, until=12.5, **options):
+    simulator = Simulator()
+    for id in range(5):
+        simulator.environment.create_node((float(id), 0.0), {}, id)
+    observed = {}
+    recorder = TraceRecorder(directory, **options)
+    simulator.schedule_event(0.0, sensing_runner, simulator, observed)
+    simulator.schedule_event(0.0, trace_runner, simulator, 1.0, recorder)
+    simulator.run(until)
+    recorder.close()
+    return observed
+
+
+def test_snapshots_match_the_nodes_at_every_recorded_time(tmp_path):
+    observed = run(str(tmp_path), every=2, chunk_size=2)
+    reader = TraceReader(str(tmp_path))
+    assert reader.times.tolist() == [0.0, 2.0, 4.0, 6.0, 8.0, 10.0, 12.0]
+    for snapshot in reader.between(0.0, 12.0):
+        nodes = observed[snapshot["time"]]
+        assert snapshot["id"].tolist() == list(nodes)
+        assert [tuple(position) for position in snapshot["position"].tolist()] == [nodes[id][0] for id in nodes]
+        assert "result.mask" not in snapshot
+        assert snapshot["result"].tolist() == [nodes[id][1] for id in nodes]
+    assert [snapshot["time"] for snapshot in reader.between(3.0, 8.0)] == [4.0, 6.0, 8.0]
+
+
+def test_histories_skip_the_masked_entries(tmp_path):
+    observed = run(str(tmp_path), chunk_size=4)
+    reader = TraceReader(str(tmp_path))
+    times, values = reader.history(2)
+    assert times.tolist() == [float(time) for time in range(0, 13, 2)]
+    assert values.tolist() == [time * 10 + 2 for time in range(0, 13, 2)]
+    assert reader.snapshot(1)["result.mask"].tolist() == [True, True, False, True, True]
+    assert reader.history(3)[0].tolist() == [0.0, 1.0, 2.0, 3.0, 4.0]
+    assert reader.history(9)[1].tolist() == [observed[float(time)][9][1] for time in range(5, 13)]
+    assert reader.history(42)[0].tolist() == []
+
+
+def test_a_partly_written_index_record_is_ignored(tmp_path):
+    run(str(tmp_path), chunk_size=4)
+    with open(os.path.join(str(tmp_path), "index.bin"), "ab") as index:
+        index.write(b"\0" * 10)
+    reader = TraceReader(str(tmp_path))
+    assert len(reader) == 13 and reader.times[-1] == 12.0
+
+
+def test_a_chunk_that_cannot_be_stored_is_dropped(tmp_path):
+    simulator = Simulator()
+    node = simulator.environment.create_node((0.0, 0.0), {"result": {"not": "a number"}}, 0)
+    recorder = TraceRecorder(str(tmp_path), chunk_size=2)
+    recorder.record(0.0, simulator.environment)
+    with pytest.raises(TypeError, match="dropped"):
+        recorder.record(1.0, simulator.environment)
+    node.data["result"] = 1.5
+    recorder.record(2.0, simulator.environment)
+    recorder.close()
+    reader = TraceReader(str(tmp_path))
+    assert reader.times.tolist() == [2.0]
+    assert reader.snapshot(0)["result"].tolist() == [1.5]
+    with pytest.raises(FileExistsError):
+        TraceRecorder(str(tmp_path))
+
+
+def test_memory_holds_at_most_one_chunk(tmp_path):
+    simulator = Simulator()
+    for id in range(10):
+        simulator.environment.create_node((float(id), 0.0), {"result": np.float64(id)}, id)
+    recorder = TraceRecorder(str(tmp_path), chunk_size=3)
+    for time in range(100):
+        recorder.record(float(time), simulator.environment)
+        assert len(recorder.times) < 3 and len(recorder.ids) < 30
+    recorder.close()
+    assert len(TraceReader(str(tmp_path))) == 100
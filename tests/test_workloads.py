@@ -0,0 +1,23 @@
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+
+
+def test_workloads_report_every_case_as_json(tmp_path):
+    output = tmp_path / "results.json"
+    environment = dict(os.environ, PYTHONPATH=os.path.join(ROOT, "src"))
+    subprocess.run([sys.executable, os.path.join(ROOT, "benchmarks", "workloads.py"), "--nodes", "16", "36",
+                    "--rounds", "40", "--neighborhoods", "radius", "knn", "--in-process", "--output", str(output)],
+                   check=True, env=environment, capture_output=True)
+    report = json.loads(output.read_text())
+    assert set(report["meta"]) == {"commit", "python", "platform", "time"}
+    results = report["results"]
+    assert len(results) == 4 * 2 * 2
+    for result in results:
+        assert result["deployed_nodes"] >= result["nodes"]
+        assert result["rounds_per_second"] > 0 and result["node_round_us"] > 0
+        # small networks settle well within the rounds
+        assert result["rounds_to_convergence"] is not None and result["rounds_to_convergence"] < 40